@@ -1,119 +1,925 @@
+import asyncio
+import glob
+import hashlib
+import hmac
+import json
+import multiprocessing
 import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import ExitStack
 from datetime import datetime
-from shutil import copy2
-from typing import List
+from functools import partial
+from typing import List, Optional, AsyncIterator, Callable, Iterator
 
 import pyzipper
 
+from core.checkpoint import ArchiveCheckpoint
+from core.command import CommandReader
+from core.compression import CompressionTuner
+from core.crypto import EncryptedStreamWriter
+from core.destination import DestinationBackend, LocalBackend, SSHBackend, S3Backend
+from core.fingerprint import HashCache, tree_fingerprint
+from core.governor import ResourceGovernor
+from core.mirror import Mirror
+from core.prefetch import Prefetcher
+from core.progress import ProgressReporter, scan_totals
+from core.readahead import ReadAhead
+from core.reader import LargeFileReader
+from core.remote import RemoteScanner, RemoteEntry, RangedReader
+from core.repository import Repository, RepositoryWriter
+from core.s3 import S3Client
+from core.scanner import ParallelScanner
+from core.shard import ShardSet, init_worker, write_shard
 from core.ssh import SSHConnection
-from core.type import Archive, SSHInfo
-from misc.utils import LOGGER
+from core.staging import StagingArea, StagingLease, AdmissionController
+from core.state import StateStore
+from core.storage import Storage, LocalStorage, SFTPStorage, S3Storage
+from core.transfer import LocalTransfer
+from core.type import Archive, SSHInfo, ArchiveDestination, TransferInfo, GovernorInfo, ProgressInfo, BackupEvent, StagingInfo, S3Info
+from core.verify import VersionVerifier
+from core.volume import VolumeWriter, Volume, TransferQueue
+from core.zipwriter import StreamingZipFile
+from misc.utils import LOGGER, VaultBackupException, BackupCancelled, file_checksum
 
 
 class BackupExecutor:
-    def __init__(self, force: bool, require_ssh: bool, ssh: SSHInfo):
+    TRANSFER_RETRIES = 3
+    READ_SIZE = 1024 * 1024
+
+    def __init__(self, force: bool, require_ssh: bool, ssh: SSHInfo, transfer: Optional[TransferInfo] = None, governor: Optional[GovernorInfo] = None,
+                 progress: Optional[ProgressInfo] = None, state: Optional[StateStore] = None, version_time: Optional[datetime] = None,
+                 staging: Optional[StagingInfo] = None, s3: Optional[S3Info] = None):
         self.__force = force
+        self.__version_time = version_time
         self.__ssh = SSHConnection(ssh) if require_ssh else None
+        self.__s3_info = s3
+        self.__s3 = S3Client(s3.endpoint, s3.region, s3.access_key, s3.get_secret_key()) if s3 is not None else None
+        self.__backends = {}
+        self.__local_transfer = LocalTransfer(transfer)
+        self.__governor = ResourceGovernor(governor)
+        self.__governor.apply_priority()
+        self.__progress = ProgressReporter(progress)
+        self.__state = state
+        self.__staging = staging if staging is not None else StagingInfo()
+        self.__checksums = {}
+        self.__throughput = {}
+        self.__throughput_lock = threading.Lock()
+        # Destinations whose transfer failed in the current run, and the commit of the file completing a version
+        self.__failed = {}
+        self.__commits = {}
+        self.__hash_cache: Optional[HashCache] = None
+        self.__content_changed = False
+        self.__cancel = threading.Event()
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+        self.__events: asyncio.Queue = asyncio.Queue()
+        self.__current_archive: Optional[Archive] = None
+        self.__remote_entries: Optional[List[RemoteEntry]] = None
+        self.__totals: Optional[tuple] = None
+        self.__progress.listener = self.__on_progress
+
+    @classmethod
+    async def create(cls, *args, **kwargs) -> 'BackupExecutor':
+        """Builds an executor without blocking the event loop (it may open the SSH connection)"""
+        return await asyncio.get_running_loop().run_in_executor(None, partial(cls, *args, **kwargs))
+
+    async def run(self, archives: List[Archive]) -> None:
+        """Runs `execute` in a worker thread and streams its events to `events`.
+
+        Cancelling the task awaiting it cancels the backup: the worker stops at its next check, removes the partial
+        archive and the partially transferred files, and only then the cancellation is propagated.
+        """
+        self.__loop = asyncio.get_running_loop()
+        self.__cancel.clear()
+        future = self.__loop.run_in_executor(None, self.execute, archives)
+        try:
+            await asyncio.shield(future)
+        except asyncio.CancelledError:
+            self.cancel()
+            try:
+                await future
+            except BackupCancelled:
+                pass
+            raise
+        finally:
+            self.__events.put_nowait(None)
+            self.__loop = None
+
+    async def events(self) -> AsyncIterator[BackupEvent]:
+        """Events of the current `run`, until it ends"""
+        while True:
+            event = await self.__events.get()
+            if event is None:
+                return
+            yield event
+
+    def cancel(self) -> None:
+        """Asks a running backup to stop. Safe to call from any thread"""
+        self.__cancel.set()
 
     def execute(self, archives: List[Archive]):
         for archive in archives:
-            start_time = datetime.now()
-            LOGGER.info(f"Execution started for\n{archive.display()}")
-            is_eligible = self._get_eligible_destinations(archive)
-            eligible_indexes = list(filter(lambda x: is_eligible[x], range(0, len(archive.destinations))))
-            allow_execution = True in is_eligible
-            LOGGER.debug(f"Allow execution: {allow_execution}")
-            if allow_execution:
+            self.__check_cancelled()
+            self.__current_archive = archive
+            self.__emit(BackupEvent.STARTED, archive)
+            try:
+                self.__execute_archive(archive)
+            except BackupCancelled:
+                LOGGER.warning(f"Backup of '{archive.name}' was cancelled")
+                self.__emit(BackupEvent.CANCELLED, archive)
+                raise
+            except Exception as e:
+                self.__emit(BackupEvent.FAILED, archive, {"error": str(e)})
+                raise
+            self.__emit(BackupEvent.FINISHED, archive, {"destinations": {x.label: x.last_run.isoformat() for x in archive.destinations}})
+
+    def verify(self, archives: List[Archive], sample: int) -> bool:
+        """Checks every retained version of every archive destination, reading only its central directory and `sample`
+        members. Results are stored in the state. True if every version passed"""
+        passed = True
+        for archive in archives:
+            if archive.format != Archive.ZIP_FORMAT:
+                LOGGER.info(f"Skipping verification of '{archive.name}': repository chunks are verified whenever they are read")
+                continue
+            for dst in filter(lambda x: x.type == ArchiveDestination.ARCHIVE_TYPE, archive.destinations):
+                storage = self.__open_storage(dst, dst.path)
+                verifier = VersionVerifier(storage, archive.get_password(), sample)
+                results = {}
+                for version, names in sorted(VersionVerifier.versions(archive.get_version_prefix(), storage.list()).items()):
+                    self.__check_cancelled()
+                    result = verifier.verify(names)
+                    results[version] = result
+                    cost = "{} of {} bytes read in {:.1f}s".format(result["bytes_read"], result["size"], result["seconds"])
+                    if result["ok"]:
+                        LOGGER.info(f"[{dst.label}] {version} verified, {result['sampled']} of {result['members']} members checked, {cost}")
+                    else:
+                        LOGGER.error(f"[{dst.label}] {version} failed verification: {result['error']}, {cost}")
+                        passed = False
+                if self.__state is not None:
+                    self.__state.commit_verification(archive, dst, results)
+        return passed
+
+    def __execute_archive(self, archive: Archive) -> None:
+        # Hosts sharing a sharded version are given the same version time
+        start_time = self.__version_time if self.__version_time is not None else datetime.now()
+        if archive.shard_host[1] > 1 and self.__version_time is None:
+            raise VaultBackupException(f"Archive '{archive.name}' is sharded across hosts, every host must be given the same version (-Dversion).")
+        LOGGER.info(f"Execution started for\n{archive.display()}")
+        if self.__state is not None:
+            self.__state.restore(archive)
+        # Each run of an archive is a new version, with its own files and checksums
+        archive.reset_archive_path()
+        self.__checksums = {}
+        self.__remote_entries, self.__totals = None, None
+        is_eligible = self._get_eligible_destinations(archive)
+        fingerprint = None
+        self.__hash_cache, self.__content_changed = None, False
+        if archive.verify_content and True in is_eligible:
+            fingerprint = self._get_fingerprint(archive)
+        elif archive.probe is not None and True in is_eligible:
+            fingerprint = self._probe(archive)
+        if fingerprint is not None and not self.__force:
+            self._skip_unchanged_content(archive, is_eligible, fingerprint, start_time)
+        eligible_indexes = list(filter(lambda x: is_eligible[x], range(0, len(archive.destinations))))
+        mirror_indexes = [x for x in eligible_indexes if archive.destinations[x].type == ArchiveDestination.MIRROR_TYPE]
+        if len(mirror_indexes) > 0:
+            self._do_mirrors(archive, start_time, fingerprint, mirror_indexes)
+            self._clean_mirrors(archive)
+        eligible_indexes = [x for x in eligible_indexes if x not in mirror_indexes]
+        allow_execution = len(eligible_indexes) > 0
+        LOGGER.debug(f"Allow execution: {allow_execution}")
+        if allow_execution and archive.format == Archive.REPOSITORY_FORMAT:
+            self._do_repository(archive, start_time, eligible_indexes)
+            self._commit_destinations(archive, start_time, fingerprint, eligible_indexes, archive.get_snapshot_name(start_time), None)
+            self._clean_repositories(archive)
+        elif allow_execution and archive.shards is not None:
+            with self._stage(archive):
+                transfers = TransferQueue(archive.parallel_uploads, partial(self._copy_file, archive, eligible_indexes))
+                with self.__throughput_lock:
+                    self.__throughput, self.__failed, self.__commits = {}, {}, {}
                 try:
-                    self._do_archive(archive, start_time)
-                    self._copy_archive(archive, eligible_indexes)
+                    self._do_shards(archive, start_time, transfers, partial(self._commit_destination, archive, start_time, fingerprint))
+                    self._commit_destinations(archive, start_time, fingerprint, eligible_indexes)
+                    self.__check_failed_destinations()
                     self._clean_archives(archive)
-                    for dst in archive.destinations:
-                        dst.last_run = start_time
                 finally:
+                    transfers.close()
                     self._delete_archive(archive)
+        elif allow_execution:
+            with self._stage(archive):
+                transfers = TransferQueue(archive.parallel_uploads, partial(self._copy_file, archive, eligible_indexes))
+                tuner = self._get_compression_tuner(archive, eligible_indexes)
+                checkpoint = self._get_checkpoint(archive, start_time)
+                if checkpoint is not None:
+                    # A resumed archive keeps the name and the start time of the run that began it
+                    start_time = checkpoint.start_time
+                with self.__throughput_lock:
+                    self.__throughput, self.__failed, self.__commits = {}, {}, {}
+                keep_partial = False
+                try:
+                    archive_start = time.perf_counter()
+                    self._do_archive(archive, start_time, transfers, tuner, checkpoint)
+                    archive_seconds = time.perf_counter() - archive_start
+                    if self.__content_changed:
+                        # The archive does not match the fingerprint, so the next run must not skip on it
+                        fingerprint = None
+                    self._copy_archive(archive, transfers, partial(self._commit_destination, archive, start_time, fingerprint))
+                    if tuner is not None:
+                        LOGGER.info(tuner.report(archive_seconds, self.__get_upload_seconds()))
+                    self._commit_destinations(archive, start_time, fingerprint, eligible_indexes)
+                    self.__check_failed_destinations()
+                    self._clean_archives(archive)
+                except BackupCancelled:
+                    raise
+                except Exception:
+                    # The checkpoint only exists while the archive is incomplete
+                    keep_partial = checkpoint is not None and os.path.isfile(checkpoint.path)
+                    raise
+                finally:
+                    transfers.close()
+                    if keep_partial:
+                        LOGGER.warning(f"Partial archive kept, the next run resumes it: {archive.get_archive_path()}")
+                    else:
+                        self._delete_archive(archive)
 
     def _get_eligible_destinations(self, archive: Archive) -> list:
         LOGGER.debug("Getting eligible destinations")
-        if self.__force:
+        if self.__force or archive.command is not None:
+            # The output of a command has no modification time, only its probe can tell it did not change
             return [True] * len(archive.destinations)
 
         destinations_num = len(archive.destinations)
         is_eligible = [False] * destinations_num
-        last_run = [i.last_run for i in archive.destinations]
-
-        for crt_path, dirs, files in os.walk(os.path.abspath(archive.path)):
-            crt_list = files
-            crt_list.extend(dirs)
-            for elem in crt_list:
-                for index in range(0, destinations_num):
-                    if is_eligible[index] is not True and datetime.fromtimestamp(os.path.getmtime(os.path.join(crt_path, elem))) >= last_run[index]:
-                        is_eligible[index] = True
-                if is_eligible.count(True) == destinations_num:
-                    return is_eligible
+        # Compared as timestamps, so no datetime is built per entry
+        last_run = [i.last_run.timestamp() for i in archive.destinations]
+        oldest_run = min(last_run)
+
+        for mtime in self.__get_mtimes(archive):
+            if mtime < oldest_run:
+                continue
+            for index in range(0, destinations_num):
+                if is_eligible[index] is not True and mtime >= last_run[index]:
+                    is_eligible[index] = True
+            if is_eligible.count(True) == destinations_num:
+                return is_eligible
         return is_eligible
 
+    def __get_mtimes(self, archive: Archive) -> Iterator[float]:
+        """Modification times of the entries of the source, from a single listing of the host for remote sources"""
+        if archive.remote:
+            yield from (x.mtime for x in self.__get_remote_entries(archive))
+            return
+        for crt_path, dirs, files in ParallelScanner(archive.scan_threads).walk(os.path.abspath(archive.path)):
+            yield from (x.stat().st_mtime for x in files + dirs)
+
+    def __get_remote_entries(self, archive: Archive) -> List[RemoteEntry]:
+        """Listing of a remote source, made once per run: it serves both the eligibility and the archive"""
+        if self.__remote_entries is None:
+            self.__remote_entries = RemoteScanner(partial(self.__ssh.stream, ok_status=RemoteScanner.OK_STATUS)).scan(archive.path)
+        return self.__remote_entries
+
+    def _get_fingerprint(self, archive: Archive) -> str:
+        LOGGER.debug("Computing content fingerprint")
+        cache = HashCache(archive.get_cache_path(), self.__throttle_read, self.__governor.release)
+        fingerprint = tree_fingerprint(archive.path, cache)
+        cache.save()
+        self.__hash_cache = cache
+        LOGGER.info(f"Content fingerprint: {fingerprint} ({cache.hashed} files hashed, {cache.reused} from cache)")
+        return fingerprint
+
     # noinspection PyMethodMayBeStatic
-    def _do_archive(self, archive: Archive, start_time: datetime) -> None:
+    def _probe(self, archive: Archive) -> Optional[str]:
+        """Fingerprint of a command source, from the output of its probe. None if the probe fails, so nothing is skipped"""
+        LOGGER.debug(f"Running probe: {archive.probe}")
+        try:
+            fingerprint = CommandReader.probe(archive.probe, archive.path)
+        except VaultBackupException as e:
+            LOGGER.warning(f"{e}, the source is considered changed")
+            return None
+        LOGGER.info(f"Probe fingerprint: {fingerprint}")
+        return fingerprint
+
+    def _skip_unchanged_content(self, archive: Archive, is_eligible: list, fingerprint: str, start_time: datetime) -> None:
+        """Destinations whose last version has the same content are not eligible, only their last run is moved"""
+        for index, dst in enumerate(archive.destinations):
+            if is_eligible[index] and dst.fingerprint == fingerprint:
+                LOGGER.info(f"[{dst.label}] Content did not change since the last version, skipping")
+                is_eligible[index] = False
+                dst.last_run = start_time
+                if self.__state is not None:
+                    self.__state.commit(archive, dst)
+
+    def _commit_destinations(self, archive: Archive, start_time: datetime, fingerprint: Optional[str], eligible_indexes: list,
+                             name: Optional[str] = None, checksum: Optional[str] = None) -> None:
+        """Moves the last run of every destination and persists the state of each one. Eligible destinations are only
+        committed here with a `name`, when the version is written to all of them at once; transferred versions commit
+        each destination as soon as it has the version (see _commit_destination)"""
+        for index, dst in enumerate(archive.destinations):
+            if index not in eligible_indexes:
+                self._commit_destination(archive, start_time, fingerprint, dst)
+            elif name is not None:
+                dst.last_run = start_time
+                dst.fingerprint = fingerprint
+                if self.__state is not None:
+                    self.__state.commit(archive, dst, name, checksum, throughput=self.__get_throughput(dst.label))
+
+    def _commit_destination(self, archive: Archive, start_time: datetime, fingerprint: Optional[str], dst: ArchiveDestination,
+                            path: Optional[str] = None) -> None:
+        """Moves the last run of a destination and persists its state. `path` is the file completing the version at the
+        destination (the archive, or the manifest of its volumes or shards), which identifies the version"""
+        dst.last_run = start_time
+        dst.fingerprint = fingerprint
+        if self.__state is None:
+            return
+        if path is None:
+            self.__state.commit(archive, dst)
+        else:
+            self.__state.commit(archive, dst, os.path.basename(path), self.__get_checksum(path), throughput=self.__get_throughput(dst.label))
+
+    def __check_failed_destinations(self) -> None:
+        """Fails the run if a destination did not get the version, once the other destinations are committed"""
+        if len(self.__failed) > 0:
+            raise VaultBackupException("Transfer failed for " + ", ".join(f"[{dst.label}]: {e}" for dst, e in self.__failed.items()))
+
+    def _stage(self, archive: Archive) -> StagingLease:
+        """Leases room for the archive in a staging area, the one its checkpoint resumes in first, and stages it there"""
+        areas = [StagingArea(x, self.__staging.min_free) for x in (self.__staging.paths if len(self.__staging.paths) > 0 else [Archive.dir_path])]
+        checkpoint = ArchiveCheckpoint.load(archive.get_checkpoint_path())
+        preferred = os.path.dirname(checkpoint.archive_path) if checkpoint is not None else None
+        # The output of a command has no size until it is read
+        estimate = self.__get_source_totals(archive)[1] if archive.command is None else None
+        controller = AdmissionController(areas, self.__staging.max_archives, self.__check_cancelled)
+        lease = controller.admit(archive.get_version_prefix(), estimate, archive.get_checkpoint_path(), preferred)
+        archive.staging_dir = lease.area.path
+        return lease
+
+    def _get_compression_tuner(self, archive: Archive, eligible_indexes: list) -> Optional[CompressionTuner]:
+        """Tuner for "auto" compression, matched to the slowest eligible destination of the previous runs"""
+        if archive.compression != Archive.AUTO_COMPRESSION:
+            return None
+        throughputs = []
+        for index in eligible_indexes:
+            dst = archive.destinations[index]
+            throughput = self.__state.get(archive, dst).get("throughput") if self.__state is not None else None
+            if self.__governor.info.upload_rate is not None:
+                throughput = min(filter(None, [throughput, self.__governor.info.upload_rate]))
+            if throughput is not None:
+                throughputs.append(throughput)
+        throughput = min(throughputs) if len(throughputs) > 0 else None
+        LOGGER.debug(f"Automatic compression, upload throughput: {throughput}")
+        # Volumes are uploaded while the archive is still being written
+        return CompressionTuner(throughput, archive.volume_size is not None)
+
+    def _get_checkpoint(self, archive: Archive, start_time: datetime) -> Optional[ArchiveCheckpoint]:
+        """Checkpoint of the archive: the one of an interrupted run when it can be resumed, a new one otherwise"""
+        if archive.volume_size is not None or archive.encryption == Archive.STREAM_ENCRYPTION or archive.command is not None or archive.remote:
+            # Sealed volumes and encrypted streams cannot be reopened at an offset, the output of a command cannot be read again
+            # and the kept members of a remote source cannot be checked without a listing
+            LOGGER.debug("Archive creation is not checkpointed for volumes, stream encryption, command and remote sources")
+            return None
+        # Keyed by the password rather than hashing it, so the checkpoint in .cache does not hold a plain hash of it
+        settings = "\0".join(map(str, [archive.path, archive.encryption, archive.compression])).encode()
+        password = archive.get_password()
+        key = hmac.new(password.encode(), settings, hashlib.sha256).hexdigest() if password is not None else hashlib.sha256(settings).hexdigest()
+        checkpoint = ArchiveCheckpoint.load(archive.get_checkpoint_path())
+        if checkpoint is not None and checkpoint.key == key and os.path.isfile(checkpoint.archive_path) \
+                and os.path.getsize(checkpoint.archive_path) >= checkpoint.offset and archive.get_version_path(checkpoint.start_time) == checkpoint.archive_path:
+            checkpoint.resume(archive.path)
+            LOGGER.info(f"Resuming archive started at {checkpoint.start_time}: {len(checkpoint.members)} members, {checkpoint.offset} bytes kept")
+            return checkpoint
+        if checkpoint is not None:
+            LOGGER.info("Checkpoint of a previous archive does not match, archiving from the start")
+            if os.path.isfile(checkpoint.archive_path):
+                os.remove(checkpoint.archive_path)
+        checkpoint = ArchiveCheckpoint(archive.get_checkpoint_path())
+        checkpoint.start(archive.get_archive_path(start_time), start_time, key)
+        return checkpoint
+
+    def _do_archive(self, archive: Archive, start_time: datetime, transfers: Optional[TransferQueue] = None, tuner: Optional[CompressionTuner] = None,
+                    checkpoint: Optional[ArchiveCheckpoint] = None) -> None:
         LOGGER.info(f"Archiving local data to: {archive.get_archive_path(start_time)}")
-        with pyzipper.AESZipFile(
-                archive.get_archive_path(start_time), 'w',
-                compression=pyzipper.ZIP_DEFLATED
-        ) as zip_file:
-            if archive.get_password() is not None:
+        kept = checkpoint.names() if checkpoint is not None else set()
+        with ExitStack() as stack:
+            output = archive.get_archive_path()
+            if checkpoint is not None and checkpoint.offset > 0:
+                # The zip writer appends after the kept members, a passed file object is not closed by it
+                output = stack.enter_context(open(output, 'r+b'))
+                output.truncate(checkpoint.offset)
+                output.seek(checkpoint.offset)
+            if archive.volume_size is not None:
+                LOGGER.debug(f"Splitting archive in volumes of {archive.volume_size} bytes")
+                output = stack.enter_context(VolumeWriter(archive.get_archive_path(), archive.volume_size, partial(self.__on_volume_sealed, transfers)))
+            if archive.encryption == Archive.STREAM_ENCRYPTION:
+                if archive.get_password() is None:
+                    raise VaultBackupException(f"Archive '{archive.name}' uses stream encryption, but no password was provided.")
+                LOGGER.debug("Setting up stream encryption")
+                output = stack.enter_context(EncryptedStreamWriter(open(output, 'wb') if isinstance(output, str) else output, archive.get_password()))
+            level = archive.compression if isinstance(archive.compression, int) else None
+            zip_file = stack.enter_context(StreamingZipFile(output, 'w', compression=pyzipper.ZIP_DEFLATED, compresslevel=level, spill_dir=os.path.dirname(archive.get_archive_path())))
+            if archive.get_password() is not None and archive.encryption == Archive.ZIP_ENCRYPTION:
                 LOGGER.debug("Setting up password")
                 zip_file.encryption = pyzipper.WZ_AES
                 zip_file.pwd = archive.get_password().encode()
-            for crt_path, directories, files in os.walk(archive.path):
-                for directory in directories:
-                    abs_path = os.path.abspath(os.path.join(crt_path, directory))
-                    rel_path = os.path.relpath(abs_path, archive.path)
-                    LOGGER.debug(f"Writing Dir : {rel_path}")
-                    zip_file.write(abs_path, rel_path)
-                for file in files:
-                    abs_path = os.path.abspath(os.path.join(crt_path, file))
+            if len(kept) > 0:
+                checkpoint.restore(zip_file)
+            self.__progress.start("archive", *self.__get_totals(archive))
+            if archive.command is not None:
+                self.__write_command(zip_file, archive, tuner)
+            elif archive.remote:
+                self.__write_remote(zip_file, archive, tuner)
+            else:
+                if archive.read_order is not None:
+                    entries = stack.enter_context(ReadAhead(self.__walk(archive), archive.read_order, archive.read_ahead,
+                                                            lambda x: os.path.relpath(x.path, archive.path).replace(os.sep, "/") in kept,
+                                                            self.__throttle_read, self.__governor.release))
+                else:
+                    entries = ((x, is_dir, None) for x, is_dir in self.__walk(archive))
+                for entry, is_dir, data in entries:
+                    abs_path = os.path.abspath(entry.path)
                     rel_path = os.path.relpath(abs_path, archive.path)
-                    LOGGER.debug(f"Writing File: {rel_path}")
-                    zip_file.write(abs_path, rel_path)
+                    if is_dir:
+                        if rel_path.replace(os.sep, "/") + "/" in kept:
+                            continue
+                        self.__progress.trace("Writing Dir ", rel_path)
+                        zip_file.write(abs_path, rel_path)
+                        self.__add_checkpoint(checkpoint, zip_file, None)
+                        continue
+                    self.__check_cancelled()
+                    self.__progress.update(rel_path)
+                    if rel_path.replace(os.sep, "/") in kept:
+                        continue
+                    self.__progress.trace("Writing File", rel_path)
+                    self.__write_file(zip_file, abs_path, rel_path, tuner, data)
+                    self.__add_checkpoint(checkpoint, zip_file, entry.stat())
+            self.__progress.finish()
+        if checkpoint is not None:
+            checkpoint.delete()
         LOGGER.info(f"Archive was crated: {archive.get_archive_path()}")
 
-    def _copy_archive(self, archive: Archive, eligible_indexes: list) -> None:
-        LOGGER.debug("Copying zip file")
+    # noinspection PyMethodMayBeStatic
+    def __walk(self, archive: Archive) -> Iterator[tuple]:
+        """(entry, is_dir) of the source, in the order of the archive: every directory listing, its directories first"""
+        for crt_path, directories, files in ParallelScanner(archive.scan_threads).walk(archive.path):
+            yield from ((x, True) for x in directories)
+            yield from ((x, False) for x in files)
+
+    # noinspection PyMethodMayBeStatic
+    def __add_checkpoint(self, checkpoint: Optional[ArchiveCheckpoint], zip_file: pyzipper.AESZipFile, stat: Optional[os.stat_result]) -> None:
+        """Records the member just written, and syncs the archive up to it when a checkpoint is due"""
+        if checkpoint is None:
+            return
+        checkpoint.add(zip_file.filelist[-1], stat)
+        if checkpoint.is_due():
+            checkpoint.commit(zip_file.fp, zip_file.start_dir)
+
+    def _do_shards(self, archive: Archive, start_time: datetime, transfers: TransferQueue, commit: Callable[[ArchiveDestination, str], None]) -> None:
+        """Archives the shards owned by this host in worker processes, shipping each one as soon as it is written, then
+        the manifest tying them to the version. `commit` is called for every destination that has the manifest"""
+        archive.get_archive_path(start_time)
+        shard_set = ShardSet(archive.shards, *archive.shard_host)
+        shards = [x for x in shard_set.partition(archive.path, archive.scan_threads) if shard_set.owns(x)]
+        LOGGER.info(f"Archiving {len(shards)} of {archive.shards} shards with {archive.shard_workers} workers: " +
+                    ", ".join(f"{x} ({len(x.members)} entries, {x.size} bytes)" for x in shards))
+        password = archive.get_password()
+        if archive.encryption == Archive.STREAM_ENCRYPTION and password is None:
+            raise VaultBackupException(f"Archive '{archive.name}' uses stream encryption, but no password was provided.")
+        level = archive.compression if isinstance(archive.compression, int) else None
+        cancel = multiprocessing.Event()
+        written = {}
+        self.__progress.start("shards", len(shards), sum(x.size for x in shards))
+        with ProcessPoolExecutor(archive.shard_workers, initializer=init_worker, initargs=(cancel,)) as pool:
+            futures = {pool.submit(write_shard, archive.get_shard_path(x.suffix()), x.members, password,
+                                   archive.encryption == Archive.STREAM_ENCRYPTION, level): x for x in shards}
+            try:
+                pending = set(futures.keys())
+                while len(pending) > 0:
+                    done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                    self.__check_cancelled()
+                    for future in done:
+                        shard = futures[future]
+                        path = archive.get_shard_path(shard.suffix())
+                        checksum, size = future.result()
+                        self.__checksums[path] = checksum
+                        written[os.path.basename(path)] = {"index": shard.index, "checksum": checksum, "size": size, "entries": len(shard.members)}
+                        self.__progress.update(os.path.basename(path), shard.size)
+                        transfers.submit(path)
+            except BaseException:
+                # Running workers stop at their next entry, queued shards are not started
+                cancel.set()
+                for future in futures:
+                    future.cancel()
+                raise
+        self.__progress.finish()
+        transfers.wait()
+        version = archive.get_snapshot_name(start_time)
+        manifest_path = os.path.join(os.path.dirname(archive.get_archive_path()), shard_set.manifest_name(version))
+        shard_set.write_manifest(manifest_path, version, written)
+        # The manifest goes last, the shards of a host are complete at a destination only once its manifest is there
+        self.__commits[manifest_path] = commit
+        transfers.submit(manifest_path)
+        transfers.wait()
+
+    def __write_file(self, zip_file: pyzipper.AESZipFile, abs_path: str, rel_path: str, tuner: Optional[CompressionTuner] = None,
+                     data: Optional[bytes] = None) -> None:
+        """`data` is the content of the file when it was read ahead"""
+        zinfo = zip_file.zipinfo_cls.from_file(abs_path, rel_path)
+        level = zip_file.compresslevel if tuner is None else tuner.choose(zinfo.file_size)
+        zinfo.compress_type = zip_file.compression if level != 0 else pyzipper.ZIP_STORED
+        zinfo._compresslevel = level
+        if data is not None:
+            if tuner is not None:
+                tuner.observe(data)
+            with zip_file.open(zinfo, 'w') as dst:
+                dst.write(data)
+            self.__progress.add_bytes(len(data))
+            return
+        if zinfo.file_size >= LargeFileReader.THRESHOLD:
+            self.__write_large_file(zip_file, zinfo, abs_path, rel_path, tuner)
+            return
+        with open(abs_path, 'rb') as src, zip_file.open(zinfo, 'w') as dst:
+            for data in iter(partial(src.read, BackupExecutor.READ_SIZE), b""):
+                self.__throttle_read(len(data))
+                if tuner is not None:
+                    tuner.observe(data)
+                dst.write(data)
+                self.__progress.add_bytes(len(data))
+            self.__governor.release(src.fileno())
+
+    def __write_command(self, zip_file: pyzipper.AESZipFile, archive: Archive, tuner: Optional[CompressionTuner] = None) -> None:
+        """Streams the output of the source command to a single member, compressed and encrypted as it is read"""
+        zinfo = zip_file.zipinfo_cls(archive.member, time.localtime()[:6])
+        zinfo.external_attr = 0o600 << 16
+        # The size is not known in advance, the level is chosen before any output is sampled
+        level = zip_file.compresslevel if tuner is None else tuner.choose(0)
+        zinfo.compress_type = zip_file.compression if level != 0 else pyzipper.ZIP_STORED
+        zinfo._compresslevel = level
+        self.__progress.trace("Writing Command", archive.member)
+        with CommandReader(archive.command, archive.path, BackupExecutor.READ_SIZE, self.__throttle_read) as reader, \
+                zip_file.open(zinfo, 'w', force_zip64=True) as dst:
+            for data in reader:
+                self.__check_cancelled()
+                if tuner is not None:
+                    tuner.observe(data)
+                dst.write(data)
+                self.__progress.add_bytes(len(data))
+        LOGGER.info(f"Command output archived: {reader.bytes_read} bytes")
+
+    def __write_remote(self, zip_file: pyzipper.AESZipFile, archive: Archive, tuner: Optional[CompressionTuner] = None) -> None:
+        """Pulls the files of a remote source over parallel SFTP channels straight into the archive, in the order of the listing"""
+        entries = self.__get_remote_entries(archive)
+        files = [x for x in entries if not x.is_dir]
+        channels = [self.__ssh.open_sftp() for _ in range(min(archive.pull_channels, max(1, len(files))))]
+        openers = [partial(lambda sftp, entry: RangedReader(sftp.open(f"{archive.path}/{entry.path}", 'rb')), x) for x in channels]
+        try:
+            with Prefetcher(files, openers, BackupExecutor.READ_SIZE) as prefetcher:
+                pulled = iter(prefetcher)
+                for entry in entries:
+                    self.__check_cancelled()
+                    # Members get the modification time of the host, zip times start in 1980
+                    zinfo = zip_file.zipinfo_cls(entry.path + ("/" if entry.is_dir else ""), max(time.localtime(entry.mtime)[:6], (1980, 1, 1, 0, 0, 0)))
+                    zinfo.external_attr = entry.unix_mode() << 16
+                    if entry.is_dir:
+                        zinfo.external_attr |= 0x10
+                        self.__progress.trace("Writing Dir ", entry.path)
+                        zip_file.writestr(zinfo, b"")
+                        continue
+                    self.__progress.update(entry.path)
+                    self.__progress.trace("Writing File", entry.path)
+                    zinfo.file_size = entry.size
+                    level = zip_file.compresslevel if tuner is None else tuner.choose(entry.size)
+                    zinfo.compress_type = zip_file.compression if level != 0 else pyzipper.ZIP_STORED
+                    zinfo._compresslevel = level
+                    with zip_file.open(zinfo, 'w') as dst:
+                        for data in next(pulled)[1]:
+                            self.__throttle_read(len(data))
+                            if tuner is not None:
+                                tuner.observe(data)
+                            dst.write(data)
+                            self.__progress.add_bytes(len(data))
+        finally:
+            for channel in channels:
+                channel.close()
+
+    def __write_large_file(self, zip_file: pyzipper.AESZipFile, zinfo: pyzipper.zipfile.ZipInfo, abs_path: str, rel_path: str,
+                           tuner: Optional[CompressionTuner]) -> None:
+        """Streams a large file in windows, skipping the reads of its holes and hashing it in the same pass"""
+        reader = LargeFileReader(abs_path, throttle=self.__throttle_read, release=self.__governor.release)
+        with zip_file.open(zinfo, 'w') as dst:
+            for data in reader:
+                if tuner is not None:
+                    tuner.observe(data)
+                dst.write(data)
+                self.__progress.add_bytes(len(data))
+        if reader.hole_bytes > 0:
+            LOGGER.debug(f"'{rel_path}': {reader.data_bytes} bytes read, {reader.hole_bytes} bytes of holes skipped")
+        expected = self.__hash_cache.lookup(rel_path) if self.__hash_cache is not None else None
+        if expected is not None and expected != reader.hexdigest():
+            LOGGER.warning(f"'{rel_path}' changed after the content fingerprint was computed")
+            self.__content_changed = True
+
+    def _do_repository(self, archive: Archive, start_time: datetime, eligible_indexes: list) -> None:
+        """Writes a snapshot of the source to the repository of every eligible destination, reading the source once"""
+        repositories = {}
         for index in eligible_indexes:
-            destination = archive.destinations[index]
-            if destination.remote:
-                LOGGER.info(f"[{destination.label}] Uploading '{archive.get_archive_path()}' to '{destination.path}'")
-                self.__ssh.upload(archive.get_archive_path(), destination.path, False)
+            dst = archive.destinations[index]
+            repositories[dst.label] = Repository(self._get_storage(archive, dst), archive.get_password(), self.__upload_throttle(dst.label))
+        writer = RepositoryWriter(repositories, throttle=self.__throttle_read, release=self.__governor.release, progress=self.__progress)
+        self.__progress.start("repository", *self.__get_totals(archive))
+        writer.backup(archive.path, archive.get_snapshot_name(start_time))
+        self.__progress.finish()
+        LOGGER.info(f"Snapshot was created, {writer.read_bytes} bytes read from the source")
+
+    def _clean_repositories(self, archive: Archive) -> None:
+        LOGGER.info("Cleaning old snapshots")
+        for dst in archive.destinations:
+            storage = self._get_storage(archive, dst)
+            if not storage.exists(Repository.CONFIG):
+                continue
+            removed, chunks = Repository(storage, archive.get_password()).prune(dst.versions)
+            for name in removed:
+                LOGGER.info(f"[{dst.label}] Snapshot removed: {name}")
+            LOGGER.info(f"[{dst.label}] Unreferenced chunks removed: {chunks}")
+
+    def _do_mirrors(self, archive: Archive, start_time: datetime, fingerprint: Optional[str], mirror_indexes: list) -> None:
+        """Writes a snapshot directory to every eligible mirror destination, and commits each one once it is complete"""
+        name = archive.get_snapshot_name(start_time)
+        for index in mirror_indexes:
+            dst = archive.destinations[index]
+            mirror = Mirror(archive.get_mirror_path(dst), archive.get_version_prefix(), archive.get_password(), dst.compress, dst.encrypt, self.__local_transfer)
+            LOGGER.info(f"[{dst.label}] Writing mirror snapshot: {name}")
+            start = time.perf_counter()
+            self.__progress.start("mirror", *self.__get_totals(archive))
+            mirror.backup(archive.path, name, self.__throttle_read, self.__check_cancelled, self.__progress)
+            self.__progress.finish()
+            LOGGER.info(f"[{dst.label}] Mirror snapshot was created in {time.perf_counter() - start:.1f}s: "
+                        f"{mirror.linked} files linked, {mirror.copied} files copied ({mirror.copied_bytes} bytes)")
+            dst.last_run = start_time
+            dst.fingerprint = fingerprint
+            if self.__state is not None:
+                self.__state.commit(archive, dst, name)
+
+    def _clean_mirrors(self, archive: Archive) -> None:
+        LOGGER.info("Cleaning old mirror snapshots")
+        for dst in filter(lambda x: x.type == ArchiveDestination.MIRROR_TYPE, archive.destinations):
+            path = archive.get_mirror_path(dst)
+            if not os.path.isdir(path):
+                continue
+            for name in Mirror(path, archive.get_version_prefix()).prune(dst.versions):
+                LOGGER.info(f"[{dst.label}] Snapshot removed: {name}")
+
+    def _get_storage(self, archive: Archive, dst: ArchiveDestination) -> Storage:
+        return self.__open_storage(dst, archive.get_repository_path(dst))
+
+    def __open_storage(self, dst: ArchiveDestination, path: str) -> Storage:
+        if dst.s3:
+            return S3Storage(path, self.__s3)
+        return SFTPStorage(path, self.__ssh.sftp()) if dst.remote else LocalStorage(path)
+
+    def _get_backend(self, dst: ArchiveDestination) -> DestinationBackend:
+        """Backend storing the files of a destination, made once per destination and shared by the transfer threads"""
+        if dst not in self.__backends:
+            if dst.s3:
+                backend = S3Backend(dst, self.__s3, self.__s3_info, self.__upload_throttle(dst.label), self.__check_cancelled)
+            elif dst.remote:
+                backend = SSHBackend(dst, self.__ssh, self.__upload_progress(dst.label))
+            else:
+                backend = LocalBackend(dst, self.__local_transfer, self.__upload_throttle(dst.label))
+            self.__backends.setdefault(dst, backend)
+        return self.__backends[dst]
+
+    def __get_totals(self, archive: Archive) -> (Optional[int], Optional[int]):
+        if not self.__progress.info.estimate or archive.command is not None:
+            return None, None
+        return self.__get_source_totals(archive)
+
+    def __get_source_totals(self, archive: Archive) -> (int, int):
+        """Number of files and bytes of the source, scanned once per run for the staging estimate and the progress"""
+        if self.__totals is None:
+            if archive.remote:
+                files = [x for x in self.__get_remote_entries(archive) if not x.is_dir]
+                self.__totals = len(files), sum(x.size for x in files)
             else:
-                LOGGER.info(f"[{destination.label}] Copying '{archive.get_archive_path()}' to '{destination.path}'")
-                copy2(archive.get_archive_path(), destination.path)
+                self.__totals = scan_totals(archive.path)
+            LOGGER.debug(f"Source has {self.__totals[0]} files, {self.__totals[1]} bytes")
+        return self.__totals
+
+    def _copy_archive(self, archive: Archive, transfers: TransferQueue, commit: Callable[[ArchiveDestination, str], None]) -> None:
+        """Transfers the files of the archive. `commit` is called for every destination as soon as it has all of them"""
+        LOGGER.debug("Copying archive files")
+        if archive.volume_size is None:
+            self.__commits[archive.get_archive_path()] = commit
+        for path in self._get_archive_files(archive):
+            transfers.submit(path)
+        transfers.wait()
+        if archive.volume_size is not None:
+            # The manifest goes last, a volume set is complete at a destination only once its manifest is there
+            manifest_path = VolumeWriter.manifest_path(archive.get_archive_path())
+            self.__commits[manifest_path] = commit
+            transfers.submit(manifest_path)
+            transfers.wait()
+
+    def _copy_file(self, archive: Archive, eligible_indexes: list, path: str) -> None:
+        """Transfers a file to the eligible destinations. A destination whose transfer fails is skipped for the rest of
+        the version while the others go on, and each destination is committed once it has the file completing the version"""
+        checksum = self.__get_checksum(path)
+        destinations = [archive.destinations[x] for x in eligible_indexes if archive.destinations[x] not in self.__failed]
+        for group in self._group_destinations(destinations):
+            source = None
+            for destination in group:
+                backend = self._get_backend(destination)
+                try:
+                    if source is None:
+                        self.__with_retries(backend, path, partial(self.__transfer_file, backend, path, checksum))
+                    else:
+                        self.__with_retries(backend, path, partial(self.__duplicate_file, source, backend, path))
+                except BackupCancelled:
+                    raise
+                except Exception as e:
+                    LOGGER.error(f"[{destination.label}] Transfer of '{os.path.basename(path)}' failed, the destination is skipped for this version: {e}")
+                    self.__failed.setdefault(destination, e)
+                    continue
+                # The next destinations of the group are filled from the first one that has the file
+                source = source if source is not None else backend
+                commit = self.__commits.get(path)
+                if commit is not None:
+                    commit(destination, path)
+
+    def _group_destinations(self, destinations: List[ArchiveDestination]) -> List[List[ArchiveDestination]]:
+        """Groups destinations sharing the same host (remote), the same filesystem (local) or the same object store"""
+        groups = {}
+        for dst in destinations:
+            groups.setdefault(self._get_backend(dst).group(), []).append(dst)
+        return list(groups.values())
+
+    def __with_retries(self, backend: DestinationBackend, path: str, transfer) -> None:
+        for attempt in range(1, BackupExecutor.TRANSFER_RETRIES + 1):
+            try:
+                transfer()
+                return
+            except BackupCancelled:
+                self.__remove_partial(backend, path)
+                raise
+            except Exception as e:
+                self.__remove_partial(backend, path)
+                if attempt == BackupExecutor.TRANSFER_RETRIES:
+                    raise
+                LOGGER.warning(f"[{backend.destination.label}] Transfer of '{os.path.basename(path)}' failed (attempt {attempt}/{BackupExecutor.TRANSFER_RETRIES}): {e}")
+
+    def __duplicate_file(self, source: DestinationBackend, backend: DestinationBackend, path: str) -> None:
+        """Fills a destination from a copy that already exists on the same host, filesystem or object store"""
+        self.__check_cancelled()
+        if not backend.duplicate(source, path, self.__get_checksum(path)):
+            self.__transfer_file(backend, path, self.__get_checksum(path))
+
+    def __transfer_file(self, backend: DestinationBackend, path: str, checksum: Optional[str]) -> None:
+        """Transfers a file, which appears at the destination once it is complete and verified"""
+        self.__check_cancelled()
+        start = time.perf_counter()
+        backend.upload(path, checksum)
+        self.__add_throughput(backend.destination.label, os.path.getsize(path), time.perf_counter() - start)
+
+    # noinspection PyMethodMayBeStatic
+    def __remove_partial(self, backend: DestinationBackend, path: str) -> None:
+        try:
+            backend.remove_partial(path)
+        except Exception as e:
+            LOGGER.warning(f"[{backend.destination.label}] Cannot remove the partial transfer of '{os.path.basename(path)}': {e}")
+
+    def __check_cancelled(self) -> None:
+        if self.__cancel.is_set():
+            raise BackupCancelled("Backup was cancelled.")
+
+    def __throttle_read(self, amount: int) -> None:
+        self.__check_cancelled()
+        self.__governor.throttle_read(amount)
+        # Throttling may have slept for a while
+        self.__check_cancelled()
+
+    def __upload_throttle(self, label: str) -> Optional[Callable[[int], None]]:
+        """Upload throttle that also stops a cancelled transfer. None if uploads are not limited, to keep the fast paths"""
+        throttle = self.__governor.upload_throttle(label)
+        if throttle is None:
+            return None
+
+        def check(amount: int) -> None:
+            self.__check_cancelled()
+            throttle(amount)
+            self.__check_cancelled()
+
+        return check
+
+    def __upload_progress(self, label: str) -> Callable:
+        progress = self.__governor.upload_progress(label)
+
+        def check(filename, size, sent) -> None:
+            self.__check_cancelled()
+            if progress is not None:
+                progress(filename, size, sent)
+
+        return check
+
+    def __emit(self, kind: str, archive: Archive, data: Optional[dict] = None) -> None:
+        loop = self.__loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self.__events.put_nowait, BackupEvent(kind, archive.name, data))
+
+    def __on_progress(self, status: dict) -> None:
+        loop = self.__loop
+        if loop is not None:
+            archive = self.__current_archive.name if self.__current_archive is not None else None
+            loop.call_soon_threadsafe(self.__events.put_nowait, BackupEvent(BackupEvent.PROGRESS, archive, status))
+
+    def __add_throughput(self, label: str, size: int, seconds: float) -> None:
+        with self.__throughput_lock:
+            total_size, total_seconds = self.__throughput.get(label, (0, 0.0))
+            self.__throughput[label] = (total_size + size, total_seconds + seconds)
+
+    def __get_throughput(self, label: str) -> Optional[float]:
+        """Upload speed to a destination in bytes per second, None if nothing was uploaded to it"""
+        with self.__throughput_lock:
+            size, seconds = self.__throughput.get(label, (0, 0.0))
+        return size / seconds if seconds > 0 else None
+
+    def __get_upload_seconds(self) -> Optional[float]:
+        """Transfer time of the slowest destination"""
+        with self.__throughput_lock:
+            return max([x[1] for x in self.__throughput.values()], default=None)
+
+    def __get_checksum(self, path: str) -> str:
+        if path not in self.__checksums:
+            self.__checksums[path] = file_checksum(path)
+        return self.__checksums[path]
+
+    def __on_volume_sealed(self, transfers: Optional[TransferQueue], volume: Volume) -> None:
+        self.__checksums[volume.path] = volume.checksum
+        if transfers is not None:
+            transfers.submit(volume.path)
+
+    # noinspection PyMethodMayBeStatic
+    def _get_archive_files(self, archive: Archive) -> List[str]:
+        if archive.shards is not None:
+            extension = ".zip.enc" if archive.encryption == Archive.STREAM_ENCRYPTION else ".zip"
+            base = glob.escape(archive.get_archive_path()[:-len(extension)])
+            return sorted(glob.glob(base + ".s*of*" + extension)) + sorted(glob.glob(base + "*" + ShardSet.MANIFEST_SUFFIX))
+        if archive.volume_size is None:
+            return [archive.get_archive_path()]
+        return sorted(glob.glob(glob.escape(archive.get_archive_path()) + ".[0-9][0-9][0-9]"))
 
     def _clean_archives(self, archive: Archive) -> None:
         LOGGER.info("Cleaning old archives")
-        prefix_name = ".".join(archive.name.split(".")[:-1])
-        for dst in archive.destinations:
-            files = os.listdir(dst.path) if not dst.remote else list(map(lambda x: x.replace("\n", ""), self.__ssh.execute(f"find '{dst.path}' -type f -maxdepth 1")[1]))
-            files = filter(lambda x: os.path.isfile(os.path.join(dst.path, x)), files) if not dst.remote else map(lambda x: os.path.relpath(x, dst.path), files)
-            files = list(filter(lambda x: x.startswith(prefix_name), files))
-
-            files.sort(reverse=True)
-            LOGGER.debug(f"[{dst.label}] Files found: {files}")
-            keep = dst.versions
-            for file in files:
-                file_path = os.path.join(dst.path, file)
-                if keep == 0 and not dst.remote:
-                    os.remove(file_path)
-                    LOGGER.info(f"[{dst.label}] File removed: {file}")
-                elif keep == 0 and dst.remote:
-                    self.__ssh.execute(f"rm '{file_path}'")
+        # Every file of a version (archive, volumes, manifest) shares the archive timestamp, so they are rotated together
+        version_pattern = re.compile(re.escape(archive.get_version_prefix()) + r"(\d{8}_\d{6})")
+        for dst in filter(lambda x: x.type == ArchiveDestination.ARCHIVE_TYPE, archive.destinations):
+            backend = self._get_backend(dst)
+            versions = {}
+            for file in backend.list():
+                if file.endswith(DestinationBackend.PART_SUFFIX):
+                    # Left by an interrupted transfer, it is not part of a version
+                    continue
+                matches = version_pattern.match(file)
+                if matches is not None:
+                    versions.setdefault(matches.group(1), []).append(file)
+
+            LOGGER.debug(f"[{dst.label}] Versions found: {sorted(versions.keys(), reverse=True)}")
+            for version in self.__get_expired_versions(backend, versions):
+                backend.delete(versions[version])
+                for file in versions[version]:
                     LOGGER.info(f"[{dst.label}] File removed: {file}")
-                else:
-                    keep -= 1
 
     # noinspection PyMethodMayBeStatic
+    def __get_expired_versions(self, backend: DestinationBackend, versions: dict) -> List[str]:
+        """Versions past the newest `dst.versions` complete ones. A volume set is complete once its manifest is there, a
+        shard set once its manifests cover every shard; an incomplete set newer than the kept ones may still be written
+        (by another host, or by the next run), so it is kept"""
+        dst = backend.destination
+        expired, complete = [], 0
+        for version in sorted(versions.keys(), reverse=True):
+            if complete >= dst.versions:
+                expired.append(version)
+                continue
+            manifests = [x for x in versions[version] if x.endswith(ShardSet.MANIFEST_SUFFIX)]
+            if len(manifests) == 0:
+                if any(re.search(r"\.\d{3}$", x) for x in versions[version]) and not any(x.endswith(VolumeWriter.MANIFEST_SUFFIX) for x in versions[version]):
+                    LOGGER.warning(f"[{dst.label}] Volume set {version} is incomplete")
+                else:
+                    complete += 1
+                continue
+            contents = [json.loads(backend.read(x)) for x in manifests]
+            if ShardSet.is_complete(contents, versions[version]):
+                complete += 1
+            else:
+                LOGGER.warning(f"[{dst.label}] Shard set {version} is incomplete")
+        return expired
+
     def _delete_archive(self, archive: Archive) -> None:
         LOGGER.debug("Deleting local archive")
         archive_path = archive.get_archive_path()
-        if os.path.isfile(archive_path):
-            os.remove(archive_path)
-            LOGGER.info(f"Local archive deleted: {archive_path}")
+        if archive_path is None:
+            # The run failed before its archive was started
+            return
+        for path in [archive_path, VolumeWriter.manifest_path(archive_path), archive.get_checkpoint_path()] + self._get_archive_files(archive):
+            if os.path.isfile(path):
+                os.remove(path)
+                LOGGER.info(f"Local archive deleted: {path}")
@@ -0,0 +1,145 @@
+import base64
+import json
+import os
+import time
+from datetime import datetime
+from typing import Optional, List, Tuple, BinaryIO
+
+import pyzipper
+
+from misc.utils import LOGGER
+
+
+class ArchiveCheckpoint:
+    """Journal of the members written to an archive, so an interrupted archive can be resumed instead of rebuilt.
+
+    The journal is append-only: a header line, then for every checkpoint the members completed since the previous
+    one followed by the archive offset they end at. Before an offset is journaled the archive is synced up to it,
+    so every member listed before the last offset is complete on disk. On resume the archive is truncated to the
+    end of the last member whose source is unchanged and the writer carries on from there.
+    """
+
+    INTERVAL = 30.0
+
+    def __init__(self, path: str):
+        self.path: str = path
+        self.archive_path: Optional[str] = None
+        self.start_time: Optional[datetime] = None
+        self.key: Optional[str] = None
+        self.offset: int = 0
+        self.members: List[Tuple[dict, Optional[list]]] = []
+        self.committed: int = 0
+        self.__pending: List[Tuple[dict, Optional[list]]] = []
+        self.__last_commit = time.monotonic()
+
+    @staticmethod
+    def load(path: str) -> Optional['ArchiveCheckpoint']:
+        if not os.path.isfile(path):
+            return None
+        checkpoint = ArchiveCheckpoint(path)
+        pending = []
+        try:
+            with open(path, 'r') as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # The last line may have been cut by the interruption, it is not part of a checkpoint
+                        break
+                    if "archive" in record:
+                        checkpoint.archive_path = record["archive"]
+                        checkpoint.start_time = datetime.fromisoformat(record["start_time"])
+                        checkpoint.key = record["key"]
+                    elif "member" in record:
+                        pending.append((record["member"], record["source"]))
+                    elif "offset" in record:
+                        checkpoint.members.extend(pending)
+                        checkpoint.offset = record["offset"]
+                        pending = []
+        except OSError as e:
+            LOGGER.warning(f"Checkpoint '{path}' cannot be read: {e}")
+            return None
+        return checkpoint if checkpoint.archive_path is not None else None
+
+    def start(self, archive_path: str, start_time: datetime, key: str) -> None:
+        """Starts a new journal for an archive written from the beginning"""
+        self.archive_path, self.start_time, self.key = archive_path, start_time, key
+        self.offset, self.members, self.committed, self.__pending = 0, [], 0, []
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.__write([{"archive": archive_path, "start_time": start_time.isoformat(), "key": key}], 'w')
+
+    def resume(self, root: str) -> int:
+        """Keeps the members whose source did not change, up to the first one that did. Returns the offset they end at"""
+        for index, (member, source) in enumerate(self.members):
+            path = os.path.join(root, member["filename"])
+            try:
+                stat = os.stat(path)
+                unchanged = os.path.isdir(path) if source is None else [stat.st_size, stat.st_mtime_ns] == source
+            except OSError:
+                unchanged = False
+            if not unchanged:
+                LOGGER.info(f"'{member['filename']}' changed since it was archived, resuming before it")
+                self.offset = member["header_offset"]
+                self.members = self.members[:index]
+                break
+        self.__write([{"archive": self.archive_path, "start_time": self.start_time.isoformat(), "key": self.key}] +
+                     [{"member": x, "source": y} for x, y in self.members] + [{"offset": self.offset}], 'w')
+        return self.offset
+
+    def restore(self, zip_file: pyzipper.AESZipFile) -> None:
+        """Puts the kept members back in the central directory of a writer opened at the resume offset"""
+        for member, _ in self.members:
+            zinfo = ArchiveCheckpoint.from_dict(zip_file.zipinfo_cls, member)
+            zip_file.filelist.append(zinfo)
+            zip_file.NameToInfo[zinfo.filename] = zinfo
+
+    def names(self) -> set:
+        return {x["filename"] for x, _ in self.members}
+
+    def add(self, zinfo: pyzipper.zipfile.ZipInfo, stat: Optional[os.stat_result]) -> None:
+        """Records a completed member and the size and mtime of its source (None for directories)"""
+        self.__pending.append((ArchiveCheckpoint.to_dict(zinfo), [stat.st_size, stat.st_mtime_ns] if stat is not None else None))
+
+    def is_due(self) -> bool:
+        return len(self.__pending) > 0 and time.monotonic() - self.__last_commit >= ArchiveCheckpoint.INTERVAL
+
+    def commit(self, archive: BinaryIO, offset: int) -> None:
+        archive.flush()
+        os.fsync(archive.fileno())
+        self.__write([{"member": x, "source": y} for x, y in self.__pending] + [{"offset": offset}], 'a')
+        # Members are only read back from the journal on resume, so memory does not grow with the archive
+        self.committed += len(self.__pending)
+        self.offset, self.__pending = offset, []
+        self.__last_commit = time.monotonic()
+        LOGGER.debug(f"Checkpoint: {len(self.members) + self.committed} members, {offset} bytes")
+
+    def delete(self) -> None:
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def __write(self, records: List[dict], mode: str) -> None:
+        with open(self.path, mode) as journal:
+            journal.write("".join(json.dumps(x) + "\n" for x in records))
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    @staticmethod
+    def to_dict(zinfo: pyzipper.zipfile.ZipInfo) -> dict:
+        member = {}
+        for cls in type(zinfo).__mro__:
+            for slot in getattr(cls, "__slots__", ()):
+                if hasattr(zinfo, slot):
+                    value = getattr(zinfo, slot)
+                    member[slot] = {"base64": base64.b64encode(value).decode()} if isinstance(value, bytes) else value
+        return member
+
+    @staticmethod
+    def from_dict(zipinfo_cls: type, member: dict) -> pyzipper.zipfile.ZipInfo:
+        zinfo = zipinfo_cls(member["filename"])
+        for slot, value in member.items():
+            if isinstance(value, dict):
+                value = base64.b64decode(value["base64"])
+            elif slot == "date_time":
+                value = tuple(value)
+            setattr(zinfo, slot, value)
+        return zinfo
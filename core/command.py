@@ -0,0 +1,72 @@
+import hashlib
+import subprocess
+import tempfile
+from functools import partial
+from typing import Optional, Callable, Iterator
+
+from misc.utils import LOGGER, VaultBackupException
+
+
+class CommandReader:
+    """Reads the standard output of a command (a database dump) as a sequence of chunks, with bounded memory whatever
+    the size of the output.
+
+    The command runs through the shell in `cwd`. Its standard error goes to a temporary file, so it cannot block the
+    command on a full pipe, and its end is reported when the command fails. The exit status is checked once the
+    output is read to the end: a failed command raises, so an incomplete dump never becomes a version. Leaving the
+    context before the end kills the command.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+    STDERR_TAIL = 2048
+    PROBE_TIMEOUT = 60
+
+    def __init__(self, command: str, cwd: Optional[str] = None, chunk_size: int = CHUNK_SIZE, throttle: Optional[Callable[[int], None]] = None):
+        self.command: str = command
+        self.cwd: Optional[str] = cwd
+        self.chunk_size: int = chunk_size
+        self.bytes_read: int = 0
+        self.__throttle = throttle
+        self.__stderr = None
+        self.__process: Optional[subprocess.Popen] = None
+
+    def __enter__(self) -> 'CommandReader':
+        LOGGER.debug(f"Running command: {self.command}")
+        self.__stderr = tempfile.TemporaryFile()
+        self.__process = subprocess.Popen(self.command, shell=True, cwd=self.cwd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=self.__stderr)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if self.__process.poll() is None:
+            LOGGER.debug(f"Killing command: {self.command}")
+            self.__process.kill()
+        self.__process.stdout.close()
+        self.__process.wait()
+        self.__stderr.close()
+
+    def __iter__(self) -> Iterator[bytes]:
+        for data in iter(partial(self.__process.stdout.read, self.chunk_size), b""):
+            if self.__throttle is not None:
+                self.__throttle(len(data))
+            self.bytes_read += len(data)
+            yield data
+        status = self.__process.wait()
+        if status != 0:
+            raise VaultBackupException(f"Command '{self.command}' failed with exit status {status}: {self.__stderr_tail()}")
+
+    def __stderr_tail(self) -> str:
+        size = self.__stderr.seek(0, 2)
+        self.__stderr.seek(max(0, size - CommandReader.STDERR_TAIL))
+        return self.__stderr.read().decode(errors="replace").strip()
+
+    @staticmethod
+    def probe(command: str, cwd: Optional[str] = None, timeout: float = PROBE_TIMEOUT) -> str:
+        """Fingerprint (sha256) of the output of a probe command: a cheap check of whether the source changed"""
+        try:
+            result = subprocess.run(command, shell=True, cwd=cwd, stdin=subprocess.DEVNULL, capture_output=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            raise VaultBackupException(f"Probe '{command}' did not finish in {timeout}s")
+        if result.returncode != 0:
+            raise VaultBackupException(f"Probe '{command}' failed with exit status {result.returncode}: "
+                                       f"{result.stderr[-CommandReader.STDERR_TAIL:].decode(errors='replace').strip()}")
+        return hashlib.sha256(result.stdout).hexdigest()
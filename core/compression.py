@@ -0,0 +1,103 @@
+import time
+import zlib
+from typing import Optional, Dict, List
+
+from misc.utils import LOGGER
+
+
+class LevelStats:
+    """Measured deflate speed and ratio of one compression level."""
+
+    def __init__(self, level: int):
+        self.level: int = level
+        self.input: int = 0
+        self.output: int = 0
+        self.seconds: float = 0.0
+
+    def speed(self) -> float:
+        """Input bytes compressed per second"""
+        return self.input / self.seconds if self.seconds > 0 else float("inf")
+
+    def ratio(self) -> float:
+        """Output size relative to the input size"""
+        return self.output / self.input if self.input > 0 else 1.0
+
+
+class CompressionTuner:
+    """Picks the compression level that minimizes the time to archive and upload the data.
+
+    Every level is measured on samples of the data being archived. With the upload throughput of the destinations,
+    the cost of a byte at a given level is the time to compress it plus the time to upload its compressed size (or
+    the larger of the two when volumes are uploaded while the archive is written). Samples are taken again every
+    `SAMPLE_INTERVAL` bytes, so the level follows the data as it changes. Level 0 stores members uncompressed.
+    Until an upload throughput is known (no previous run), the default level is used.
+    """
+
+    LEVELS = [0, 1, 3, 6, 9]
+    SAMPLE_SIZE = 256 * 1024
+    SAMPLE_INTERVAL = 64 * 1024 * 1024
+    DECAY = 0.5
+
+    def __init__(self, upload_throughput: Optional[float], overlap: bool = False, levels: Optional[List[int]] = None):
+        self.upload_throughput: Optional[float] = upload_throughput
+        self.overlap: bool = overlap
+        self.stats: Dict[int, LevelStats] = {x: LevelStats(x) for x in (levels if levels is not None else CompressionTuner.LEVELS)}
+        self.level: int = 6 if 6 in self.stats else max(self.stats)
+        self.used: Dict[int, int] = {}
+        self.predicted_archive: float = 0.0
+        self.predicted_upload: float = 0.0
+        self.__next_sample = 0
+        self.__observed = 0
+
+    def observe(self, data: bytes) -> None:
+        """Called with the data being archived, samples it when a sample is due"""
+        if self.__observed >= self.__next_sample:
+            self.sample(data[:CompressionTuner.SAMPLE_SIZE])
+            self.__next_sample = self.__observed + CompressionTuner.SAMPLE_INTERVAL
+        self.__observed += len(data)
+
+    def sample(self, data: bytes) -> None:
+        if len(data) == 0:
+            return
+        for stats in self.stats.values():
+            # Older samples weigh less, so the measures follow the data as it changes
+            stats.input, stats.output, stats.seconds = [x * CompressionTuner.DECAY for x in (stats.input, stats.output, stats.seconds)]
+            start = time.perf_counter()
+            if stats.level == 0:
+                output = len(data)
+            else:
+                compressor = zlib.compressobj(stats.level, zlib.DEFLATED, -15)
+                output = len(compressor.compress(data)) + len(compressor.flush())
+            stats.seconds += time.perf_counter() - start
+            stats.input += len(data)
+            stats.output += output
+        if self.upload_throughput is None:
+            # Without an upload throughput every level but the fastest looks like wasted time, so the default is kept
+            return
+        level = min(self.stats, key=lambda x: (self.cost(x), x))
+        if level != self.level:
+            LOGGER.debug(f"Compression level changed from {self.level} to {level}: " +
+                         ", ".join(f"{x}: {self.cost(x) * 1024 ** 2:.3f}s/MiB" for x in self.stats))
+            self.level = level
+
+    def cost(self, level: int) -> float:
+        """Predicted seconds per input byte at a level"""
+        stats = self.stats[level]
+        archive = 1 / stats.speed()
+        upload = stats.ratio() / self.upload_throughput if self.upload_throughput is not None else 0.0
+        return max(archive, upload) if self.overlap else archive + upload
+
+    def choose(self, size: int) -> int:
+        """Level of the next member, accounting its predicted time"""
+        stats = self.stats[self.level]
+        self.used[self.level] = self.used.get(self.level, 0) + 1
+        self.predicted_archive += size / stats.speed()
+        if self.upload_throughput is not None:
+            self.predicted_upload += size * stats.ratio() / self.upload_throughput
+        return self.level
+
+    def report(self, archive_seconds: float, upload_seconds: Optional[float]) -> str:
+        predicted = max(self.predicted_archive, self.predicted_upload) if self.overlap else self.predicted_archive + self.predicted_upload
+        return "Compression levels used (level: members): {}. Predicted {:.1f}s (archive {:.1f}s, upload {:.1f}s), actual archive {:.1f}s{}".format(
+            dict(sorted(self.used.items())), predicted, self.predicted_archive, self.predicted_upload, archive_seconds,
+            f", upload {upload_seconds:.1f}s" if upload_seconds is not None else "")
@@ -0,0 +1,208 @@
+import hashlib
+import io
+import os
+import struct
+from typing import BinaryIO, Optional
+
+from Cryptodome.Cipher import AES
+
+from misc.utils import VaultBackupException
+
+
+class StreamHeader:
+    """Header of a stream encrypted container: one salt, one derived key for the whole stream."""
+
+    MAGIC = b"VBSE"
+    VERSION = 1
+    STRUCT = struct.Struct("<4sBII16s4s")
+    SIZE = STRUCT.size
+    TAG_SIZE = 16
+    KDF_ITERATIONS = 200000
+    DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, chunk_size: int, iterations: int, salt: bytes, nonce_prefix: bytes):
+        self.chunk_size: int = chunk_size
+        self.iterations: int = iterations
+        self.salt: bytes = salt
+        self.nonce_prefix: bytes = nonce_prefix
+
+    @staticmethod
+    def create(chunk_size: int = DEFAULT_CHUNK_SIZE, iterations: int = KDF_ITERATIONS) -> 'StreamHeader':
+        return StreamHeader(chunk_size, iterations, os.urandom(16), os.urandom(4))
+
+    @staticmethod
+    def unpack(data: bytes) -> 'StreamHeader':
+        if len(data) != StreamHeader.SIZE:
+            raise VaultBackupException("Encrypted stream is truncated: incomplete header.")
+        magic, version, chunk_size, iterations, salt, nonce_prefix = StreamHeader.STRUCT.unpack(data)
+        if magic != StreamHeader.MAGIC:
+            raise VaultBackupException("Not a stream encrypted container.")
+        if version != StreamHeader.VERSION:
+            raise VaultBackupException(f"Unsupported stream encryption version: {version}")
+        return StreamHeader(chunk_size, iterations, salt, nonce_prefix)
+
+    def pack(self) -> bytes:
+        return StreamHeader.STRUCT.pack(StreamHeader.MAGIC, StreamHeader.VERSION, self.chunk_size, self.iterations, self.salt, self.nonce_prefix)
+
+    def derive_key(self, password: str) -> bytes:
+        return hashlib.pbkdf2_hmac("sha256", password.encode(), self.salt, self.iterations, 32)
+
+    def frame_size(self) -> int:
+        return self.chunk_size + StreamHeader.TAG_SIZE
+
+    def frame_cipher(self, key: bytes, index: int, final: bool):
+        cipher = AES.new(key, AES.MODE_GCM, nonce=self.nonce_prefix + struct.pack("<Q", index))
+        # Header, frame index and the final flag are authenticated, so frames cannot be reordered, spliced or cut off
+        cipher.update(self.pack() + struct.pack("<QB", index, 1 if final else 0))
+        return cipher
+
+
+class EncryptedStreamWriter(io.RawIOBase):
+    """Write-only stream that encrypts everything written to it as AES-GCM frames of a fixed plaintext size.
+
+    `iterations` may only be lowered when the password is already a strong key, derived once for many streams.
+    """
+
+    def __init__(self, raw: BinaryIO, password: str, chunk_size: int = StreamHeader.DEFAULT_CHUNK_SIZE, iterations: int = StreamHeader.KDF_ITERATIONS):
+        super().__init__()
+        if not password:
+            raise VaultBackupException("Stream encryption requires a password.")
+        self.__raw = raw
+        self.__header = StreamHeader.create(chunk_size, iterations)
+        self.__key = self.__header.derive_key(password)
+        self.__buffer = bytearray()
+        self.__index = 0
+        self.__position = 0
+        self.__raw.write(self.__header.pack())
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def tell(self) -> int:
+        return self.__position
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        self.__buffer += data
+        self.__position += len(data)
+        chunk_size = self.__header.chunk_size
+        # Keep at least one byte buffered so the last frame is always written by close() with the final flag
+        if len(self.__buffer) > chunk_size:
+            frames = (len(self.__buffer) - 1) // chunk_size
+            view = memoryview(self.__buffer)
+            for i in range(frames):
+                self.__write_frame(view[i * chunk_size:(i + 1) * chunk_size], False)
+            view.release()
+            del self.__buffer[:frames * chunk_size]
+        return len(data)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            self.__write_frame(self.__buffer, True)
+            self.__buffer = bytearray()
+            self.__raw.close()
+        finally:
+            super().close()
+
+    def __write_frame(self, data, final: bool) -> None:
+        ciphertext, tag = self.__header.frame_cipher(self.__key, self.__index, final).encrypt_and_digest(data)
+        self.__raw.write(ciphertext)
+        self.__raw.write(tag)
+        self.__index += 1
+
+
+class EncryptedStreamReader(io.RawIOBase):
+    """Seekable reader of a stream encrypted container. Only the frames that are actually read get decrypted."""
+
+    def __init__(self, raw: BinaryIO, password: str):
+        super().__init__()
+        if not password:
+            raise VaultBackupException("Stream encryption requires a password.")
+        self.__raw = raw
+        self.__raw.seek(0)
+        self.__header = StreamHeader.unpack(self.__raw.read(StreamHeader.SIZE))
+        self.__key = self.__header.derive_key(password)
+        raw_size = self.__raw.seek(0, io.SEEK_END) - StreamHeader.SIZE
+        frame_size = self.__header.frame_size()
+        self.__frames = max(1, -(-raw_size // frame_size))
+        last_frame = raw_size - (self.__frames - 1) * frame_size
+        if last_frame < StreamHeader.TAG_SIZE:
+            raise VaultBackupException("Encrypted stream is truncated: incomplete frame.")
+        self.size: int = (self.__frames - 1) * self.__header.chunk_size + last_frame - StreamHeader.TAG_SIZE
+        self.__position = 0
+        self.__cached_index: Optional[int] = None
+        self.__cached_data = b""
+
+    @staticmethod
+    def open(path: str, password: str) -> 'EncryptedStreamReader':
+        return EncryptedStreamReader(open(path, 'rb'), password)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.__position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.__position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if position < 0:
+            raise ValueError("Negative seek position.")
+        self.__position = position
+        return position
+
+    def readinto(self, buffer) -> int:
+        if self.__position >= self.size:
+            return 0
+        chunk_size = self.__header.chunk_size
+        index, offset = divmod(self.__position, chunk_size)
+        data = self.__read_frame(index)
+        length = min(len(buffer), len(data) - offset)
+        buffer[:length] = data[offset:offset + length]
+        self.__position += length
+        return length
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = max(0, self.size - self.__position)
+        result = bytearray()
+        while len(result) < size:
+            buffer = bytearray(min(size - len(result), self.__header.chunk_size))
+            length = self.readinto(buffer)
+            if length == 0:
+                break
+            result += buffer[:length]
+        return bytes(result)
+
+    def close(self) -> None:
+        if not self.closed:
+            self.__raw.close()
+        super().close()
+
+    def __read_frame(self, index: int) -> bytes:
+        if self.__cached_index != index:
+            frame_size = self.__header.frame_size()
+            self.__raw.seek(StreamHeader.SIZE + index * frame_size)
+            frame = self.__raw.read(frame_size)
+            ciphertext, tag = frame[:-StreamHeader.TAG_SIZE], frame[-StreamHeader.TAG_SIZE:]
+            try:
+                self.__cached_data = self.__header.frame_cipher(self.__key, index, index == self.__frames - 1).decrypt_and_verify(ciphertext, tag)
+            except ValueError:
+                raise VaultBackupException(f"Encrypted stream is corrupted or the password is wrong (frame {index}).")
+            self.__cached_index = index
+        return self.__cached_data
@@ -0,0 +1,234 @@
+import os
+import time
+from typing import List, Optional, Callable
+
+from core.s3 import S3Client, ObjectUploader
+from core.ssh import SSHConnection
+from core.transfer import LocalTransfer
+from core.type import ArchiveDestination, S3Info
+from misc.utils import LOGGER, VaultBackupException, file_checksum
+
+
+class DestinationBackend:
+    """Stores the files of the versions of an archive at a destination: transfers them and lists and deletes them for
+    the retention.
+
+    A file appears under its final name only once it is complete and its checksum verified, so an interrupted transfer
+    never leaves a file that looks like a version. Destinations of backends in the same `group` can be filled from one
+    another with a server-side copy instead of a transfer.
+    """
+
+    PART_SUFFIX = ".part"
+
+    def __init__(self, destination: ArchiveDestination):
+        self.destination: ArchiveDestination = destination
+
+    def group(self) -> tuple:
+        raise NotImplementedError()
+
+    def upload(self, path: str, checksum: Optional[str]) -> None:
+        raise NotImplementedError()
+
+    def duplicate(self, source: 'DestinationBackend', path: str, checksum: Optional[str]) -> bool:
+        """Fills the destination from the copy of the file at `source`. False if it cannot, the file is uploaded instead"""
+        return False
+
+    def remove_partial(self, path: str) -> None:
+        """Removes what an interrupted transfer of the file left"""
+        raise NotImplementedError()
+
+    def list(self) -> List[str]:
+        """Names of the files of the destination"""
+        raise NotImplementedError()
+
+    def read(self, name: str) -> bytes:
+        raise NotImplementedError()
+
+    def delete(self, names: List[str]) -> None:
+        raise NotImplementedError()
+
+    def _target(self, path: str) -> str:
+        return os.path.join(self.destination.path, os.path.basename(path))
+
+
+class LocalBackend(DestinationBackend):
+
+    def __init__(self, destination: ArchiveDestination, transfer: LocalTransfer, throttle: Optional[Callable[[int], None]] = None):
+        super().__init__(destination)
+        self.__transfer = transfer
+        self.__throttle = throttle
+
+    def group(self) -> tuple:
+        # Destinations on the same filesystem share their files through hardlinks
+        try:
+            return False, os.stat(self.destination.path).st_dev
+        except OSError:
+            return False, self.destination.path
+
+    def upload(self, path: str, checksum: Optional[str]) -> None:
+        LOGGER.info(f"[{self.destination.label}] Copying '{path}' to '{self.destination.path}'")
+        copied = self.__transfer.copy(path, self._target(path) + DestinationBackend.PART_SUFFIX, self.__throttle)
+        LOGGER.info(f"[{self.destination.label}] Copied: {copied}")
+        self.__complete(self._target(path), checksum)
+
+    def duplicate(self, source: DestinationBackend, path: str, checksum: Optional[str]) -> bool:
+        source_path, target_path = source._target(path), self._target(path)
+        # The link or copy replaces an existing file only once it is complete
+        part_path = target_path + DestinationBackend.PART_SUFFIX
+        if os.path.lexists(part_path):
+            os.remove(part_path)
+        try:
+            os.link(source_path, part_path)
+            os.replace(part_path, target_path)
+            LOGGER.info(f"[{self.destination.label}] Hardlinked '{source_path}' to '{self.destination.path}'")
+            return True
+        except OSError as e:
+            LOGGER.debug(f"[{self.destination.label}] Cannot hardlink '{source_path}': {e}")
+        LOGGER.info(f"[{self.destination.label}] Copying '{source_path}' to '{self.destination.path}'")
+        copied = self.__transfer.copy(source_path, target_path + DestinationBackend.PART_SUFFIX, self.__throttle)
+        LOGGER.info(f"[{self.destination.label}] Copied: {copied}")
+        self.__complete(target_path, checksum)
+        return True
+
+    def remove_partial(self, path: str) -> None:
+        part_path = self._target(path) + DestinationBackend.PART_SUFFIX
+        if os.path.lexists(part_path):
+            os.remove(part_path)
+
+    def list(self) -> List[str]:
+        return [x for x in os.listdir(self.destination.path) if os.path.isfile(os.path.join(self.destination.path, x))]
+
+    def read(self, name: str) -> bytes:
+        with open(os.path.join(self.destination.path, name), 'rb') as file:
+            return file.read()
+
+    def delete(self, names: List[str]) -> None:
+        for name in names:
+            os.remove(os.path.join(self.destination.path, name))
+
+    # noinspection PyMethodMayBeStatic
+    def __complete(self, target_path: str, checksum: Optional[str]) -> None:
+        part_path = target_path + DestinationBackend.PART_SUFFIX
+        if checksum is not None:
+            actual_checksum = file_checksum(part_path)
+            if actual_checksum != checksum:
+                raise VaultBackupException(f"Checksum mismatch for '{target_path}': expected {checksum}, found {actual_checksum}")
+        os.replace(part_path, target_path)
+
+
+class SSHBackend(DestinationBackend):
+
+    def __init__(self, destination: ArchiveDestination, ssh: SSHConnection, progress: Optional[Callable] = None):
+        super().__init__(destination)
+        self.__ssh = ssh
+        self.__progress = progress
+
+    def group(self) -> tuple:
+        # All remote destinations go through the same SSH connection, so they share one host
+        return True, None
+
+    def upload(self, path: str, checksum: Optional[str]) -> None:
+        LOGGER.info(f"[{self.destination.label}] Uploading '{path}' to '{self.destination.path}'")
+        self.__ssh.upload(path, self._target(path) + DestinationBackend.PART_SUFFIX, False, self.__progress)
+        self.__complete(self._target(path), checksum)
+
+    def duplicate(self, source: DestinationBackend, path: str, checksum: Optional[str]) -> bool:
+        source_path, target_path = source._target(path), self._target(path)
+        try:
+            LOGGER.info(f"[{self.destination.label}] Server-side copy of '{source_path}' to '{self.destination.path}'")
+            self.__ssh.execute(f"cp --reflink=auto '{source_path}' '{target_path}{DestinationBackend.PART_SUFFIX}'")
+        except Exception as e:
+            LOGGER.warning(f"[{self.destination.label}] Server-side copy failed, uploading instead: {e}")
+            return False
+        self.__complete(target_path, checksum)
+        return True
+
+    def remove_partial(self, path: str) -> None:
+        self.__ssh.execute(f"rm -f '{self._target(path)}{DestinationBackend.PART_SUFFIX}'")
+
+    def list(self) -> List[str]:
+        files = self.__ssh.execute(f"find '{self.destination.path}' -type f -maxdepth 1")[1]
+        return [os.path.relpath(x.replace("\n", ""), self.destination.path) for x in files]
+
+    def read(self, name: str) -> bytes:
+        return self.__ssh.execute(f"cat '{os.path.join(self.destination.path, name)}'")[1].read()
+
+    def delete(self, names: List[str]) -> None:
+        for name in names:
+            self.__ssh.execute(f"rm '{os.path.join(self.destination.path, name)}'")
+
+    def __complete(self, target_path: str, checksum: Optional[str]) -> None:
+        part_path = target_path + DestinationBackend.PART_SUFFIX
+        if checksum is not None:
+            actual_checksum = self.__ssh.checksum(part_path)
+            if actual_checksum != checksum:
+                raise VaultBackupException(f"Checksum mismatch for '{target_path}': expected {checksum}, found {actual_checksum}")
+        self.__ssh.execute(f"mv -f '{part_path}' '{target_path}'")
+
+
+class S3Backend(DestinationBackend):
+    """Objects under `<bucket>/<prefix>` of an S3 compatible store.
+
+    Files are uploaded in parts sent in parallel (see ObjectUploader), which is how the bandwidth of an object store is
+    reached, and are verified against their ETags. An object appears only once its upload is complete, so nothing is
+    renamed; an interrupted upload is aborted. The retention lists the prefix on the server and deletes by batches.
+    """
+
+    def __init__(self, destination: ArchiveDestination, client: S3Client, info: S3Info, throttle: Optional[Callable[[int], None]] = None,
+                 check_cancelled: Optional[Callable[[], None]] = None):
+        super().__init__(destination)
+        self.__client = client
+        self.__info = info
+        self.__bucket, _, self.__prefix = destination.path.partition("/")
+        self.__uploader = ObjectUploader(client, info.part_size, info.parallel_parts, throttle, check_cancelled)
+
+    def group(self) -> tuple:
+        return "s3", self.__info.endpoint
+
+    def upload(self, path: str, checksum: Optional[str]) -> None:
+        LOGGER.info(f"[{self.destination.label}] Uploading '{path}' to '{self.__info.endpoint}/{self.destination.path}'")
+        start = time.perf_counter()
+        etag = self.__uploader.upload(path, self.__bucket, self.__key(path), {"sha256": checksum} if checksum is not None else None)
+        seconds = time.perf_counter() - start
+        size = os.path.getsize(path)
+        LOGGER.info(f"[{self.destination.label}] Uploaded: {size / 1024 ** 2:.1f} MiB in {seconds:.2f}s "
+                    f"({size / 1024 ** 2 / seconds if seconds > 0 else 0:.1f} MiB/s), ETag {etag}")
+
+    def duplicate(self, source: DestinationBackend, path: str, checksum: Optional[str]) -> bool:
+        if not isinstance(source, S3Backend) or os.path.getsize(path) > S3Client.MAX_COPY_SIZE:
+            return False
+        source_head = self.__client.head_object(source.__bucket, source.__key(path))
+        if source_head is None:
+            return False
+        LOGGER.info(f"[{self.destination.label}] Server-side copy of '{source.destination.path}/{os.path.basename(path)}' to '{self.destination.path}'")
+        etag = self.__client.copy_object(self.__bucket, self.__key(path), source.__bucket, source.__key(path))
+        source_etag = source_head.get("etag", "").strip('"')
+        if etag == source_etag:
+            return True
+        if "-" in source_etag and checksum is not None:
+            # The copy of an object uploaded in parts is given the ETag of a single upload, so the size and the checksum
+            # stored with the object are compared instead
+            head = self.__client.head_object(self.__bucket, self.__key(path)) or {}
+            if head.get("content-length") == source_head.get("content-length") and head.get("x-amz-meta-sha256") == checksum == source_head.get("x-amz-meta-sha256"):
+                return True
+        LOGGER.warning(f"[{self.destination.label}] Server-side copy does not match its source (ETag {etag}, expected {source_etag}), uploading instead")
+        return False
+
+    def remove_partial(self, path: str) -> None:
+        key = self.__key(path)
+        for upload_key, upload_id in self.__client.list_multipart_uploads(self.__bucket, key):
+            if upload_key == key:
+                self.__client.abort_multipart_upload(self.__bucket, key, upload_id)
+
+    def list(self) -> List[str]:
+        prefix = self.__prefix + "/" if self.__prefix else ""
+        return [x.key[len(prefix):] for x in self.__client.list_objects(self.__bucket, prefix, "/")[0]]
+
+    def read(self, name: str) -> bytes:
+        return self.__client.get_object(self.__bucket, self.__key(name))
+
+    def delete(self, names: List[str]) -> None:
+        self.__client.delete_objects(self.__bucket, [self.__key(x) for x in names])
+
+    def __key(self, path: str) -> str:
+        return "/".join(x for x in [self.__prefix, os.path.basename(path)] if x)
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+from functools import partial
+from typing import Callable, Optional, Dict
+
+from core.reader import LargeFileReader
+from misc.utils import LOGGER
+
+
+class HashCache:
+    """Content hashes of files, keyed by (inode, size, mtime_ns), so only files whose key changed are read again."""
+
+    READ_SIZE = 1024 * 1024
+
+    def __init__(self, path: str, throttle: Optional[Callable[[int], None]] = None, release: Optional[Callable[[int], None]] = None):
+        self.path: str = path
+        self.hashed: int = 0
+        self.reused: int = 0
+        self.__throttle = throttle
+        self.__release = release
+        self.__entries: Dict[str, list] = {}
+        self.__seen: Dict[str, list] = {}
+        if os.path.isfile(path):
+            try:
+                with open(path, 'r') as cache_file:
+                    self.__entries = json.loads(cache_file.read())
+            except (OSError, ValueError) as e:
+                LOGGER.warning(f"Hash cache '{path}' cannot be read, all files will be hashed: {e}")
+
+    def get(self, abs_path: str, rel_path: str, stat: os.stat_result) -> str:
+        key = [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+        entry = self.__entries.get(rel_path)
+        if entry is not None and entry[:3] == key:
+            self.reused += 1
+        else:
+            entry = key + [self.__hash(abs_path)]
+            self.hashed += 1
+        self.__seen[rel_path] = entry
+        return entry[3]
+
+    def lookup(self, rel_path: str) -> Optional[str]:
+        """Hash of a file seen in this run, None if it was not seen"""
+        entry = self.__seen.get(rel_path)
+        return entry[3] if entry is not None else None
+
+    def save(self) -> None:
+        """Persists the entries seen since the cache was loaded, dropping the files that no longer exist"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as cache_file:
+            cache_file.write(json.dumps(self.__seen))
+        os.replace(tmp_path, self.path)
+
+    def __hash(self, abs_path: str) -> str:
+        if os.path.getsize(abs_path) >= LargeFileReader.THRESHOLD:
+            reader = LargeFileReader(abs_path, throttle=self.__throttle, release=self.__release)
+            for _ in reader:
+                pass
+            return reader.hexdigest()
+        content_hash = hashlib.sha256()
+        with open(abs_path, 'rb') as file:
+            for data in iter(partial(file.read, HashCache.READ_SIZE), b""):
+                if self.__throttle is not None:
+                    self.__throttle(len(data))
+                content_hash.update(data)
+            if self.__release is not None:
+                self.__release(file.fileno())
+        return content_hash.hexdigest()
+
+
+def tree_fingerprint(root: str, cache: HashCache) -> str:
+    """Hash of the names and contents of every entry under root. Metadata (mtime, permissions) is not part of it"""
+    fingerprint = hashlib.sha256()
+    for crt_path, directories, files in os.walk(root):
+        directories.sort()
+        rel_dir = os.path.relpath(crt_path, root)
+        fingerprint.update(f"D\0{rel_dir}\0".encode())
+        for file in sorted(files):
+            abs_path = os.path.join(crt_path, file)
+            rel_path = os.path.normpath(os.path.join(rel_dir, file))
+            stat = os.stat(abs_path)
+            fingerprint.update(f"F\0{rel_path}\0{stat.st_size}\0{cache.get(abs_path, rel_path, stat)}\0".encode())
+    return fingerprint.hexdigest()
@@ -0,0 +1,166 @@
+import os
+import shutil
+import subprocess
+import threading
+import time
+from functools import partial
+from typing import Optional, Dict, Callable
+
+from core.type import GovernorInfo
+from misc.utils import LOGGER
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `consume` blocks until the requested number of bytes fits in the rate."""
+
+    def __init__(self, rate: Optional[int], burst: Optional[int] = None):
+        self.rate: Optional[int] = rate
+        self.factor: float = 1.0
+        self.__burst = burst if burst is not None else rate
+        self.__tokens = float(self.__burst) if self.__burst is not None else 0.0
+        self.__last = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def consume(self, amount: int) -> None:
+        if self.rate is None:
+            return
+        with self.__lock:
+            rate = self.rate * self.factor
+            now = time.monotonic()
+            self.__tokens = min(float(self.__burst), self.__tokens + (now - self.__last) * rate)
+            self.__last = now
+            # Tokens may go negative: a large request is admitted, and the debt is paid by waiting
+            self.__tokens -= amount
+            wait = -self.__tokens / rate if self.__tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ResourceGovernor:
+    """Keeps a backup run from starving the services it shares the host with.
+
+    Source reads and uploads go through token buckets, source files are dropped from the page cache once read and
+    the process can be moved to a lower CPU and I/O priority. In adaptive mode the rates are scaled down while the
+    system load or the disk latency is above its threshold and scaled back up once it recovers.
+    """
+
+    IONICE_CLASSES = {"realtime": 1, "best-effort": 2, "idle": 3}
+    ADAPTIVE_INTERVAL = 1.0
+    MIN_FACTOR = 1 / 64
+    __priority_lock = threading.Lock()
+    __priority_applied = False
+
+    def __init__(self, info: Optional[GovernorInfo] = None):
+        self.info: GovernorInfo = info if info is not None else GovernorInfo()
+        self.__read_bucket = TokenBucket(self.info.read_rate)
+        self.__upload_buckets: Dict[str, TokenBucket] = {}
+        self.__lock = threading.Lock()
+        self.__factor = 1.0
+        self.__last_check = 0.0
+        self.__disk_stats = self.__read_disk_stats()
+
+    def apply_priority(self) -> None:
+        """Lowers the priority of the process. Priorities are per process, so only the first call has an effect"""
+        with ResourceGovernor.__priority_lock:
+            if ResourceGovernor.__priority_applied:
+                LOGGER.debug("Process priority was already applied")
+                return
+            ResourceGovernor.__priority_applied = True
+        if self.info.nice is not None:
+            LOGGER.info(f"Process niceness: {os.nice(self.info.nice)}")
+        if self.info.ionice_class is not None:
+            if shutil.which("ionice") is None:
+                LOGGER.warning("Cannot set the I/O priority: 'ionice' is not available.")
+                return
+            command = ["ionice", "-c", str(ResourceGovernor.IONICE_CLASSES[self.info.ionice_class]), "-p", str(os.getpid())]
+            if self.info.ionice_level is not None and self.info.ionice_class != "idle":
+                command[3:3] = ["-n", str(self.info.ionice_level)]
+            result = subprocess.run(command, capture_output=True, text=True)
+            if result.returncode != 0:
+                LOGGER.warning(f"Cannot set the I/O priority: {result.stderr.strip()}")
+            else:
+                LOGGER.info(f"I/O priority set to: {self.info.ionice_class}")
+
+    def throttle_read(self, amount: int) -> None:
+        self.__adapt()
+        self.__read_bucket.consume(amount)
+
+    def throttle_upload(self, destination: str, amount: int) -> None:
+        self.__adapt()
+        self.__get_upload_bucket(destination).consume(amount)
+
+    def upload_throttle(self, destination: str) -> Optional[Callable[[int], None]]:
+        """Callback throttling the uploads to a destination, None if uploads are not limited"""
+        if self.info.upload_rate is None and not self.info.adaptive:
+            return None
+        return partial(self.throttle_upload, destination)
+
+    def upload_progress(self, destination: str) -> Optional[Callable]:
+        """Progress callback for SCP uploads, throttling the upload it is attached to. None if uploads are not limited"""
+        if self.info.upload_rate is None and not self.info.adaptive:
+            return None
+        sent_before = {}
+
+        def progress(filename, size, sent) -> None:
+            self.throttle_upload(destination, sent - sent_before.get(filename, 0))
+            sent_before[filename] = sent
+
+        return progress
+
+    def release(self, fd: int) -> None:
+        """Drops a fully read file from the page cache"""
+        if self.info.drop_cache and hasattr(os, "posix_fadvise"):
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            except OSError as e:
+                LOGGER.debug(f"posix_fadvise(POSIX_FADV_DONTNEED) failed: {e}")
+
+    def __get_upload_bucket(self, destination: str) -> TokenBucket:
+        with self.__lock:
+            if destination not in self.__upload_buckets:
+                self.__upload_buckets[destination] = TokenBucket(self.info.upload_rate)
+                self.__upload_buckets[destination].factor = self.__factor
+            return self.__upload_buckets[destination]
+
+    def __adapt(self) -> None:
+        if not self.info.adaptive:
+            return
+        with self.__lock:
+            now = time.monotonic()
+            if now - self.__last_check < ResourceGovernor.ADAPTIVE_INTERVAL:
+                return
+            self.__last_check = now
+            load = os.getloadavg()[0] / (os.cpu_count() or 1)
+            latency = self.__disk_latency()
+            overloaded = load > self.info.max_load or latency > self.info.max_disk_latency
+            factor = max(ResourceGovernor.MIN_FACTOR, self.__factor / 2) if overloaded else min(1.0, self.__factor * 1.25)
+            if factor != self.__factor:
+                LOGGER.debug(f"Adaptive throttling: load {load:.2f}, disk latency {latency:.1f} ms, rate factor {factor:.3f}")
+                self.__factor = factor
+                for bucket in [self.__read_bucket] + list(self.__upload_buckets.values()):
+                    bucket.factor = factor
+        if overloaded and self.info.read_rate is None and self.info.upload_rate is None:
+            # Without rates to scale down, back off by pausing
+            time.sleep(ResourceGovernor.ADAPTIVE_INTERVAL * (1 - factor))
+
+    def __disk_latency(self) -> float:
+        """Average time per completed I/O in ms, across all disks, since the previous call"""
+        stats = self.__read_disk_stats()
+        ios = sum(stats.get(x, (0, 0))[0] - self.__disk_stats.get(x, (0, 0))[0] for x in stats)
+        ticks = sum(stats.get(x, (0, 0))[1] - self.__disk_stats.get(x, (0, 0))[1] for x in stats)
+        self.__disk_stats = stats
+        return ticks / ios if ios > 0 else 0.0
+
+    # noinspection PyMethodMayBeStatic
+    def __read_disk_stats(self) -> Dict[str, tuple]:
+        stats = {}
+        try:
+            with open("/proc/diskstats", 'r') as disk_stats:
+                for line in disk_stats:
+                    fields = line.split()
+                    if len(fields) >= 11 and not fields[2].startswith(("loop", "ram")):
+                        # reads completed, ms reading, writes completed, ms writing
+                        stats[fields[2]] = (int(fields[3]) + int(fields[7]), int(fields[6]) + int(fields[10]))
+        except OSError:
+            pass
+        return stats
@@ -0,0 +1,163 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+from functools import partial
+from typing import Optional, Callable, List, BinaryIO
+
+from core.crypto import EncryptedStreamWriter, EncryptedStreamReader
+from core.progress import ProgressReporter
+from core.transfer import LocalTransfer
+from misc.utils import LOGGER, VaultBackupException, write_atomic
+
+
+class Mirror:
+    """Browsable snapshot directories of a local destination, one per version.
+
+    Layout: `.mirror.json` (key derivation parameters, when files are encrypted), `<prefix><timestamp>/` (the tree of a
+    snapshot) and `<prefix><timestamp>.manifest.json` (size, mtime and stored suffix of every file). Files whose size
+    and mtime match the previous snapshot are hardlinked to it, so a new snapshot costs the changed files only.
+    Changed files are copied, optionally gzip compressed (".gz") and stream encrypted (".enc"). A snapshot is
+    written to a ".part" directory and is complete once its manifest exists.
+    """
+
+    CONFIG = ".mirror.json"
+    MANIFEST_SUFFIX = ".manifest.json"
+    PART_SUFFIX = ".part"
+    VERSION = 1
+    KDF_ITERATIONS = 200000
+    READ_SIZE = 1024 * 1024
+
+    def __init__(self, path: str, prefix: str, password: Optional[str] = None, compress: bool = False, encrypt: bool = False,
+                 transfer: Optional[LocalTransfer] = None):
+        if encrypt and not password:
+            raise VaultBackupException(f"Mirror '{path}' is encrypted, but no password was provided.")
+        self.path: str = path
+        self.prefix: str = prefix
+        self.compress: bool = compress
+        self.encrypt: bool = encrypt
+        self.suffix: str = (".gz" if compress else "") + (".enc" if encrypt else "")
+        self.linked: int = 0
+        self.copied: int = 0
+        self.copied_bytes: int = 0
+        self.__transfer = transfer if transfer is not None else LocalTransfer()
+        self.__pattern = re.compile(re.escape(prefix) + r"\d{8}_\d{6}$")
+        os.makedirs(path, exist_ok=True)
+        self.__secret = self.__load_secret(password) if password and (encrypt or os.path.isfile(os.path.join(path, Mirror.CONFIG))) else None
+
+    def snapshots(self) -> List[str]:
+        """Complete snapshots, oldest first"""
+        return sorted(x for x in os.listdir(self.path) if self.__pattern.match(x) and os.path.isfile(self.__manifest_path(x)))
+
+    def read_manifest(self, name: str) -> dict:
+        with open(self.__manifest_path(name), 'r') as manifest:
+            return json.load(manifest)
+
+    def backup(self, source: str, name: str, throttle: Optional[Callable[[int], None]] = None, check: Optional[Callable[[], None]] = None,
+               progress: Optional[ProgressReporter] = None) -> None:
+        """Writes a snapshot of source. `check` is called for every entry and may raise to stop the backup"""
+        snapshots = self.snapshots()
+        previous = snapshots[-1] if len(snapshots) > 0 else None
+        previous_files = self.read_manifest(previous)["files"] if previous is not None else {}
+        part_path = os.path.join(self.path, name + Mirror.PART_SUFFIX)
+        if os.path.exists(part_path):
+            shutil.rmtree(part_path)
+        files, directories = {}, []
+        for crt_path, dir_names, file_names in os.walk(source):
+            for directory in dir_names:
+                rel_path = os.path.relpath(os.path.join(crt_path, directory), source)
+                os.makedirs(os.path.join(part_path, rel_path))
+                directories.append(rel_path)
+            os.makedirs(os.path.join(part_path, os.path.relpath(crt_path, source)), exist_ok=True)
+            for file in file_names:
+                if check is not None:
+                    check()
+                abs_path = os.path.join(crt_path, file)
+                rel_path = os.path.relpath(abs_path, source)
+                stat = os.stat(abs_path)
+                files[rel_path] = [stat.st_size, stat.st_mtime_ns, self.suffix]
+                target = os.path.join(part_path, rel_path + self.suffix)
+                if previous_files.get(rel_path) == files[rel_path] and self.__link(os.path.join(self.path, previous, rel_path + self.suffix), target):
+                    self.linked += 1
+                    size = 0
+                else:
+                    self.__store(abs_path, target, stat, throttle)
+                    self.copied += 1
+                    self.copied_bytes += stat.st_size
+                    size = stat.st_size
+                if progress is not None:
+                    progress.update(rel_path, size)
+        os.replace(part_path, os.path.join(self.path, name))
+        write_atomic(self.__manifest_path(name), json.dumps({"source": source, "directories": directories, "files": files}))
+        LOGGER.debug(f"Mirror snapshot '{name}': {self.linked} files linked, {self.copied} copied ({self.copied_bytes} bytes)")
+
+    def prune(self, keep: int) -> List[str]:
+        """Removes the oldest snapshots, and leftovers of incomplete ones. Returns the removed snapshot names"""
+        snapshots = self.snapshots()
+        removed = snapshots[:max(0, len(snapshots) - keep)]
+        for name in os.listdir(self.path):
+            snapshot = name[:-len(Mirror.PART_SUFFIX)] if name.endswith(Mirror.PART_SUFFIX) else name
+            if self.__pattern.match(snapshot) and (name in removed or name not in snapshots) and os.path.isdir(os.path.join(self.path, name)):
+                shutil.rmtree(os.path.join(self.path, name))
+        for name in removed:
+            os.remove(self.__manifest_path(name))
+        return removed
+
+    def open(self, name: str, rel_path: str) -> BinaryIO:
+        """Readable stream of a file of a snapshot, decrypted and decompressed"""
+        size, mtime, suffix = self.read_manifest(name)["files"][rel_path]
+        stream = open(os.path.join(self.path, name, rel_path + suffix), 'rb')
+        if suffix.endswith(".enc"):
+            if self.__secret is None:
+                raise VaultBackupException(f"Mirror '{self.path}' is encrypted, but no password was provided.")
+            stream = EncryptedStreamReader(stream, self.__secret)
+        if suffix.startswith(".gz"):
+            stream = gzip.GzipFile(fileobj=stream, mode='rb')
+        return stream
+
+    def __manifest_path(self, name: str) -> str:
+        return os.path.join(self.path, name + Mirror.MANIFEST_SUFFIX)
+
+    # noinspection PyMethodMayBeStatic
+    def __link(self, source: str, target: str) -> bool:
+        try:
+            os.link(source, target)
+            return True
+        except OSError as e:
+            # Missing in the previous snapshot, too many links or another filesystem: the file is copied
+            LOGGER.debug(f"Cannot link '{target}' to '{source}': {e}")
+            return False
+
+    def __store(self, source: str, target: str, stat: os.stat_result, throttle: Optional[Callable[[int], None]]) -> None:
+        if not self.compress and not self.encrypt:
+            self.__transfer.copy(source, target, throttle)
+            return
+        with open(source, 'rb') as src, open(target, 'wb') as raw:
+            output = EncryptedStreamWriter(raw, self.__secret, iterations=1) if self.encrypt else raw
+            with output, (gzip.GzipFile(fileobj=output, mode='wb', compresslevel=6, mtime=0) if self.compress else output) as dst:
+                for data in iter(partial(src.read, Mirror.READ_SIZE), b""):
+                    if throttle is not None:
+                        throttle(len(data))
+                    dst.write(data)
+        os.chmod(target, stat.st_mode & 0o7777)
+        os.utime(target, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    def __load_secret(self, password: str) -> str:
+        """Key derived once from the password. Files are encrypted with it and a salt of their own, without a slow derivation each"""
+        config_path = os.path.join(self.path, Mirror.CONFIG)
+        if os.path.isfile(config_path):
+            with open(config_path, 'r') as config_file:
+                config = json.load(config_file)
+            if config.get("version") != Mirror.VERSION:
+                raise VaultBackupException(f"Unsupported mirror version: {config.get('version')}")
+            secret = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(config["salt"]), config["iterations"]).hex()
+            if hashlib.sha256(secret.encode()).hexdigest() != config["key_check"]:
+                raise VaultBackupException(f"Wrong password for mirror '{self.path}'.")
+            return secret
+        salt = os.urandom(16)
+        secret = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, Mirror.KDF_ITERATIONS).hex()
+        write_atomic(config_path, json.dumps({"version": Mirror.VERSION, "salt": salt.hex(), "iterations": Mirror.KDF_ITERATIONS,
+                                              "key_check": hashlib.sha256(secret.encode()).hexdigest()}, indent='\t'))
+        return secret
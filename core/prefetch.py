@@ -0,0 +1,93 @@
+import queue
+import threading
+from functools import partial
+from typing import Callable, Iterator, List, Tuple, Dict, Any, BinaryIO
+
+from misc.utils import LOGGER
+
+
+class Prefetcher:
+    """Reads items in parallel threads and hands out their content in the order of the items.
+
+    Every worker has its own opener (an SFTP channel for remote sources), takes the next item, reads it in chunks of
+    `chunk_size` and queues them for the consumer. A worker holds at most `max_chunks` chunks of the item it reads,
+    so memory is bounded by workers * max_chunks * chunk_size whatever the size of the items. The chunks of an item
+    must be read to the end before the next item is taken.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+    MAX_CHUNKS = 4
+    __END = object()
+
+    def __init__(self, items: List[Any], openers: List[Callable[[Any], BinaryIO]], chunk_size: int = CHUNK_SIZE, max_chunks: int = MAX_CHUNKS):
+        self.items: List[Any] = items
+        self.chunk_size: int = chunk_size
+        self.max_chunks: int = max_chunks
+        self.__openers = openers
+        self.__condition = threading.Condition()
+        self.__queues: Dict[int, queue.Queue] = {}
+        self.__next = 0
+        self.__stopped = False
+        self.__workers: List[threading.Thread] = []
+
+    def __enter__(self) -> 'Prefetcher':
+        self.__workers = [threading.Thread(target=self.__work, args=(x,), name=f"prefetch-{index}", daemon=True) for index, x in enumerate(self.__openers)]
+        for worker in self.__workers:
+            worker.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        with self.__condition:
+            self.__stopped = True
+            self.__condition.notify_all()
+        for worker in self.__workers:
+            worker.join()
+
+    def __iter__(self) -> Iterator[Tuple[Any, Iterator[bytes]]]:
+        """Yields (item, chunks) for every item, in order"""
+        for index, item in enumerate(self.items):
+            with self.__condition:
+                while index not in self.__queues:
+                    self.__condition.wait()
+                chunks = self.__queues.pop(index)
+            yield item, self.__read(chunks)
+
+    @staticmethod
+    def __read(chunks: queue.Queue) -> Iterator[bytes]:
+        while True:
+            data = chunks.get()
+            if data is Prefetcher.__END:
+                return
+            if isinstance(data, BaseException):
+                raise data
+            yield data
+
+    def __work(self, opener: Callable[[Any], BinaryIO]) -> None:
+        while True:
+            with self.__condition:
+                if self.__stopped or self.__next >= len(self.items):
+                    return
+                index = self.__next
+                self.__next += 1
+                chunks = queue.Queue(self.max_chunks)
+                self.__queues[index] = chunks
+                self.__condition.notify_all()
+            try:
+                with opener(self.items[index]) as file:
+                    for data in iter(partial(file.read, self.chunk_size), b""):
+                        if not self.__put(chunks, data):
+                            return
+                self.__put(chunks, Prefetcher.__END)
+            except Exception as e:
+                LOGGER.debug(f"Cannot read '{self.items[index]}': {e}")
+                self.__put(chunks, e)
+
+    def __put(self, chunks: queue.Queue, data: Any) -> bool:
+        """Waits for room in the queue of the item. False if the consumer stopped"""
+        while not self.__stopped:
+            try:
+                chunks.put(data, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
@@ -0,0 +1,126 @@
+import json
+import os
+import time
+from datetime import datetime
+from typing import Optional, Callable
+
+from core.type import ProgressInfo
+from misc.utils import LOGGER
+
+
+class ProgressReporter:
+    """Aggregates the progress of a phase and reports it at a fixed interval instead of once per entry.
+
+    `update` only increments counters and compares a clock, so it can be called for every file of the tree. Every
+    `interval` seconds the counters, the current path, the rate and (when the totals are known) the ETA are logged,
+    written to the status file and passed to the listener. Per-entry tracing is opt-in and sampled: one entry in
+    `trace_sample` is logged.
+    """
+
+    def __init__(self, info: Optional[ProgressInfo] = None):
+        self.info: ProgressInfo = info if info is not None else ProgressInfo()
+        self.phase: Optional[str] = None
+        self.files: int = 0
+        self.bytes: int = 0
+        self.total_files: Optional[int] = None
+        self.total_bytes: Optional[int] = None
+        self.current: Optional[str] = None
+        self.listener: Optional[Callable[[dict], None]] = None
+        self.__start = 0.0
+        self.__next_report = 0.0
+        self.__traced = 0
+
+    def start(self, phase: str, total_files: Optional[int] = None, total_bytes: Optional[int] = None) -> None:
+        self.phase = phase
+        self.files, self.bytes, self.current = 0, 0, None
+        self.total_files, self.total_bytes = total_files, total_bytes
+        self.__start = time.monotonic()
+        self.__next_report = self.__start + self.info.interval
+        self.__traced = 0
+
+    def update(self, path: str, size: int = 0) -> None:
+        self.files += 1
+        self.bytes += size
+        self.current = path
+        if time.monotonic() >= self.__next_report:
+            self.report()
+
+    def add_bytes(self, size: int) -> None:
+        """Progress inside a large entry, so long files do not stall the report"""
+        self.bytes += size
+        if time.monotonic() >= self.__next_report:
+            self.report()
+
+    def trace(self, kind: str, path: str) -> None:
+        if self.info.trace_sample <= 0:
+            return
+        self.__traced += 1
+        if self.__traced % self.info.trace_sample == 0:
+            LOGGER.debug(f"{kind}: {path}")
+
+    def rate(self) -> float:
+        """Bytes per second since the phase started"""
+        elapsed = time.monotonic() - self.__start
+        return self.bytes / elapsed if elapsed > 0 else 0.0
+
+    def eta(self) -> Optional[float]:
+        """Seconds left, None when the totals are not known"""
+        rate = self.rate()
+        if self.total_bytes is None or rate <= 0:
+            return None
+        return max(0.0, (self.total_bytes - self.bytes) / rate)
+
+    def status(self) -> dict:
+        return {
+            "phase": self.phase,
+            "files": self.files,
+            "total_files": self.total_files,
+            "bytes": self.bytes,
+            "total_bytes": self.total_bytes,
+            "rate": self.rate(),
+            "eta": self.eta(),
+            "current": self.current,
+            "updated": datetime.now().isoformat()
+        }
+
+    def report(self) -> None:
+        self.__next_report = time.monotonic() + self.info.interval
+        eta = self.eta()
+        total_files = f"/{self.total_files}" if self.total_files is not None else ""
+        total_bytes = f"/{self.total_bytes / 1024 ** 2:.1f}" if self.total_bytes is not None else ""
+        LOGGER.info(f"[{self.phase}] {self.files}{total_files} files, {self.bytes / 1024 ** 2:.1f}{total_bytes} MiB, "
+                    f"{self.rate() / 1024 ** 2:.1f} MiB/s" + (f", ETA {eta:.0f}s" if eta is not None else "") + f" - {self.current}")
+        if self.info.status_file is not None or self.listener is not None:
+            status = self.status()
+            if self.info.status_file is not None:
+                self.__write_status(status)
+            if self.listener is not None:
+                self.listener(status)
+
+    def finish(self) -> None:
+        self.report()
+        self.phase = None
+
+    def __write_status(self, status: dict) -> None:
+        tmp_path = self.info.status_file + ".tmp"
+        try:
+            with open(tmp_path, 'w') as status_file:
+                status_file.write(json.dumps(status))
+            os.replace(tmp_path, self.info.status_file)
+        except OSError as e:
+            LOGGER.warning(f"Cannot write the status file '{self.info.status_file}': {e}")
+
+
+def scan_totals(root: str) -> (int, int):
+    """Number of files and bytes under root, used as totals for the ETA"""
+    files, size = 0, 0
+    directories = [root]
+    while len(directories) > 0:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                else:
+                    files += 1
+                    size += entry.stat().st_size if entry.is_file() else 0
+    return files, size
@@ -0,0 +1,178 @@
+import fcntl
+import os
+import queue
+import struct
+import threading
+import time
+from typing import Optional, Callable, Iterator, List, Tuple, Any
+
+from core.reader import LargeFileReader
+from misc.utils import LOGGER
+
+
+class ReadOrder:
+    """Order files are read in, to turn the random seeks of a walk over a spinning disk into a sweep across it"""
+
+    WALK = "walk"
+    INODE = "inode"
+    EXTENT = "extent"
+    ORDERS = [WALK, INODE, EXTENT]
+
+    FS_IOC_FIEMAP = 0xC020660B
+    FIEMAP_HEADER = "=QQLLLL"
+    FIEMAP_EXTENT = "=QQQQQL"
+    FIEMAP_EXTENT_SIZE = 56
+    # Extents of data not written back yet have no location
+    FIEMAP_EXTENT_UNKNOWN = 0x2
+
+    @staticmethod
+    def physical_offset(path: str) -> Optional[int]:
+        """Physical offset of the first extent of a file (FIEMAP). None if it has no extent (empty or inline file), its
+        location is not known yet or the filesystem does not report extents"""
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return None
+        try:
+            request = bytearray(struct.pack(ReadOrder.FIEMAP_HEADER, 0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0) + bytes(ReadOrder.FIEMAP_EXTENT_SIZE))
+            fcntl.ioctl(fd, ReadOrder.FS_IOC_FIEMAP, request, True)
+        except OSError:
+            return None
+        finally:
+            os.close(fd)
+        if struct.unpack_from(ReadOrder.FIEMAP_HEADER, request)[3] == 0:
+            return None
+        _, physical, _, _, _, flags = struct.unpack_from(ReadOrder.FIEMAP_EXTENT, request, struct.calcsize(ReadOrder.FIEMAP_HEADER))
+        return physical if not flags & ReadOrder.FIEMAP_EXTENT_UNKNOWN else None
+
+    @staticmethod
+    def key(order: str, entry: os.DirEntry) -> Tuple[int, int]:
+        """Sort key of a file. Files without an extent go after the others, by inode"""
+        if order == ReadOrder.EXTENT:
+            offset = ReadOrder.physical_offset(entry.path)
+            if offset is not None:
+                return 0, offset
+        return (1, entry.inode()) if order != ReadOrder.WALK else (0, 0)
+
+
+class ReadAhead:
+    """Reads the files of a walk in a background thread, ahead of the archive and in the order of the disk.
+
+    Entries are taken from the walk in batches of up to `batch_size` bytes (and MAX_FILES files). The files of a batch
+    are read in `order` while the previous batch is compressed and encrypted, and the batch is then handed out in the
+    order of the walk, so the archive has the same entries in the same order whatever the read order. At most three
+    batches are held: the one consumed, one ready and one being read. Files of LargeFileReader.THRESHOLD or more, or
+    larger than a batch, and entries rejected by `skip` are handed out without data, to be read in place.
+    """
+
+    DEFAULT_BATCH_SIZE = 64 * 1024 * 1024
+    MAX_FILES = 4096
+    __END = object()
+
+    def __init__(self, entries: Iterator[Tuple[os.DirEntry, bool]], order: str = ReadOrder.WALK, batch_size: int = DEFAULT_BATCH_SIZE,
+                 skip: Optional[Callable[[os.DirEntry], bool]] = None, throttle: Optional[Callable[[int], None]] = None,
+                 release: Optional[Callable[[int], None]] = None):
+        self.order: str = order
+        self.batch_size: int = batch_size
+        self.files: int = 0
+        self.read_bytes: int = 0
+        self.read_seconds: float = 0.0
+        self.__entries = entries
+        self.__skip = skip
+        self.__throttle = throttle
+        self.__release = release
+        self.__batches: queue.Queue = queue.Queue(1)
+        self.__stopped = threading.Event()
+        self.__worker: Optional[threading.Thread] = None
+
+    def __enter__(self) -> 'ReadAhead':
+        self.__worker = threading.Thread(target=self.__work, name="read-ahead", daemon=True)
+        self.__worker.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.__stopped.set()
+        # Unblocks the worker waiting for room in the queue
+        while self.__worker.is_alive():
+            try:
+                self.__batches.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        if exc_type is None:
+            LOGGER.info(self.report())
+
+    def __iter__(self) -> Iterator[Tuple[os.DirEntry, bool, Optional[bytes]]]:
+        """Yields (entry, is_dir, data) in the order of the walk. Data is None for the entries to read in place"""
+        while True:
+            batch = self.__batches.get()
+            if batch is ReadAhead.__END:
+                return
+            if isinstance(batch, BaseException):
+                raise batch
+            yield from batch
+
+    def report(self) -> str:
+        """Read throughput of the preloaded files"""
+        rate = self.read_bytes / self.read_seconds / 1024 ** 2 if self.read_seconds > 0 else 0.0
+        return f"Read ahead {self.files} files, {self.read_bytes} bytes in {self.read_seconds:.2f}s ({rate:.1f} MiB/s), {self.order} order"
+
+    def __work(self) -> None:
+        try:
+            batch, size = [], 0
+            for entry, is_dir in self.__entries:
+                if self.__stopped.is_set():
+                    return
+                batch.append([entry, is_dir, None])
+                if not is_dir and self.__is_preloaded(entry):
+                    size += entry.stat().st_size
+                if size >= self.batch_size or len(batch) >= ReadAhead.MAX_FILES:
+                    self.__put(self.__read(batch))
+                    batch, size = [], 0
+            self.__put(self.__read(batch))
+            self.__put(ReadAhead.__END)
+        except BaseException as e:
+            self.__put(e)
+        finally:
+            close = getattr(self.__entries, "close", None)
+            if close is not None:
+                close()
+
+    def __is_preloaded(self, entry: os.DirEntry) -> bool:
+        if self.__skip is not None and self.__skip(entry):
+            return False
+        try:
+            size = entry.stat().st_size
+        except OSError:
+            return False
+        return size < LargeFileReader.THRESHOLD and size <= self.batch_size
+
+    def __read(self, batch: List[list]) -> List[tuple]:
+        """Reads the files of the batch in the read order, and returns the batch in the order of the walk"""
+        files = [x for x in batch if not x[1] and self.__is_preloaded(x[0])]
+        start = time.perf_counter()
+        for item in sorted(files, key=lambda x: ReadOrder.key(self.order, x[0])):
+            if self.__stopped.is_set():
+                break
+            try:
+                with open(item[0].path, 'rb') as file:
+                    item[2] = file.read()
+                    if self.__release is not None:
+                        self.__release(file.fileno())
+            except OSError as e:
+                # Read again in place, where the error is reported like for any other file
+                LOGGER.debug(f"Cannot read ahead '{item[0].path}': {e}")
+                continue
+            if self.__throttle is not None:
+                self.__throttle(len(item[2]))
+            self.files += 1
+            self.read_bytes += len(item[2])
+        self.read_seconds += time.perf_counter() - start
+        return [tuple(x) for x in batch]
+
+    def __put(self, item: Any) -> None:
+        while not self.__stopped.is_set():
+            try:
+                self.__batches.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
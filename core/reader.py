@@ -0,0 +1,123 @@
+import errno
+import hashlib
+import os
+from typing import Optional, Callable, Iterator, List, Tuple, Generator
+
+from misc.utils import LOGGER
+
+
+class LargeFileReader:
+    """Reads a large file as a sequence of memory views, with bounded memory whatever the size of the file.
+
+    Data ranges are read in windows of `window` bytes into a buffer reused for the whole file, so a view is only valid
+    until the next one is handed out. The next window is hinted to the kernel while the current one is consumed. Reads
+    rather than memory mappings are used because touching a mapping past the end of a file truncated meanwhile (a live
+    database or VM image) kills the process, while a read just ends early. Holes of sparse files, found with
+    SEEK_DATA/SEEK_HOLE, are not read at all: a shared buffer of zeros is handed out instead. With `hash_name` the content
+    (holes included) is hashed in the same pass. `throttle` is only called for data actually read.
+    """
+
+    THRESHOLD = 64 * 1024 * 1024
+    WINDOW = 8 * 1024 * 1024
+
+    def __init__(self, path: str, window: int = WINDOW, hash_name: Optional[str] = "sha256",
+                 throttle: Optional[Callable[[int], None]] = None, release: Optional[Callable[[int], None]] = None):
+        self.path: str = path
+        self.window: int = max(1, window)
+        self.hash = hashlib.new(hash_name) if hash_name is not None else None
+        self.data_bytes: int = 0
+        self.hole_bytes: int = 0
+        self.__throttle = throttle
+        self.__release = release
+        self.__zeros: Optional[memoryview] = None
+        self.__buffer: Optional[memoryview] = None
+
+    def __iter__(self) -> Iterator[memoryview]:
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            for offset, length, is_data in self.segments(fd, size):
+                if is_data:
+                    if not (yield from self.__read_data(fd, offset, length)):
+                        LOGGER.warning(f"'{self.path}' shrank while it was read, the rest of it is skipped")
+                        break
+                else:
+                    yield from self.__read_hole(length)
+            if self.__release is not None:
+                self.__release(fd)
+        finally:
+            os.close(fd)
+
+    def hexdigest(self) -> Optional[str]:
+        return self.hash.hexdigest() if self.hash is not None else None
+
+    @staticmethod
+    def is_sparse(stat: os.stat_result) -> bool:
+        return hasattr(stat, "st_blocks") and stat.st_blocks * 512 < stat.st_size
+
+    # noinspection PyMethodMayBeStatic
+    def segments(self, fd: int, size: int) -> List[Tuple[int, int, bool]]:
+        """(offset, length, is_data) ranges covering the file. A single data range if holes cannot be detected"""
+        if not hasattr(os, "SEEK_DATA") or not LargeFileReader.is_sparse(os.fstat(fd)):
+            return [(0, size, True)] if size > 0 else []
+        segments = []
+        offset = 0
+        try:
+            while offset < size:
+                try:
+                    data = min(os.lseek(fd, offset, os.SEEK_DATA), size)
+                except OSError as e:
+                    if e.errno != errno.ENXIO:
+                        raise
+                    # No data after offset, the rest of the file is a hole
+                    data = size
+                if data > offset:
+                    segments.append((offset, data - offset, False))
+                if data >= size:
+                    break
+                hole = min(os.lseek(fd, data, os.SEEK_HOLE), size)
+                segments.append((data, hole - data, True))
+                offset = hole
+        except OSError as e:
+            LOGGER.debug(f"Cannot detect holes of '{self.path}': {e}")
+            return [(0, size, True)]
+        return segments
+
+    def __read_data(self, fd: int, offset: int, length: int) -> Generator[memoryview, None, bool]:
+        """Reads a data range. Returns False if the file ended before it"""
+        if self.__buffer is None:
+            self.__buffer = memoryview(bytearray(self.window))
+        end = offset + length
+        while offset < end:
+            size = min(self.window, end - offset)
+            if hasattr(os, "posix_fadvise") and offset + size < end:
+                os.posix_fadvise(fd, offset + size, min(self.window, end - offset - size), os.POSIX_FADV_WILLNEED)
+            read = os.preadv(fd, [self.__buffer[:size]], offset)
+            if read == 0:
+                return False
+            view = self.__buffer[:read]
+            self.__account(view, True)
+            yield view
+            offset += read
+        return True
+
+    def __read_hole(self, length: int) -> Iterator[memoryview]:
+        if self.__zeros is None:
+            self.__zeros = memoryview(bytes(self.window))
+        while length > 0:
+            view = self.__zeros[:min(length, self.window)]
+            self.__account(view, False)
+            yield view
+            length -= len(view)
+
+    def __account(self, view: memoryview, is_data: bool) -> None:
+        if is_data:
+            self.data_bytes += len(view)
+            if self.__throttle is not None:
+                self.__throttle(len(view))
+        else:
+            self.hole_bytes += len(view)
+        if self.hash is not None:
+            self.hash.update(view)
@@ -0,0 +1,86 @@
+import shlex
+import stat
+from typing import Callable, Iterator, List, Optional
+
+from paramiko.sftp_file import SFTPFile
+
+from misc.utils import LOGGER
+
+
+class RemoteEntry:
+    """File or directory of a remote source, as listed by find"""
+    __slots__ = ("path", "is_dir", "mode", "size", "mtime")
+
+    def __init__(self, path: str, is_dir: bool, mode: int, size: int, mtime: float):
+        self.path: str = path
+        self.is_dir: bool = is_dir
+        self.mode: int = mode
+        self.size: int = size
+        self.mtime: float = mtime
+
+    def __str__(self) -> str:
+        return self.path
+
+    def unix_mode(self) -> int:
+        """Permissions with the file type, as stored in the zip external attributes"""
+        return self.mode | (stat.S_IFDIR if self.is_dir else stat.S_IFREG)
+
+
+class RemoteScanner:
+    """Lists a tree on the SSH host with a single `find -printf` call, instead of a round-trip per directory and file.
+
+    Records are NUL separated, so any file name is parsed, and read as the output arrives. Symlinks are reported with
+    the type of their target (so they are archived like the local scanner does), broken ones are skipped. Entries are
+    sorted by path, so they are archived in the same order whatever the order find walked in. Requires GNU find.
+    """
+
+    FORMAT = r"%Y\t%m\t%s\t%T@\t%P\0"
+    # find exits with 1 when some entries cannot be read, they are reported and the others archived; a missing root is 2
+    OK_STATUS = (0, 1)
+
+    def __init__(self, stream: Callable[[str], Iterator[bytes]]):
+        self.__stream = stream
+
+    def scan(self, root: str) -> List[RemoteEntry]:
+        command = f"test -d {shlex.quote(root)} || exit 2; find {shlex.quote(root)} -mindepth 1 -printf {shlex.quote(RemoteScanner.FORMAT)}"
+        entries, pending = [], b""
+        for data in self.__stream(command):
+            records = (pending + data).split(b"\0")
+            pending = records.pop()
+            entries.extend(filter(None, map(self.__parse, records)))
+        entries.sort(key=lambda x: x.path.split("/"))
+        LOGGER.debug(f"Remote source '{root}' has {len(entries)} entries")
+        return entries
+
+    # noinspection PyMethodMayBeStatic
+    def __parse(self, record: bytes) -> Optional[RemoteEntry]:
+        kind, mode, size, mtime, path = record.decode(errors="surrogateescape").split("\t", 4)
+        if kind not in ["d", "f"]:
+            LOGGER.debug(f"Skipping remote entry '{path}' of type '{kind}'")
+            return None
+        return RemoteEntry(path, kind == "d", int(mode, 8), int(size), float(mtime))
+
+
+class RangedReader:
+    """Reads a remote file with all the requests of a chunk in flight at once (SFTP readv), instead of a round-trip
+    per request. Reads stop at the size the file had when opened"""
+
+    REQUEST_SIZE = 32768
+
+    def __init__(self, file: SFTPFile):
+        self.__file = file
+        self.__offset = 0
+        self.size: int = file.stat().st_size
+
+    def __enter__(self) -> 'RangedReader':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.__file.close()
+
+    def read(self, size: int) -> bytes:
+        end = min(self.size, self.__offset + size)
+        ranges = [(x, min(RangedReader.REQUEST_SIZE, end - x)) for x in range(self.__offset, end, RangedReader.REQUEST_SIZE)]
+        data = b"".join(self.__file.readv(ranges)) if len(ranges) > 0 else b""
+        self.__offset += len(data)
+        return data
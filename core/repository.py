@@ -0,0 +1,350 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import struct
+import zlib
+from datetime import datetime
+from typing import Optional, Dict, List, Iterator, BinaryIO, Callable, Set
+
+import numpy
+from Cryptodome.Cipher import AES
+
+from core.progress import ProgressReporter
+from core.storage import Storage
+from misc.utils import LOGGER, VaultBackupException
+
+
+class Chunker:
+    """Content-defined chunking with a gear rolling hash (FastCDC), so an insertion only changes the chunks around it.
+
+    Cut points are looked for after `min_size` bytes, with a stricter mask before `avg_size` and a looser one after
+    it, which keeps chunk sizes close to the average. No chunk is larger than `max_size`.
+
+    The hash is computed with numpy over blocks of SCAN_BLOCK bytes rather than byte by byte. Only the low bits of the
+    hash are compared with the mask, and those only depend on the last 32 bytes (64 for masks wider than 32 bits), since
+    older bytes are shifted out of them, so a block is hashed in a few vector steps from those bytes.
+    """
+
+    MIN_SIZE = 256 * 1024
+    AVG_SIZE = 1024 * 1024
+    MAX_SIZE = 4 * 1024 * 1024
+    GEAR = numpy.array([int.from_bytes(hashlib.sha256(b"vault-backup-gear" + bytes([x])).digest()[:8], "little") for x in range(256)],
+                       dtype=numpy.uint64)
+    GEAR_32 = (GEAR & numpy.uint64(0xFFFFFFFF)).astype(numpy.uint32)
+    SCAN_BLOCK = 64 * 1024
+
+    def __init__(self, min_size: int = MIN_SIZE, avg_size: int = AVG_SIZE, max_size: int = MAX_SIZE):
+        if not 0 < min_size <= avg_size <= max_size:
+            raise VaultBackupException("Chunk sizes must satisfy: 0 < min <= avg <= max.")
+        self.min_size: int = min_size
+        self.avg_size: int = avg_size
+        self.max_size: int = max_size
+        bits = max(1, avg_size.bit_length() - 1)
+        self.__mask_small = (1 << (bits + 1)) - 1
+        self.__mask_large = (1 << max(1, bits - 1)) - 1
+        self.__gear, self.__window = (Chunker.GEAR_32, 32) if self.__mask_small <= 0xFFFFFFFF else (Chunker.GEAR, 64)
+
+    def chunks(self, file: BinaryIO, throttle: Optional[Callable[[int], None]] = None) -> Iterator[bytes]:
+        buffer = b""
+        eof = False
+        while True:
+            if not eof and len(buffer) < self.max_size:
+                data = file.read(self.max_size)
+                if throttle is not None and len(data) > 0:
+                    throttle(len(data))
+                eof = len(data) == 0
+                buffer += data
+                continue
+            if len(buffer) == 0:
+                return
+            cut = self.cut(buffer)
+            yield buffer[:cut]
+            buffer = buffer[cut:]
+
+    def cut(self, data: bytes) -> int:
+        """Length of the first chunk of data"""
+        length = min(len(data), self.max_size)
+        if length <= self.min_size:
+            return length
+        normal = min(length, self.avg_size)
+        cut = self.__find_cut(data, self.min_size, normal, self.__mask_small)
+        if cut is None:
+            cut = self.__find_cut(data, normal, length, self.__mask_large)
+        return cut if cut is not None else length
+
+    def __find_cut(self, data: bytes, start: int, end: int, mask: int) -> Optional[int]:
+        """First cut point in [start, end). The hash starts empty at min_size"""
+        for block in range(start, end, Chunker.SCAN_BLOCK):
+            block_end = min(block + Chunker.SCAN_BLOCK, end)
+            context = max(self.min_size, block - self.__window + 1)
+            hashes = self.__gear[numpy.frombuffer(data, numpy.uint8, block_end - context, context)]
+            lane = hashes.dtype.type
+            # After the step of `shift`, every hash is the sum of the shifted gear values of the `2 * shift` bytes before it
+            shift = 1
+            while shift < self.__window:
+                hashes[shift:] += hashes[:-shift] << lane(shift)
+                shift *= 2
+            hits = numpy.flatnonzero((hashes[block - context:] & lane(mask)) == 0)
+            if len(hits) > 0:
+                return block + int(hits[0]) + 1
+        return None
+
+
+class Repository:
+    """Deduplicating store of one source at one destination.
+
+    Layout: `config` (key derivation parameters), `chunks/<id[:2]>/<id>` (compressed and encrypted chunks, addressed by
+    a keyed hash of their plain content) and `snapshots/<name>` (one encrypted index per version, listing the
+    entries of the source tree and the chunks of every file). Retention removes snapshots and then every chunk no
+    longer referenced by a remaining snapshot.
+    """
+
+    VERSION = 1
+    CONFIG = "config"
+    CHUNKS = "chunks"
+    SNAPSHOTS = "snapshots"
+    KDF_ITERATIONS = 200000
+    FLAG_COMPRESSED = 0x01
+    FLAG_ENCRYPTED = 0x02
+    KEY_CHECK = b"vault-backup-repository"
+
+    def __init__(self, storage: Storage, password: Optional[str], throttle: Optional[Callable[[int], None]] = None):
+        self.storage: Storage = storage
+        self.__throttle = throttle
+        self.__encryption_key: Optional[bytes] = None
+        self.__id_key: Optional[bytes] = None
+        if storage.exists(Repository.CONFIG):
+            self.__load_config(password)
+        else:
+            self.__create_config(password)
+
+    def chunk_id(self, data: bytes) -> str:
+        if self.__id_key is None:
+            return hashlib.sha256(data).hexdigest()
+        return hmac.new(self.__id_key, data, hashlib.sha256).hexdigest()
+
+    def known_chunks(self) -> Set[str]:
+        chunks = set()
+        for prefix in self.storage.list_dirs(Repository.CHUNKS):
+            chunks.update(self.storage.list(f"{Repository.CHUNKS}/{prefix}"))
+        return chunks
+
+    def put_chunk(self, chunk_id: str, data: bytes, compressed: Optional[bytes] = None) -> int:
+        """Stores a chunk. `compressed` can be passed when it was already compressed for another repository"""
+        blob = self.__seal(data, compressed)
+        if self.__throttle is not None:
+            self.__throttle(len(blob))
+        self.storage.write(Repository.__chunk_name(chunk_id), blob)
+        return len(blob)
+
+    def get_chunk(self, chunk_id: str) -> bytes:
+        data = self.__open(self.storage.read(Repository.__chunk_name(chunk_id)))
+        if not hmac.compare_digest(self.chunk_id(data), chunk_id):
+            raise VaultBackupException(f"Chunk '{chunk_id}' is corrupted.")
+        return data
+
+    def snapshots(self) -> List[str]:
+        return sorted(self.storage.list(Repository.SNAPSHOTS))
+
+    def write_snapshot(self, name: str, source: str, entries: List[list]) -> None:
+        snapshot = {"name": name, "created": datetime.now().isoformat(), "source": source, "entries": entries}
+        self.storage.write(f"{Repository.SNAPSHOTS}/{name}", self.__seal(json.dumps(snapshot).encode()))
+
+    def read_snapshot(self, name: str) -> dict:
+        return json.loads(self.__open(self.storage.read(f"{Repository.SNAPSHOTS}/{name}")))
+
+    def prune(self, keep: int) -> (List[str], int):
+        """Keeps the newest `keep` snapshots and collects the chunks nobody references anymore"""
+        snapshots = self.snapshots()
+        removed = snapshots[:-keep] if keep > 0 else snapshots
+        for name in removed:
+            self.storage.delete(f"{Repository.SNAPSHOTS}/{name}")
+        referenced = set()
+        for name in snapshots[len(removed):]:
+            for entry in self.read_snapshot(name)["entries"]:
+                referenced.update(entry[SnapshotEntry.CHUNKS])
+        unreferenced = self.known_chunks() - referenced
+        for chunk_id in unreferenced:
+            self.storage.delete(Repository.__chunk_name(chunk_id))
+        return removed, len(unreferenced)
+
+    def restore(self, name: str, target: str) -> None:
+        directories = []
+        for entry in self.read_snapshot(name)["entries"]:
+            path = os.path.join(target, entry[SnapshotEntry.PATH])
+            if entry[SnapshotEntry.TYPE] == SnapshotEntry.DIRECTORY:
+                os.makedirs(path, exist_ok=True)
+                directories.append((path, entry))
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                for chunk_id in entry[SnapshotEntry.CHUNKS]:
+                    file.write(self.get_chunk(chunk_id))
+            Repository.__restore_metadata(path, entry)
+        # Once their content is written, deepest first: writing a child changes the mtime of its directory, and a
+        # read-only directory would reject it
+        for path, entry in sorted(directories, key=lambda x: x[1][SnapshotEntry.PATH].count(os.sep), reverse=True):
+            Repository.__restore_metadata(path, entry)
+
+    @staticmethod
+    def __restore_metadata(path: str, entry: list) -> None:
+        os.chmod(path, entry[SnapshotEntry.MODE] & 0o7777)
+        os.utime(path, ns=(entry[SnapshotEntry.MTIME], entry[SnapshotEntry.MTIME]))
+
+    @staticmethod
+    def compress(data: bytes) -> bytes:
+        return zlib.compress(data, 6)
+
+    @staticmethod
+    def __chunk_name(chunk_id: str) -> str:
+        return f"{Repository.CHUNKS}/{chunk_id[:2]}/{chunk_id}"
+
+    def __seal(self, data: bytes, compressed: Optional[bytes] = None) -> bytes:
+        compressed = Repository.compress(data) if compressed is None else compressed
+        flags, payload = (Repository.FLAG_COMPRESSED, compressed) if len(compressed) < len(data) else (0, data)
+        if self.__encryption_key is not None:
+            nonce = os.urandom(12)
+            ciphertext, tag = AES.new(self.__encryption_key, AES.MODE_GCM, nonce=nonce).encrypt_and_digest(payload)
+            flags, payload = flags | Repository.FLAG_ENCRYPTED, nonce + ciphertext + tag
+        return struct.pack("<B", flags) + payload
+
+    def __open(self, blob: bytes) -> bytes:
+        flags, payload = blob[0], blob[1:]
+        if flags & Repository.FLAG_ENCRYPTED:
+            if self.__encryption_key is None:
+                raise VaultBackupException("Repository data is encrypted, but no password was provided.")
+            try:
+                payload = AES.new(self.__encryption_key, AES.MODE_GCM, nonce=payload[:12]).decrypt_and_verify(payload[12:-16], payload[-16:])
+            except ValueError:
+                raise VaultBackupException("Repository data is corrupted or the password is wrong.")
+        return zlib.decompress(payload) if flags & Repository.FLAG_COMPRESSED else payload
+
+    def __derive_keys(self, password: str, salt: bytes, iterations: int) -> None:
+        key_material = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations, 64)
+        self.__encryption_key, self.__id_key = key_material[:32], key_material[32:]
+
+    def __create_config(self, password: Optional[str]) -> None:
+        LOGGER.info(f"Initializing repository: {self.storage.root}")
+        config = {"version": Repository.VERSION, "encrypted": password is not None}
+        if password is not None:
+            salt = os.urandom(16)
+            self.__derive_keys(password, salt, Repository.KDF_ITERATIONS)
+            config["salt"] = base64.b64encode(salt).decode()
+            config["iterations"] = Repository.KDF_ITERATIONS
+            config["key_check"] = base64.b64encode(self.__seal(Repository.KEY_CHECK)).decode()
+        self.storage.write(Repository.CONFIG, json.dumps(config, indent='\t').encode())
+
+    def __load_config(self, password: Optional[str]) -> None:
+        config = json.loads(self.storage.read(Repository.CONFIG))
+        if config.get("version") != Repository.VERSION:
+            raise VaultBackupException(f"Unsupported repository version: {config.get('version')}")
+        if not config.get("encrypted"):
+            return
+        if password is None:
+            raise VaultBackupException(f"Repository '{self.storage.root}' is encrypted, but no password was provided.")
+        self.__derive_keys(password, base64.b64decode(config["salt"]), config["iterations"])
+        if self.__open(base64.b64decode(config["key_check"])) != Repository.KEY_CHECK:
+            raise VaultBackupException(f"Wrong password for repository '{self.storage.root}'.")
+
+
+class SnapshotEntry:
+    """Positions of the fields of a snapshot entry, stored as a list to keep indexes of large trees small"""
+
+    TYPE = 0
+    PATH = 1
+    SIZE = 2
+    MTIME = 3
+    MODE = 4
+    CHUNKS = 5
+    DIRECTORY = "d"
+    FILE = "f"
+
+
+class RepositoryWriter:
+    """Backs a source tree up to several repositories in one pass: every file is read and chunked once.
+
+    A file is not read at all when the previous snapshot of every repository has it with the same size and mtime.
+    Only the chunks a repository does not have yet are compressed, encrypted and written to it.
+    """
+
+    def __init__(self, repositories: Dict[str, Repository], chunker: Optional[Chunker] = None,
+                 throttle: Optional[Callable[[int], None]] = None, release: Optional[Callable[[int], None]] = None,
+                 progress: Optional[ProgressReporter] = None):
+        self.repositories: Dict[str, Repository] = repositories
+        self.chunker: Chunker = chunker if chunker is not None else Chunker()
+        self.stats: Dict[str, Dict[str, int]] = {x: {"new_chunks": 0, "dedup_chunks": 0, "written": 0, "reused_files": 0} for x in repositories}
+        self.read_bytes: int = 0
+        self.__throttle = throttle
+        self.__release = release
+        self.__progress = progress
+        self.__known: Dict[str, Set[str]] = {}
+        self.__previous: Dict[str, Dict[str, list]] = {}
+
+    def backup(self, source: str, snapshot_name: str) -> None:
+        for label, repository in self.repositories.items():
+            self.__known[label] = repository.known_chunks()
+            snapshots = repository.snapshots()
+            entries = repository.read_snapshot(snapshots[-1])["entries"] if len(snapshots) > 0 else []
+            self.__previous[label] = {x[SnapshotEntry.PATH]: x for x in entries if x[SnapshotEntry.TYPE] == SnapshotEntry.FILE}
+            LOGGER.debug(f"[{label}] Repository has {len(self.__known[label])} chunks and {len(snapshots)} snapshots")
+
+        entries: Dict[str, List[list]] = {x: [] for x in self.repositories}
+        for crt_path, directories, files in os.walk(source):
+            directories.sort()
+            for directory in directories:
+                abs_path = os.path.join(crt_path, directory)
+                stat = os.stat(abs_path)
+                entry = [SnapshotEntry.DIRECTORY, os.path.relpath(abs_path, source), 0, stat.st_mtime_ns, stat.st_mode, []]
+                for label in self.repositories:
+                    entries[label].append(entry)
+            for file in sorted(files):
+                abs_path = os.path.join(crt_path, file)
+                if self.__progress is not None:
+                    self.__progress.update(os.path.relpath(abs_path, source))
+                for label, entry in self.__backup_file(abs_path, os.path.relpath(abs_path, source)).items():
+                    entries[label].append(entry)
+
+        for label, repository in self.repositories.items():
+            repository.write_snapshot(snapshot_name, source, entries[label])
+            stats = self.stats[label]
+            LOGGER.info(f"[{label}] Snapshot '{snapshot_name}' written: {stats['new_chunks']} new chunks ({stats['written']} bytes), "
+                        f"{stats['dedup_chunks']} deduplicated chunks, {stats['reused_files']} unchanged files")
+
+    def __backup_file(self, abs_path: str, rel_path: str) -> Dict[str, list]:
+        stat = os.stat(abs_path)
+        result = {}
+        for label in self.repositories:
+            previous = self.__previous[label].get(rel_path)
+            if previous is not None and previous[SnapshotEntry.SIZE] == stat.st_size and previous[SnapshotEntry.MTIME] == stat.st_mtime_ns:
+                result[label] = [SnapshotEntry.FILE, rel_path, stat.st_size, stat.st_mtime_ns, stat.st_mode, previous[SnapshotEntry.CHUNKS]]
+                self.stats[label]["reused_files"] += 1
+        pending = [x for x in self.repositories if x not in result]
+        if len(pending) == 0:
+            return result
+
+        chunk_ids = {x: [] for x in pending}
+        with open(abs_path, 'rb') as file:
+            for chunk in self.chunker.chunks(file, self.__throttle):
+                self.read_bytes += len(chunk)
+                if self.__progress is not None:
+                    self.__progress.add_bytes(len(chunk))
+                compressed = None
+                for label in pending:
+                    repository = self.repositories[label]
+                    chunk_id = repository.chunk_id(chunk)
+                    chunk_ids[label].append(chunk_id)
+                    if chunk_id in self.__known[label]:
+                        self.stats[label]["dedup_chunks"] += 1
+                        continue
+                    if compressed is None:
+                        compressed = Repository.compress(chunk)
+                    self.stats[label]["written"] += repository.put_chunk(chunk_id, chunk, compressed)
+                    self.stats[label]["new_chunks"] += 1
+                    self.__known[label].add(chunk_id)
+            if self.__release is not None:
+                self.__release(file.fileno())
+        for label in pending:
+            result[label] = [SnapshotEntry.FILE, rel_path, stat.st_size, stat.st_mtime_ns, stat.st_mode, chunk_ids[label]]
+        return result
@@ -1,25 +1,29 @@
 import json
 import re
 import sys
+from datetime import datetime
 from typing import Optional, List
 
-from core.type import SSHInfo, Archive
+from core.type import SSHInfo, Archive, TransferInfo, GovernorInfo, ProgressInfo, StagingInfo, S3Info
 from misc.utils import LOGGER
-from misc.utils import VaultBackupException, convert, handle_password, handle_timestamp, not_none
+from misc.utils import VaultBackupException, convert, handle_password, handle_size, handle_timestamp, not_none
 
 
 # noinspection SpellCheckingInspection
 class ArgsResolver:
-    __ARG_LIST = ["force", "password", "password_ssh"]
+    __ARG_LIST = ["force", "password", "password_ssh", "password_s3", "verify", "version"]
 
     def __init__(self) -> None:
         self.force = None
         self.password = None
         self.password_ssh = None
+        self.password_s3 = None
+        self.verify = None
+        self.version = None
         LOGGER.debug(f"System args: {sys.argv}")
         if len(sys.argv) > 1:
             for arg in sys.argv[1:]:
-                matches = re.findall(r"-D([a-z_A-Z]+)=(.+)", arg)
+                matches = re.findall(r"-D([a-z_A-Z0-9]+)=(.+)", arg)
                 if len(matches) == 0:
                     raise VaultBackupException(f"Input argument '{arg}' is not correctly formatted. Expected: -Dargument='value' or -Dargument=value.\nSupported arguments: {ArgsResolver.__ARG_LIST}")
                 key, value = matches[0]
@@ -34,20 +38,41 @@ class ArgsResolver:
                 elif key == "password_ssh":
                     self.password_ssh = not_none(key, handle_password(value))
                     LOGGER.debug(f"SSH password was set")
+                elif key == "password_s3":
+                    self.password_s3 = not_none(key, handle_password(value))
+                    LOGGER.debug(f"S3 secret key was set")
+                elif key == "verify":
+                    self.verify = not_none(key, convert(int, value))
+                    if self.verify < 0:
+                        raise VaultBackupException("Verify expects the number of members to check in every version.")
+                    LOGGER.debug(f"Verify set to: {self.verify}")
+                elif key == "version":
+                    self.version = not_none(key, handle_timestamp(value))
+                    LOGGER.debug(f"Version set to: {self.version}")
 
 
 class JsonResolver:
-    __ARG_LIST = ["force", "ssh", "backup"]
+    __ARG_LIST = ["force", "ssh", "s3", "transfer", "governor", "progress", "staging", "backup"]
 
     def __init__(self, json_path: str = "config.json"):
         self.force: bool = False
         self.ssh: Optional[SSHInfo] = None
+        self.s3: Optional[S3Info] = None
+        self.transfer: TransferInfo = TransferInfo()
+        self.governor: GovernorInfo = GovernorInfo()
+        self.progress: ProgressInfo = ProgressInfo()
+        self.staging: StagingInfo = StagingInfo()
         self.backups: List[Archive] = []
+        self.verify: Optional[int] = None
+        self.version: Optional[datetime] = None
 
         self.require_ssh = False
+        self.require_s3 = False
         self.__handle_data(json_path)
         if self.require_ssh and self.ssh is None:
             raise VaultBackupException("Current configuration require a SSH connection, but no SSH info was provided.")
+        if self.require_s3 and self.s3 is None:
+            raise VaultBackupException("Current configuration require an S3 connection, but no S3 info was provided.")
 
     def __handle_data(self, json_path: str):
         self.__data: dict = json.loads(open(json_path, 'r').read())
@@ -65,35 +90,104 @@ class JsonResolver:
                     not_none(key + ".port", ssh.get("port"))
                 )
                 self.ssh.set_password(handle_password(ssh.get("password")))
+            elif key == "s3" and self.__data.get(key) is not None:
+                s3 = self.__data.get(key)
+                self.s3 = S3Info(
+                    not_none(key + ".endpoint", convert(str, s3.get("endpoint"))),
+                    not_none(key + ".access_key", convert(str, s3.get("access_key"))),
+                    convert(str, s3.get("region")),
+                    handle_size(s3.get("part_size")),
+                    convert(int, s3.get("parallel_parts"))
+                )
+                self.s3.set_secret_key(handle_password(s3.get("secret_key")))
+            elif key == "transfer":
+                transfer = self.__data.get(key)
+                self.transfer = TransferInfo(
+                    handle_size(transfer.get("buffer_size")),
+                    convert(bool, transfer.get("direct_io")) or False,
+                    convert(bool, transfer.get("drop_cache")) is not False
+                )
+            elif key == "governor":
+                governor = self.__data.get(key)
+                self.governor = GovernorInfo(
+                    handle_size(governor.get("read_rate")),
+                    handle_size(governor.get("upload_rate")),
+                    convert(int, governor.get("nice")),
+                    convert(str, governor.get("ionice_class")),
+                    convert(int, governor.get("ionice_level")),
+                    convert(bool, governor.get("drop_cache")) is not False,
+                    convert(bool, governor.get("adaptive")) or False,
+                    convert(float, governor.get("max_load")),
+                    convert(float, governor.get("max_disk_latency"))
+                )
+            elif key == "progress":
+                progress = self.__data.get(key)
+                self.progress = ProgressInfo(
+                    convert(float, progress.get("interval")),
+                    convert(str, progress.get("status_file")),
+                    convert(int, progress.get("trace_sample")),
+                    convert(bool, progress.get("estimate")) or False
+                )
+            elif key == "staging":
+                staging = self.__data.get(key)
+                self.staging = StagingInfo(
+                    [not_none(f"{key}.paths", convert(str, x)) for x in staging.get("paths")] if staging.get("paths") is not None else None,
+                    handle_size(staging.get("min_free")),
+                    convert(int, staging.get("max_archives"))
+                )
             elif key == "backup":
-                for backup in self.__data.get(key):
-                    parent_path = f"{key}[{self.__data.get(key).index(backup)}]"
+                known_backups = {}
+                for index, backup in enumerate(self.__data.get(key)):
+                    parent_path = f"{key}[{index}]"
                     crt_backup = Archive(
                         not_none(f'{parent_path}.name', convert(str, backup.get("name"))),
                         not_none(f'{parent_path}.path', convert(str, backup.get("path")))
                     )
                     crt_backup.set_password(handle_password(backup.get("password")))
+                    crt_backup.set_format(convert(str, backup.get("format")))
+                    crt_backup.set_encryption(convert(str, backup.get("encryption")))
+                    crt_backup.set_compression(convert(str, backup.get("compression")))
+                    crt_backup.set_volumes(handle_size(backup.get("volume_size")), convert(int, backup.get("parallel_uploads")))
+                    crt_backup.verify_content = convert(bool, backup.get("verify_content")) or False
+                    crt_backup.set_scan_threads(convert(int, backup.get("scan_threads")))
+                    crt_backup.set_shards(convert(int, backup.get("shards")), convert(int, backup.get("shard_workers")), convert(str, backup.get("shard_host")))
+                    source = backup.get("source") or {}
+                    crt_backup.set_command(convert(str, source.get("command")), convert(str, source.get("probe")), convert(str, source.get("member")))
+                    crt_backup.set_remote(convert(bool, backup.get("remote")) or False, convert(int, backup.get("pull_channels")))
+                    crt_backup.set_read_order(convert(str, backup.get("read_order")), handle_size(backup.get("read_ahead")))
+                    self.require_ssh = self.require_ssh or crt_backup.remote
 
-                    if crt_backup in self.backups:
-                        crt_backup = self.backups[self.backups.index(crt_backup)]
+                    if crt_backup in known_backups:
+                        crt_backup = known_backups[crt_backup]
                     else:
+                        known_backups[crt_backup] = crt_backup
                         self.backups.append(crt_backup)
 
                     for dst in backup.get("destination"):
                         self.require_ssh = self.require_ssh or convert(bool, dst.get("remote"))
+                        self.require_s3 = self.require_s3 or convert(bool, dst.get("s3"))
                         crt_backup.add_destination(
                             not_none(f"{parent_path}.destination.label", convert(str, dst.get("label"))),
                             not_none(f"{parent_path}.destination.path", convert(str, dst.get("path"))),
                             not_none(f"{parent_path}.destination.remote", convert(bool, dst.get("remote"))),
                             not_none(f"{parent_path}.destination.versions", convert(int, dst.get("versions"))),
-                            handle_timestamp(dst.get("last_run"))
+                            handle_timestamp(dst.get("last_run")),
+                            convert(str, dst.get("fingerprint")),
+                            convert(str, dst.get("type")),
+                            convert(bool, dst.get("compress")) or False,
+                            convert(bool, dst.get("encrypt")) or False,
+                            convert(bool, dst.get("s3")) or False
                         )
         self._update_backup_struct()
         args_resolver = ArgsResolver()
         if args_resolver.force is not None:
             self.force = args_resolver.force
+        self.verify = args_resolver.verify
+        self.version = args_resolver.version
         if args_resolver.password_ssh is not None:
             self.ssh.set_password(args_resolver.password_ssh)
+        if args_resolver.password_s3 is not None and self.s3 is not None:
+            self.s3.set_secret_key(args_resolver.password_s3)
         if args_resolver.password is not None:
             [bkp.set_password(args_resolver.password) for bkp in self.backups]
         if self.force:
@@ -103,9 +197,9 @@ class JsonResolver:
 
 
     def update_last_run_date(self) -> None:
-        for bkp in self.backups:
-            for dst in bkp.destinations:
-                self.__data['backup'][self.backups.index(bkp)]['destination'][bkp.destinations.index(dst)]['last_run'] = dst.last_run.isoformat()
+        for bkp_index, bkp in enumerate(self.backups):
+            for dst_index, dst in enumerate(bkp.destinations):
+                self.__data['backup'][bkp_index]['destination'][dst_index]['last_run'] = dst.last_run.isoformat()
 
     def _update_backup_struct(self) -> None:
         backups = []
@@ -113,13 +207,33 @@ class JsonResolver:
             backups.append({
                 "name": bkp.name,
                 "path": bkp.path,
+                "source": {"command": bkp.command, "probe": bkp.probe, "member": bkp.member} if bkp.command is not None else None,
+                "remote": bkp.remote,
+                "pull_channels": bkp.pull_channels,
                 "password": bkp.get_password(False),
+                "format": bkp.format,
+                "encryption": bkp.encryption,
+                "compression": bkp.compression,
+                "volume_size": bkp.volume_size,
+                "parallel_uploads": bkp.parallel_uploads,
+                "verify_content": bkp.verify_content,
+                "scan_threads": bkp.scan_threads,
+                "read_order": bkp.read_order,
+                "read_ahead": bkp.read_ahead,
+                "shards": bkp.shards,
+                "shard_workers": bkp.shard_workers,
+                "shard_host": "{}/{}".format(*bkp.shard_host),
                 "destination": [{
                     "label": dst.label,
                     "path": dst.path,
                     "remote": dst.remote,
+                    "s3": dst.s3,
                     "versions": dst.versions,
-                    "last_run": dst.last_run.isoformat()
+                    "last_run": dst.last_run.isoformat(),
+                    "fingerprint": dst.fingerprint,
+                    "type": dst.type,
+                    "compress": dst.compress,
+                    "encrypt": dst.encrypt
                 } for dst in bkp.destinations]
             })
         self.__data['backup'] = backups
@@ -133,18 +247,73 @@ class JsonResolver:
                 "ip": self.ssh.ip,
                 "port": self.ssh.port
             },
+            "s3": {
+                "endpoint": self.s3.endpoint,
+                "access_key": self.s3.access_key,
+                "secret_key": self.s3.get_secret_key(False),
+                "region": self.s3.region,
+                "part_size": self.s3.part_size,
+                "parallel_parts": self.s3.parallel_parts
+            } if self.s3 is not None else None,
+            "transfer": {
+                "buffer_size": self.transfer.buffer_size,
+                "direct_io": self.transfer.direct_io,
+                "drop_cache": self.transfer.drop_cache
+            },
+            "governor": {
+                "read_rate": self.governor.read_rate,
+                "upload_rate": self.governor.upload_rate,
+                "nice": self.governor.nice,
+                "ionice_class": self.governor.ionice_class,
+                "ionice_level": self.governor.ionice_level,
+                "drop_cache": self.governor.drop_cache,
+                "adaptive": self.governor.adaptive,
+                "max_load": self.governor.max_load,
+                "max_disk_latency": self.governor.max_disk_latency
+            },
+            "progress": {
+                "interval": self.progress.interval,
+                "status_file": self.progress.status_file,
+                "trace_sample": self.progress.trace_sample,
+                "estimate": self.progress.estimate
+            },
+            "staging": {
+                "paths": self.staging.paths,
+                "min_free": self.staging.min_free,
+                "max_archives": self.staging.max_archives
+            },
             "backup": [
                 {
                     "name": x.name,
                     "path": x.path,
+                    "source": {"command": x.command, "probe": x.probe, "member": x.member} if x.command is not None else None,
+                    "remote": x.remote,
+                    "pull_channels": x.pull_channels,
                     "password": x.get_password(False),
+                    "format": x.format,
+                    "encryption": x.encryption,
+                    "compression": x.compression,
+                    "volume_size": x.volume_size,
+                    "parallel_uploads": x.parallel_uploads,
+                    "verify_content": x.verify_content,
+                    "scan_threads": x.scan_threads,
+                    "read_order": x.read_order,
+                    "read_ahead": x.read_ahead,
+                    "shards": x.shards,
+                    "shard_workers": x.shard_workers,
+                    "shard_host": "{}/{}".format(*x.shard_host),
                     "destination": [
                         {
                             "label": y.label,
                             "path": y.path,
                             "remote": y.remote,
+                            "s3": y.s3,
                             "versions": y.versions,
-                            "last_run": y.last_run.isoformat()
+                            "last_run": y.last_run.isoformat(),
+                            "fingerprint": y.fingerprint,
+                            "type": y.type,
+                            "compress": y.compress,
+                            "encrypt": y.encrypt
                         } for y in x.destinations
                     ]
                 } for x in self.backups
@@ -0,0 +1,310 @@
+import base64
+import hashlib
+import hmac
+import http.client
+import math
+import os
+import threading
+import time
+import urllib.parse
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Optional, List, Dict, Tuple, Callable
+
+from misc.utils import LOGGER, VaultBackupException
+
+
+class S3Error(VaultBackupException):
+    """Request refused by the object storage, with its HTTP status and S3 error code"""
+
+    def __init__(self, message: str, status: Optional[int] = None, code: Optional[str] = None):
+        super().__init__(message)
+        self.status: Optional[int] = status
+        self.code: Optional[str] = code
+
+
+class S3Object:
+    """Object of a bucket, as listed"""
+    __slots__ = ("key", "size", "etag")
+
+    def __init__(self, key: str, size: int, etag: str):
+        self.key: str = key
+        self.size: int = size
+        self.etag: str = etag
+
+    def __str__(self) -> str:
+        return self.key
+
+
+def sign_v4(method: str, host: str, path: str, query: Dict[str, str], headers: Dict[str, str], payload_hash: str,
+            access_key: str, secret_key: str, region: str, amz_date: str, service: str = "s3") -> str:
+    """Authorization header of a request (AWS Signature Version 4). Every header given is signed, with the host"""
+    signed = {k.lower(): " ".join(str(v).split()) for k, v in headers.items()}
+    signed["host"] = host
+    names = sorted(signed)
+    canonical_query = "&".join(f"{k}={v}" for k, v in sorted((urllib.parse.quote(k, safe="-_.~"), urllib.parse.quote(v, safe="-_.~")) for k, v in query.items()))
+    canonical = "\n".join([method, urllib.parse.quote(path, safe="/-_.~"), canonical_query, "".join(f"{x}:{signed[x]}\n" for x in names), ";".join(names), payload_hash])
+    scope = f"{amz_date[:8]}/{region}/{service}/aws4_request"
+    to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical.encode()).hexdigest()])
+    key = ("AWS4" + secret_key).encode()
+    for part in [amz_date[:8], region, service, "aws4_request"]:
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    signature = hmac.new(key, to_sign.encode(), hashlib.sha256).hexdigest()
+    return f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, SignedHeaders={';'.join(names)}, Signature={signature}"
+
+
+class S3Client:
+    """Requests to an S3 compatible object storage over HTTP(S), signed with Signature Version 4.
+
+    Buckets are addressed in the path (http(s)://<endpoint>/<bucket>/<key>), which every S3 compatible store supports.
+    Every thread keeps its own connection, so parts are sent in parallel without reconnecting. Connection errors,
+    throttling (503, 429) and server errors are retried with a backoff; refused requests raise S3Error. Payloads are
+    sent unsigned with their MD5 (Content-MD5), which the store checks before accepting them.
+    """
+
+    TIMEOUT = 60
+    RETRIES = 4
+    RETRY_DELAY = 0.5
+    UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+    NAMESPACE = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+    MAX_DELETE = 1000
+    MAX_COPY_SIZE = 5 * 1024 ** 3
+
+    def __init__(self, endpoint: str, region: str, access_key: str, secret_key: str, timeout: float = TIMEOUT):
+        url = urllib.parse.urlsplit(endpoint)
+        self.secure: bool = url.scheme == "https"
+        self.host: str = url.netloc
+        self.region: str = region
+        self.timeout: float = timeout
+        self.__access_key = access_key
+        self.__secret_key = secret_key
+        self.__local = threading.local()
+
+    def request(self, method: str, bucket: str, key: str = "", query: Optional[Dict[str, str]] = None, headers: Optional[Dict[str, str]] = None,
+                body: bytes = b"") -> Tuple[int, Dict[str, str], bytes]:
+        """Status, headers (lower case names) and body of the response. Raises S3Error if the request was refused"""
+        query = {} if query is None else query
+        path = f"/{bucket}/{key}" if key else f"/{bucket}"
+        url = urllib.parse.quote(path, safe="/-_.~") + ("?" + urllib.parse.urlencode(query, quote_via=urllib.parse.quote, safe="-_.~") if query else "")
+        for attempt in range(1, S3Client.RETRIES + 1):
+            request_headers = dict(headers) if headers is not None else {}
+            request_headers["x-amz-date"] = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+            request_headers["x-amz-content-sha256"] = S3Client.UNSIGNED_PAYLOAD
+            if len(body) > 0:
+                request_headers["content-md5"] = base64.b64encode(hashlib.md5(body).digest()).decode()
+            authorization = sign_v4(method, self.host, path, query, request_headers, S3Client.UNSIGNED_PAYLOAD, self.__access_key, self.__secret_key,
+                                    self.region, request_headers["x-amz-date"])
+            request_headers["authorization"] = authorization
+            request_headers["content-length"] = str(len(body))
+            try:
+                connection = self.__connection()
+                connection.request(method, url, body=body, headers=request_headers)
+                response = connection.getresponse()
+                status, data = response.status, response.read()
+                response_headers = {k.lower(): v for k, v in response.getheaders()}
+            except (OSError, http.client.HTTPException) as e:
+                self.close()
+                if attempt == S3Client.RETRIES:
+                    raise S3Error(f"S3 {method} '{path}' failed: {e}")
+                LOGGER.debug(f"S3 {method} '{path}' failed (attempt {attempt}/{S3Client.RETRIES}): {e}")
+            else:
+                if status < 300:
+                    return status, response_headers, data
+                code, message = self.__error(data)
+                if (status < 500 and status != 429) or attempt == S3Client.RETRIES:
+                    raise S3Error(f"S3 {method} '{path}' failed with status {status}: {code} {message}".strip(), status, code)
+                LOGGER.debug(f"S3 {method} '{path}' failed with status {status} (attempt {attempt}/{S3Client.RETRIES}): {code}")
+            time.sleep(S3Client.RETRY_DELAY * 2 ** (attempt - 1))
+
+    def put_object(self, bucket: str, key: str, data: bytes, metadata: Optional[Dict[str, str]] = None) -> str:
+        """ETag of the new object"""
+        headers = {f"x-amz-meta-{k}": v for k, v in (metadata or {}).items()}
+        return self.request("PUT", bucket, key, headers=headers, body=data)[1].get("etag", "").strip('"')
+
+    def copy_object(self, bucket: str, key: str, source_bucket: str, source_key: str) -> str:
+        """Server-side copy of an object of up to 5 GiB, with its metadata. ETag of the copy"""
+        headers = {"x-amz-copy-source": urllib.parse.quote(f"/{source_bucket}/{source_key}", safe="/-_.~")}
+        # A copy can fail after the status was sent, the error is then in the body
+        root = self.__xml(self.request("PUT", bucket, key, headers=headers)[2])
+        if root.tag.endswith("Error"):
+            raise S3Error(f"S3 copy of '{source_key}' to '{key}' failed: {self.__text(root, 'Code')} {self.__text(root, 'Message')}")
+        return self.__text(root, "ETag").strip('"')
+
+    def get_object(self, bucket: str, key: str, start: Optional[int] = None, end: Optional[int] = None) -> bytes:
+        """Content of an object, or of its bytes from start to end (excluded)"""
+        headers = {"range": f"bytes={start}-{end - 1}"} if start is not None else None
+        return self.request("GET", bucket, key, headers=headers)[2]
+
+    def head_object(self, bucket: str, key: str) -> Optional[Dict[str, str]]:
+        """Headers of an object, None if it does not exist"""
+        try:
+            return self.request("HEAD", bucket, key)[1]
+        except S3Error as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def list_objects(self, bucket: str, prefix: str = "", delimiter: Optional[str] = None) -> Tuple[List[S3Object], List[str]]:
+        """Objects under a prefix, and the common prefixes ("directories") when listed with a delimiter. Pages are
+        followed until the listing is complete"""
+        objects, prefixes, token = [], [], None
+        while True:
+            query = {"list-type": "2", "prefix": prefix}
+            if delimiter is not None:
+                query["delimiter"] = delimiter
+            if token is not None:
+                query["continuation-token"] = token
+            root = self.__xml(self.request("GET", bucket, query=query)[2])
+            for content in root.iter(f"{S3Client.NAMESPACE}Contents"):
+                objects.append(S3Object(self.__text(content, "Key"), int(self.__text(content, "Size")), self.__text(content, "ETag").strip('"')))
+            prefixes.extend(self.__text(x, "Prefix") for x in root.iter(f"{S3Client.NAMESPACE}CommonPrefixes"))
+            if self.__text(root, "IsTruncated") != "true":
+                return objects, prefixes
+            token = self.__text(root, "NextContinuationToken")
+
+    def delete_objects(self, bucket: str, keys: List[str]) -> None:
+        """Deletes objects by batches of 1000 keys, a request per batch"""
+        for index in range(0, len(keys), S3Client.MAX_DELETE):
+            root = ElementTree.Element("Delete")
+            ElementTree.SubElement(root, "Quiet").text = "true"
+            for key in keys[index:index + S3Client.MAX_DELETE]:
+                ElementTree.SubElement(ElementTree.SubElement(root, "Object"), "Key").text = key
+            result = self.__xml(self.request("POST", bucket, query={"delete": ""}, body=ElementTree.tostring(root))[2])
+            errors = [f"{self.__text(x, 'Key')}: {self.__text(x, 'Code')}" for x in result.iter(f"{S3Client.NAMESPACE}Error")]
+            if len(errors) > 0:
+                raise S3Error(f"S3 delete failed for {len(errors)} objects: {', '.join(errors)}")
+
+    def create_multipart_upload(self, bucket: str, key: str, metadata: Optional[Dict[str, str]] = None) -> str:
+        """Id of the new upload"""
+        headers = {f"x-amz-meta-{k}": v for k, v in (metadata or {}).items()}
+        return self.__text(self.__xml(self.request("POST", bucket, key, query={"uploads": ""}, headers=headers)[2]), "UploadId")
+
+    def upload_part(self, bucket: str, key: str, upload_id: str, number: int, data: bytes) -> str:
+        """ETag of the part"""
+        return self.request("PUT", bucket, key, query={"partNumber": str(number), "uploadId": upload_id}, body=data)[1].get("etag", "").strip('"')
+
+    def complete_multipart_upload(self, bucket: str, key: str, upload_id: str, etags: List[str]) -> str:
+        """Makes the object of the parts appear under its key. ETag of the object"""
+        root = ElementTree.Element("CompleteMultipartUpload")
+        for number, etag in enumerate(etags, 1):
+            part = ElementTree.SubElement(root, "Part")
+            ElementTree.SubElement(part, "PartNumber").text = str(number)
+            ElementTree.SubElement(part, "ETag").text = f'"{etag}"'
+        result = self.__xml(self.request("POST", bucket, key, query={"uploadId": upload_id}, body=ElementTree.tostring(root))[2])
+        if result.tag.endswith("Error"):
+            raise S3Error(f"S3 upload of '{key}' failed to complete: {self.__text(result, 'Code')} {self.__text(result, 'Message')}")
+        return self.__text(result, "ETag").strip('"')
+
+    def abort_multipart_upload(self, bucket: str, key: str, upload_id: str) -> None:
+        self.request("DELETE", bucket, key, query={"uploadId": upload_id})
+
+    def list_multipart_uploads(self, bucket: str, prefix: str = "") -> List[Tuple[str, str]]:
+        """Key and id of the uploads started and neither completed nor aborted"""
+        root = self.__xml(self.request("GET", bucket, query={"uploads": "", "prefix": prefix})[2])
+        return [(self.__text(x, "Key"), self.__text(x, "UploadId")) for x in root.iter(f"{S3Client.NAMESPACE}Upload")]
+
+    def close(self) -> None:
+        """Closes the connection of the calling thread"""
+        connection = getattr(self.__local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.__local.connection = None
+
+    def __connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self.__local, "connection", None)
+        if connection is None:
+            connection_class = http.client.HTTPSConnection if self.secure else http.client.HTTPConnection
+            connection = connection_class(self.host, timeout=self.timeout)
+            self.__local.connection = connection
+        return connection
+
+    def __error(self, data: bytes) -> Tuple[str, str]:
+        try:
+            root = self.__xml(data)
+            return self.__text(root, "Code"), self.__text(root, "Message")
+        except ElementTree.ParseError:
+            return "", data[:200].decode(errors="replace")
+
+    @staticmethod
+    def __xml(data: bytes) -> ElementTree.Element:
+        return ElementTree.fromstring(data)
+
+    @staticmethod
+    def __text(element: ElementTree.Element, name: str) -> str:
+        """Text of a direct child, with or without the S3 namespace"""
+        child = element.find(f"{S3Client.NAMESPACE}{name}")
+        child = element.find(name) if child is None else child
+        return (child.text or "") if child is not None else ""
+
+
+class ObjectUploader:
+    """Uploads a file as an object, in parts of `part_size` sent by `parallel_parts` threads at once.
+
+    Every thread reads its own part from the file, so memory is bounded by parallel_parts * part_size whatever the
+    size of the file. Every part is checked by the store against its MD5, and its ETag against the MD5 read; the ETag of
+    the object is checked against the one computed from the parts (MD5 of the part MD5s, "-<count>"). The object only
+    appears once all parts are complete, a failed upload is aborted. Files of a single part are sent with one PUT.
+    """
+
+    MAX_PARTS = 10000
+
+    def __init__(self, client: S3Client, part_size: int, parallel_parts: int, throttle: Optional[Callable[[int], None]] = None,
+                 check_cancelled: Optional[Callable[[], None]] = None):
+        self.client: S3Client = client
+        self.part_size: int = part_size
+        self.parallel_parts: int = parallel_parts
+        self.__throttle = throttle
+        self.__check_cancelled = check_cancelled
+
+    def upload(self, path: str, bucket: str, key: str, metadata: Optional[Dict[str, str]] = None) -> str:
+        """ETag of the uploaded object"""
+        size = os.path.getsize(path)
+        part_size = max(self.part_size, math.ceil(size / ObjectUploader.MAX_PARTS))
+        with open(path, 'rb') as file:
+            if size <= part_size:
+                data = self.__read(file.fileno(), 0, size)
+                return self.__check(key, self.client.put_object(bucket, key, data, metadata), hashlib.md5(data).hexdigest())
+            upload_id = self.client.create_multipart_upload(bucket, key, metadata)
+            try:
+                count = math.ceil(size / part_size)
+                with ThreadPoolExecutor(max_workers=self.parallel_parts, thread_name_prefix="s3-part") as pool:
+                    futures = [pool.submit(self.__upload_part, file.fileno(), bucket, key, upload_id, x + 1, x * part_size, min(part_size, size - x * part_size))
+                               for x in range(count)]
+                    try:
+                        digests = [x.result() for x in futures]
+                    except BaseException:
+                        for future in futures:
+                            future.cancel()
+                        raise
+                expected = hashlib.md5(b"".join(digests)).hexdigest() + f"-{count}"
+                etag = self.client.complete_multipart_upload(bucket, key, upload_id, [x.hex() for x in digests])
+                return self.__check(key, etag, expected)
+            except BaseException:
+                try:
+                    self.client.abort_multipart_upload(bucket, key, upload_id)
+                except Exception as e:
+                    LOGGER.warning(f"Cannot abort the upload of '{key}': {e}")
+                raise
+
+    def __upload_part(self, fd: int, bucket: str, key: str, upload_id: str, number: int, offset: int, length: int) -> bytes:
+        data = self.__read(fd, offset, length)
+        digest = hashlib.md5(data).digest()
+        self.__check(f"{key} part {number}", self.client.upload_part(bucket, key, upload_id, number, data), digest.hex())
+        return digest
+
+    def __read(self, fd: int, offset: int, length: int) -> bytes:
+        if self.__check_cancelled is not None:
+            self.__check_cancelled()
+        data = os.pread(fd, length, offset)
+        if len(data) != length:
+            raise VaultBackupException(f"File was truncated while uploaded: {length} bytes expected at {offset}, {len(data)} read")
+        if self.__throttle is not None:
+            self.__throttle(length)
+        return data
+
+    @staticmethod
+    def __check(name: str, etag: str, expected: str) -> str:
+        if etag != expected:
+            raise S3Error(f"ETag mismatch for '{name}': expected {expected}, found {etag}")
+        return etag
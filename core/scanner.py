@@ -0,0 +1,102 @@
+import os
+import threading
+from typing import Optional, Callable, Iterator, List, Tuple, Dict
+
+from misc.utils import LOGGER
+
+
+class ParallelScanner:
+    """Walks a tree with a pool of threads, for sources where every readdir and stat is a network round-trip.
+
+    Workers take directories from a shared queue, list them, stat every entry (the stat is cached in the returned
+    `os.DirEntry`) and queue the subdirectories they find. `walk` yields the listings top-down like `os.walk`, in a
+    deterministic order (entries sorted by name) whatever the order the workers finished in. At most `max_pending`
+    listings are kept ahead of the consumer. Symlinks to directories are listed but not followed.
+    """
+
+    DEFAULT_THREADS = 1
+    MAX_PENDING = 4096
+
+    def __init__(self, threads: int = DEFAULT_THREADS, max_pending: int = MAX_PENDING, scandir: Callable = os.scandir):
+        self.threads: int = max(1, threads)
+        self.max_pending: int = max_pending
+        self.__scandir = scandir
+        self.__condition = threading.Condition()
+        self.__queue: Dict[str, None] = {}
+        self.__results: Dict[str, Tuple[List[os.DirEntry], List[os.DirEntry]]] = {}
+        self.__wanted: Optional[str] = None
+        self.__stopped = False
+
+    def walk(self, root: str) -> Iterator[Tuple[str, List[os.DirEntry], List[os.DirEntry]]]:
+        """Yields (path, directories, files) for every directory under root, entries sorted by name"""
+        self.__queue, self.__results, self.__stopped = {root: None}, {}, False
+        workers = [threading.Thread(target=self.__work, name=f"scanner-{x}", daemon=True) for x in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        try:
+            stack = [root]
+            while len(stack) > 0:
+                path = stack.pop()
+                directories, files = self.__take(path)
+                yield path, directories, files
+                stack.extend(x.path for x in reversed(directories) if not x.is_symlink())
+        finally:
+            with self.__condition:
+                self.__stopped = True
+                self.__condition.notify_all()
+            for worker in workers:
+                worker.join()
+
+    def __take(self, path: str) -> Tuple[List[os.DirEntry], List[os.DirEntry]]:
+        with self.__condition:
+            self.__wanted = path
+            self.__condition.notify_all()
+            while path not in self.__results:
+                self.__condition.wait()
+            self.__wanted = None
+            # A slot was freed for the workers held back by max_pending
+            self.__condition.notify_all()
+            return self.__results.pop(path)
+
+    def __work(self) -> None:
+        while True:
+            with self.__condition:
+                while True:
+                    if self.__stopped:
+                        return
+                    if self.__wanted in self.__queue:
+                        # The consumer waits for this one, it goes first even when max_pending is reached
+                        path = self.__wanted
+                        del self.__queue[path]
+                        break
+                    if len(self.__queue) > 0 and len(self.__results) < self.max_pending:
+                        # Last queued first, which is close to the order the listings are consumed in
+                        path = self.__queue.popitem()[0]
+                        break
+                    self.__condition.wait()
+            directories, files = self.__list(path)
+            with self.__condition:
+                self.__results[path] = (directories, files)
+                for directory in reversed(directories):
+                    if not directory.is_symlink():
+                        self.__queue[directory.path] = None
+                self.__condition.notify_all()
+
+    def __list(self, path: str) -> Tuple[List[os.DirEntry], List[os.DirEntry]]:
+        directories, files = [], []
+        try:
+            with self.__scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                        # Cached in the entry, so the consumer does not pay the round-trip
+                        entry.stat()
+                    except OSError as e:
+                        LOGGER.debug(f"Cannot stat '{entry.path}': {e}")
+                        is_dir = False
+                    (directories if is_dir else files).append(entry)
+        except OSError as e:
+            LOGGER.warning(f"Cannot list '{path}': {e}")
+        directories.sort(key=lambda x: x.name)
+        files.sort(key=lambda x: x.name)
+        return directories, files
@@ -0,0 +1,112 @@
+import heapq
+import json
+import multiprocessing
+import os
+from typing import Optional, List, Tuple, Dict
+
+import pyzipper
+
+from core.crypto import EncryptedStreamWriter
+from core.scanner import ParallelScanner
+from core.zipwriter import StreamingZipFile
+from misc.utils import BackupCancelled, file_checksum
+
+
+class Shard:
+    """Part of a source tree archived on its own, as one of the zips of a sharded version."""
+
+    def __init__(self, index: int, count: int):
+        self.index: int = index
+        self.count: int = count
+        self.members: List[Tuple[str, str]] = []
+        self.size: int = 0
+
+    def __str__(self) -> str:
+        return self.suffix()
+
+    def suffix(self) -> str:
+        """1-based and zero padded to the width of the count: ".s01of12" """
+        width = len(str(self.count))
+        return f".s{self.index + 1:0{width}d}of{self.count:0{width}d}"
+
+
+class ShardSet:
+    """Partitions a tree into shards of balanced byte size, and ties the shards written by every host into one version.
+
+    Files are assigned largest first to the shard with the fewest bytes (longest processing time first), so the
+    shards finish at about the same time. The partition only depends on the scanned tree, so every host computes
+    the same one and archives the shards it owns. Every host writes a manifest of its shards
+    (`<version>.shards.json`, or `<version>.hKofM.shards.json` with several hosts); a version is complete once the
+    manifests cover every shard.
+    """
+
+    MANIFEST_SUFFIX = ".shards.json"
+
+    def __init__(self, count: int, host: int = 1, hosts: int = 1):
+        self.count: int = count
+        self.host: int = host
+        self.hosts: int = hosts
+
+    def partition(self, root: str, scan_threads: int = 1) -> List[Shard]:
+        shards = [Shard(x, self.count) for x in range(self.count)]
+        files = []
+        for crt_path, directories, entries in ParallelScanner(scan_threads).walk(root):
+            # Directory entries are tiny, they all go to the first shard so empty directories are kept
+            shards[0].members.extend((x.path, os.path.relpath(x.path, root)) for x in directories)
+            files.extend((x.stat().st_size, x.path) for x in entries)
+        heap = [(0, x) for x in range(self.count)]
+        for size, path in sorted(files, key=lambda x: (-x[0], x[1])):
+            total, index = heapq.heappop(heap)
+            shards[index].members.append((path, os.path.relpath(path, root)))
+            shards[index].size += size
+            heapq.heappush(heap, (total + size, index))
+        for shard in shards:
+            shard.members.sort(key=lambda x: x[1])
+        return shards
+
+    def owns(self, shard: Shard) -> bool:
+        return shard.index % self.hosts == self.host - 1
+
+    def manifest_name(self, version: str) -> str:
+        host = f".h{self.host}of{self.hosts}" if self.hosts > 1 else ""
+        return version + host + ShardSet.MANIFEST_SUFFIX
+
+    def write_manifest(self, path: str, version: str, shards: Dict[str, dict]) -> None:
+        with open(path, 'w') as manifest:
+            manifest.write(json.dumps({"version": version, "shards": self.count, "host": [self.host, self.hosts], "files": shards}, indent='\t'))
+
+    @staticmethod
+    def is_complete(manifests: List[dict], names: List[str]) -> bool:
+        """True if the manifests of a version cover every shard and every shard they list is in names"""
+        if len(manifests) == 0:
+            return False
+        count = manifests[0]["shards"]
+        files = {}
+        for manifest in manifests:
+            files.update(manifest["files"])
+        indexes = {x["index"] for x in files.values()}
+        return indexes == set(range(count)) and all(x in names for x in files)
+
+
+_cancel = None
+
+
+def init_worker(cancel: multiprocessing.Event) -> None:
+    """Initializer of the worker processes: the event set by the parent when the backup is cancelled"""
+    global _cancel
+    _cancel = cancel
+
+
+def write_shard(path: str, members: List[Tuple[str, str]], password: Optional[str], stream_encryption: bool, level: Optional[int]) -> Tuple[str, int]:
+    """Archives the members of a shard to path, in a worker process. Returns the checksum and the size of the shard"""
+    with open(path, 'wb') as raw:
+        output = EncryptedStreamWriter(raw, password) if stream_encryption else raw
+        with output, StreamingZipFile(output, 'w', compression=pyzipper.ZIP_DEFLATED, compresslevel=level, spill_dir=os.path.dirname(path)) as zip_file:
+            if password is not None and not stream_encryption:
+                zip_file.encryption = pyzipper.WZ_AES
+                zip_file.pwd = password.encode()
+            for abs_path, rel_path in members:
+                if _cancel is not None and _cancel.is_set():
+                    raise BackupCancelled("Backup was cancelled.")
+                zip_file.write(abs_path, rel_path)
+    return file_checksum(path), os.path.getsize(path)
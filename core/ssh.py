@@ -1,9 +1,13 @@
+import socket
+
 from paramiko.channel import ChannelStderrFile, ChannelFile, ChannelStdinFile
 from paramiko.client import SSHClient, AutoAddPolicy
+from paramiko.sftp_client import SFTPClient
 from scp import SCPClient
+from typing import Optional, Callable, Iterator, Tuple
 
 from core.type import SSHInfo
-from misc.utils import LOGGER
+from misc.utils import LOGGER, VaultBackupException
 
 
 class SSHConnection:
@@ -12,6 +16,7 @@ class SSHConnection:
         self.client.set_missing_host_key_policy(AutoAddPolicy())
         self.client.connect(ssh.ip, int(ssh.port), ssh.user, ssh.get_password())
         self.scp = SCPClient(self.client.get_transport())
+        self.__sftp: Optional[SFTPClient] = None
 
     def execute(self, command: str) -> tuple[ChannelStdinFile, ChannelFile, ChannelStderrFile]:
         LOGGER.debug(f"Executing SSH command: {command}")
@@ -22,14 +27,59 @@ class SSHConnection:
             raise Exception("Runtime error.")
         return stdin, stdout, stderr
 
+    def stream(self, command: str, ok_status: Tuple[int, ...] = (0,), chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+        """Output of a command as it arrives, for outputs too large to be read at once. Standard error is read at the same
+        time, so it cannot stall the channel, and logged when the command ends"""
+        LOGGER.debug(f"Streaming SSH command: {command}")
+        channel = self.client.get_transport().open_session()
+        errors = b""
+        try:
+            channel.settimeout(1.0)
+            channel.exec_command(command)
+            while True:
+                while channel.recv_stderr_ready():
+                    errors = (errors + channel.recv_stderr(65536))[-4096:]
+                try:
+                    data = channel.recv(chunk_size)
+                except socket.timeout:
+                    continue
+                if len(data) == 0:
+                    break
+                yield data
+            status = channel.recv_exit_status()
+            while channel.recv_stderr_ready():
+                errors = (errors + channel.recv_stderr(65536))[-4096:]
+        finally:
+            channel.close()
+        if len(errors) > 0:
+            LOGGER.warning(f"SSH command '{command}' reported: {errors.decode(errors='replace').strip()}")
+        if status not in ok_status:
+            raise VaultBackupException(f"SSH command '{command}' failed with exit status {status}")
+
+    def open_sftp(self) -> SFTPClient:
+        """A new SFTP channel on the shared transport, for transfers in parallel threads"""
+        return self.client.open_sftp()
+
     def download(self, remote_source: str, local_destination: str, is_dir: bool):
         self.scp.get(remote_source, local_destination, is_dir, True)
         LOGGER.debug("{} '{}' was downloaded to {}".format(f"Directory" if is_dir else "File", remote_source, local_destination))
 
-    def upload(self, local_source: str, remote_destination: str, is_dir: bool):
-        self.scp.put(local_source, remote_destination, is_dir, True)
+    def upload(self, local_source: str, remote_destination: str, is_dir: bool, progress: Optional[Callable] = None):
+        # Every upload gets its own SCP channel on the shared transport, so uploads can run in parallel threads
+        with SCPClient(self.client.get_transport(), progress=progress) as scp:
+            scp.put(local_source, remote_destination, is_dir, True)
         LOGGER.debug("{} '{}' was uploaded to {}".format(f"Directory" if is_dir else "File", local_source, remote_destination))
 
+    def checksum(self, remote_path: str) -> str:
+        return self.execute(f"sha256sum '{remote_path}'")[1].read().decode().split(" ")[0].strip()
+
+    def sftp(self) -> SFTPClient:
+        if self.__sftp is None:
+            self.__sftp = self.client.open_sftp()
+        return self.__sftp
+
     def close(self) -> None:
+        if self.__sftp is not None:
+            self.__sftp.close()
         self.scp.close()
         self.client.close()
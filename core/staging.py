@@ -0,0 +1,187 @@
+import fcntl
+import json
+import os
+import re
+import time
+from typing import Optional, List, Callable
+
+from core.checkpoint import ArchiveCheckpoint
+from misc.utils import LOGGER, VaultBackupException
+
+
+class StagingLease:
+    """Space reserved in a staging area for the archive of a run, held while the archive is staged.
+
+    The lease is a file in `<area>/.staging/` locked by the process that holds it, so other processes (and the
+    cleanup after a crash) can tell a live lease from the one of a process that died.
+    """
+
+    def __init__(self, area: 'StagingArea', path: str, prefix: str, estimate: int):
+        self.area: StagingArea = area
+        self.path: str = path
+        self.prefix: str = prefix
+        self.estimate: int = estimate
+        self.__file = None
+
+    def __enter__(self) -> 'StagingLease':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.release()
+
+    def acquire(self, checkpoint_path: Optional[str]) -> None:
+        self.__file = open(self.path, 'w')
+        fcntl.flock(self.__file, fcntl.LOCK_EX)
+        self.__file.write(json.dumps({"pid": os.getpid(), "prefix": self.prefix, "estimate": self.estimate, "checkpoint": checkpoint_path}))
+        self.__file.flush()
+
+    def release(self) -> None:
+        if self.__file is None:
+            return
+        os.remove(self.path)
+        self.__file.close()
+        self.__file = None
+        LOGGER.debug(f"Staging lease released: {self.path}")
+
+
+class StagingArea:
+    """Directory archives are staged in, with the space it has left for them.
+
+    The space an area can give is its free space, minus `min_free`, minus what the live leases reserved and did not
+    write yet. Files of a lease whose process died are removed, except the archive its checkpoint resumes.
+    """
+
+    LEASE_DIR = ".staging"
+
+    def __init__(self, path: str, min_free: int = 0):
+        self.path: str = os.path.abspath(path)
+        self.min_free: int = min_free
+
+    def __str__(self) -> str:
+        return self.path
+
+    def free(self) -> int:
+        stat = os.statvfs(self.path)
+        return stat.f_bavail * stat.f_frsize
+
+    def available(self, leases: List[dict]) -> int:
+        """Space left for a new archive: free space not reserved by live leases and above min_free"""
+        reserved = sum(max(0, x["estimate"] - self.staged_size(x["prefix"])) for x in leases)
+        return self.free() - reserved - self.min_free
+
+    def staged_size(self, prefix: str) -> int:
+        return sum(os.path.getsize(x) for x in self.staged_files(prefix))
+
+    def staged_files(self, prefix: str) -> List[str]:
+        """Archives, volumes, shards and manifests of the versions of an archive staged in the area"""
+        pattern = re.compile(re.escape(prefix) + r"\d{8}_\d{6}[.\w-]*$")
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(x.path for x in os.scandir(self.path) if x.is_file() and pattern.match(x.name))
+
+    def leases(self) -> List[dict]:
+        """Live leases of the area. Leases left by dead processes are cleaned up on the way"""
+        directory = os.path.join(self.path, StagingArea.LEASE_DIR)
+        if not os.path.isdir(directory):
+            return []
+        leases = []
+        for entry in os.scandir(directory):
+            if not entry.name.endswith(".lease"):
+                continue
+            try:
+                with open(entry.path, 'r') as file:
+                    try:
+                        fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        leases.append(json.loads(file.read()))
+                        continue
+                    content = file.read()
+                    self.__cleanup(entry.path, json.loads(content) if content else None)
+            except (OSError, ValueError) as e:
+                # Released (or being written) while listed
+                LOGGER.debug(f"Skipping staging lease '{entry.path}': {e}")
+        return leases
+
+    def __cleanup(self, lease_path: str, lease: Optional[dict]) -> None:
+        """Removes the staged files of a lease whose process died, but the archive its checkpoint can resume"""
+        if lease is not None:
+            checkpoint = ArchiveCheckpoint.load(lease["checkpoint"]) if lease["checkpoint"] is not None else None
+            kept = checkpoint.archive_path if checkpoint is not None else None
+            for path in self.staged_files(lease["prefix"]):
+                if path != kept:
+                    LOGGER.warning(f"Removing archive staged by an interrupted run (pid {lease['pid']}): {path}")
+                    os.remove(path)
+                else:
+                    LOGGER.info(f"Keeping archive staged by an interrupted run, its checkpoint resumes it: {path}")
+        os.remove(lease_path)
+
+    def lease(self, prefix: str, estimate: int, checkpoint_path: Optional[str]) -> StagingLease:
+        directory = os.path.join(self.path, StagingArea.LEASE_DIR)
+        os.makedirs(directory, exist_ok=True)
+        lease = StagingLease(self, os.path.join(directory, f"{prefix}{os.getpid()}_{time.monotonic_ns()}.lease"), prefix, estimate)
+        lease.acquire(checkpoint_path)
+        return lease
+
+    def lock(self):
+        """Exclusive lock of the admission in this area, so two processes do not take the same space"""
+        directory = os.path.join(self.path, StagingArea.LEASE_DIR)
+        os.makedirs(directory, exist_ok=True)
+        file = open(os.path.join(directory, "admission.lock"), 'w')
+        fcntl.flock(file, fcntl.LOCK_EX)
+        return file
+
+
+class AdmissionController:
+    """Chooses the staging area of an archive and admits it once the area has room for its estimated size.
+
+    Areas are tried in order, the one holding a resumable archive first. An archive is admitted to the first area
+    with `available` space for its estimate and fewer than `max_archives` live leases. When no area has room but
+    other archives are staged, it waits for them to be released. When no area could ever hold it, the run fails
+    before anything is written, instead of filling the disk partway through.
+    """
+
+    POLL_INTERVAL = 5.0
+
+    def __init__(self, areas: List[StagingArea], max_archives: Optional[int] = None, check_cancelled: Optional[Callable[[], None]] = None):
+        self.areas: List[StagingArea] = areas
+        self.max_archives: Optional[int] = max_archives
+        self.__check_cancelled = check_cancelled
+
+    def cleanup(self) -> None:
+        """Removes what interrupted runs left in every area"""
+        for area in self.areas:
+            lock = area.lock()
+            try:
+                area.leases()
+            finally:
+                lock.close()
+
+    def admit(self, prefix: str, estimate: Optional[int], checkpoint_path: Optional[str] = None, preferred: Optional[str] = None) -> StagingLease:
+        """Lease of the area the archive is staged in. Without an estimate only min_free is checked"""
+        areas = sorted(self.areas, key=lambda x: x.path != preferred)
+        estimate = 0 if estimate is None else estimate
+        self.cleanup()
+        waiting = False
+        while True:
+            staged = 0
+            for area in areas:
+                lock = area.lock()
+                try:
+                    leases = area.leases()
+                    staged += len(leases)
+                    available = area.available(leases)
+                    if available >= estimate and (self.max_archives is None or len(leases) < self.max_archives):
+                        LOGGER.info(f"Staging in '{area}': {estimate} bytes estimated, {available} bytes available, {len(leases)} other archives staged")
+                        return area.lease(prefix, estimate, checkpoint_path)
+                    LOGGER.debug(f"Staging area '{area}' cannot take {estimate} bytes: {available} bytes available, {len(leases)} archives staged")
+                finally:
+                    lock.close()
+            if staged == 0:
+                raise VaultBackupException(f"No staging area has room for an archive of {estimate} bytes: " +
+                                           ", ".join(f"'{x}' {x.free()} bytes free (keeping {x.min_free})" for x in areas))
+            if not waiting:
+                LOGGER.info(f"Waiting for one of {staged} staged archives to be released before staging {estimate} bytes")
+                waiting = True
+            if self.__check_cancelled is not None:
+                self.__check_cancelled()
+            time.sleep(AdmissionController.POLL_INTERVAL)
@@ -0,0 +1,79 @@
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Optional, Dict
+
+from core.type import Archive, ArchiveDestination
+from misc.utils import LOGGER, VaultBackupException, write_atomic
+
+
+class StateStore:
+    """Run state of every destination (last run, fingerprint, last archive and its checksum, upload throughput).
+
+    It is kept apart from the configuration and committed as soon as a destination is done, by replacing the whole
+    file atomically, so a run that crashes keeps the destinations it finished and the next run only redoes the rest.
+    """
+
+    def __init__(self, path: str):
+        self.path: str = os.path.abspath(path)
+        self.__lock = threading.Lock()
+        self.__state: Dict[str, Dict[str, dict]] = {}
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, 'r') as state_file:
+                    self.__state = json.loads(state_file.read())
+            except ValueError as e:
+                raise VaultBackupException(f"State file '{self.path}' is corrupted: {e}")
+
+    def get(self, archive: Archive, dst: ArchiveDestination) -> dict:
+        with self.__lock:
+            return dict(self.__state.get(StateStore.__archive_key(archive), {}).get(StateStore.__destination_key(dst), {}))
+
+    def restore(self, archive: Archive) -> None:
+        """Applies the committed state to destinations whose configuration is older"""
+        for dst in archive.destinations:
+            state = self.get(archive, dst)
+            if state.get("last_run") is None:
+                continue
+            last_run = datetime.fromisoformat(state["last_run"])
+            if last_run > dst.last_run:
+                LOGGER.debug(f"[{dst.label}] Last run restored from state: {last_run.isoformat()}")
+                dst.last_run = last_run
+                dst.fingerprint = state.get("fingerprint")
+
+    def commit(self, archive: Archive, dst: ArchiveDestination, version: Optional[str] = None, checksum: Optional[str] = None,
+               throughput: Optional[float] = None) -> None:
+        """Stores the last run and fingerprint of a destination and persists it. The version (the archive name and its
+        checksum) and the upload throughput are updated only when given"""
+        with self.__lock:
+            state = self.__state.setdefault(StateStore.__archive_key(archive), {}).setdefault(StateStore.__destination_key(dst), {})
+            if version is not None:
+                state["archive"] = version
+                state["checksum"] = checksum
+            if throughput is not None:
+                state["throughput"] = throughput
+            state["last_run"] = dst.last_run.isoformat()
+            state["fingerprint"] = dst.fingerprint
+            self.__save()
+        LOGGER.debug(f"[{dst.label}] State committed")
+
+    def commit_verification(self, archive: Archive, dst: ArchiveDestination, results: Dict[str, dict]) -> None:
+        """Stores the verification result of every retained version of a destination, replacing those of removed versions"""
+        with self.__lock:
+            state = self.__state.setdefault(StateStore.__archive_key(archive), {}).setdefault(StateStore.__destination_key(dst), {})
+            state["verification"] = results
+            self.__save()
+        LOGGER.debug(f"[{dst.label}] Verification committed")
+
+    def __save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        write_atomic(self.path, json.dumps(self.__state, indent='\t'))
+
+    @staticmethod
+    def __archive_key(archive: Archive) -> str:
+        return f"{archive.name}:{archive.path}"
+
+    @staticmethod
+    def __destination_key(dst: ArchiveDestination) -> str:
+        return f"{'remote' if dst.remote else 's3' if dst.s3 else 'local'}:{dst.path}"
@@ -0,0 +1,223 @@
+import io
+import os
+import stat
+from typing import List, BinaryIO
+
+from paramiko.sftp_client import SFTPClient
+
+from core.s3 import S3Client
+
+
+class Storage:
+    """Minimal file store used by the repository format and the verification: names relative to a root, written atomically."""
+
+    def __init__(self, root: str):
+        self.root: str = root
+
+    def read(self, name: str) -> bytes:
+        raise NotImplementedError()
+
+    def write(self, name: str, data: bytes) -> None:
+        raise NotImplementedError()
+
+    def exists(self, name: str) -> bool:
+        raise NotImplementedError()
+
+    def open(self, name: str) -> BinaryIO:
+        """Seekable reader, for ranged reads of large files"""
+        raise NotImplementedError()
+
+    def size(self, name: str) -> int:
+        raise NotImplementedError()
+
+    def list(self, directory: str = "") -> List[str]:
+        """Names of the files directly under a directory. Empty if the directory does not exist"""
+        raise NotImplementedError()
+
+    def list_dirs(self, directory: str = "") -> List[str]:
+        raise NotImplementedError()
+
+    def delete(self, name: str) -> None:
+        raise NotImplementedError()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name) if name else self.root
+
+
+class LocalStorage(Storage):
+
+    def read(self, name: str) -> bytes:
+        with open(self._path(name), 'rb') as file:
+            return file.read()
+
+    def write(self, name: str, data: bytes) -> None:
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", 'wb') as file:
+            file.write(data)
+        os.replace(path + ".tmp", path)
+
+    def exists(self, name: str) -> bool:
+        return os.path.isfile(self._path(name))
+
+    def open(self, name: str) -> BinaryIO:
+        return open(self._path(name), 'rb')
+
+    def size(self, name: str) -> int:
+        return os.path.getsize(self._path(name))
+
+    def list(self, directory: str = "") -> List[str]:
+        path = self._path(directory)
+        if not os.path.isdir(path):
+            return []
+        return [x.name for x in os.scandir(path) if x.is_file() and not x.name.endswith(".tmp")]
+
+    def list_dirs(self, directory: str = "") -> List[str]:
+        path = self._path(directory)
+        if not os.path.isdir(path):
+            return []
+        return [x.name for x in os.scandir(path) if x.is_dir()]
+
+    def delete(self, name: str) -> None:
+        os.remove(self._path(name))
+
+
+class SFTPStorage(Storage):
+
+    def __init__(self, root: str, sftp: SFTPClient):
+        super().__init__(root)
+        self.__sftp = sftp
+        self.__dirs = set()
+
+    def read(self, name: str) -> bytes:
+        with self.__sftp.open(self._path(name), 'rb') as file:
+            file.prefetch()
+            return file.read()
+
+    def write(self, name: str, data: bytes) -> None:
+        path = self._path(name)
+        self.__makedirs(os.path.dirname(path))
+        with self.__sftp.open(path + ".tmp", 'wb') as file:
+            file.set_pipelined(True)
+            file.write(data)
+        self.__sftp.posix_rename(path + ".tmp", path)
+
+    def exists(self, name: str) -> bool:
+        try:
+            self.__sftp.stat(self._path(name))
+            return True
+        except IOError:
+            return False
+
+    def open(self, name: str) -> BinaryIO:
+        return self.__sftp.open(self._path(name), 'rb')
+
+    def size(self, name: str) -> int:
+        return self.__sftp.stat(self._path(name)).st_size
+
+    def list(self, directory: str = "") -> List[str]:
+        return [x.filename for x in self.__listdir(directory) if stat.S_ISREG(x.st_mode) and not x.filename.endswith(".tmp")]
+
+    def list_dirs(self, directory: str = "") -> List[str]:
+        return [x.filename for x in self.__listdir(directory) if stat.S_ISDIR(x.st_mode)]
+
+    def delete(self, name: str) -> None:
+        self.__sftp.remove(self._path(name))
+
+    def __listdir(self, directory: str) -> list:
+        try:
+            return self.__sftp.listdir_attr(self._path(directory))
+        except IOError:
+            return []
+
+    def __makedirs(self, path: str) -> None:
+        if path in self.__dirs or path in ["", "/"]:
+            return
+        try:
+            self.__sftp.stat(path)
+        except IOError:
+            self.__makedirs(os.path.dirname(path))
+            self.__sftp.mkdir(path)
+        self.__dirs.add(path)
+
+
+class S3Reader(io.RawIOBase):
+    """Seekable reader of an object, through ranged GETs of at least READ_AHEAD bytes"""
+
+    READ_AHEAD = 256 * 1024
+
+    def __init__(self, client: S3Client, bucket: str, key: str, size: int):
+        super().__init__()
+        self.__client = client
+        self.__bucket = bucket
+        self.__key = key
+        self.size: int = size
+        self.__position = 0
+        self.__buffer = b""
+        self.__buffer_offset = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.__position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self.__position = {io.SEEK_SET: 0, io.SEEK_CUR: self.__position, io.SEEK_END: self.size}[whence] + offset
+        return self.__position
+
+    def readinto(self, buffer) -> int:
+        end = min(self.size, self.__position + len(buffer))
+        if self.__position >= end:
+            return 0
+        if not self.__buffer_offset <= self.__position or end > self.__buffer_offset + len(self.__buffer):
+            self.__buffer_offset = self.__position
+            self.__buffer = self.__client.get_object(self.__bucket, self.__key, self.__position, min(self.size, max(end, self.__position + S3Reader.READ_AHEAD)))
+        data = self.__buffer[self.__position - self.__buffer_offset:end - self.__buffer_offset]
+        buffer[:len(data)] = data
+        self.__position += len(data)
+        return len(data)
+
+
+class S3Storage(Storage):
+    """Objects under `<bucket>/<prefix>`, names relative to it. A PUT is atomic, the object appears once complete"""
+
+    def __init__(self, root: str, client: S3Client):
+        super().__init__(root.strip("/"))
+        self.__client = client
+        self.__bucket, _, self.__prefix = self.root.partition("/")
+
+    def read(self, name: str) -> bytes:
+        return self.__client.get_object(self.__bucket, self.__key(name))
+
+    def write(self, name: str, data: bytes) -> None:
+        self.__client.put_object(self.__bucket, self.__key(name), data)
+
+    def exists(self, name: str) -> bool:
+        return self.__client.head_object(self.__bucket, self.__key(name)) is not None
+
+    def open(self, name: str) -> BinaryIO:
+        return io.BufferedReader(S3Reader(self.__client, self.__bucket, self.__key(name), self.size(name)))
+
+    def size(self, name: str) -> int:
+        headers = self.__client.head_object(self.__bucket, self.__key(name))
+        if headers is None:
+            raise FileNotFoundError(f"Object '{self.__key(name)}' does not exist in bucket '{self.__bucket}'")
+        return int(headers["content-length"])
+
+    def list(self, directory: str = "") -> List[str]:
+        prefix = self.__key(directory) + "/" if self.__key(directory) else ""
+        return [x.key[len(prefix):] for x in self.__client.list_objects(self.__bucket, prefix, "/")[0]]
+
+    def list_dirs(self, directory: str = "") -> List[str]:
+        prefix = self.__key(directory) + "/" if self.__key(directory) else ""
+        return [x[len(prefix):].rstrip("/") for x in self.__client.list_objects(self.__bucket, prefix, "/")[1]]
+
+    def delete(self, name: str) -> None:
+        self.__client.delete_objects(self.__bucket, [self.__key(name)])
+
+    def __key(self, name: str) -> str:
+        return "/".join(x for x in [self.__prefix, name] if x)
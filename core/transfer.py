@@ -0,0 +1,181 @@
+import errno
+import fcntl
+import mmap
+import os
+import shutil
+import time
+from typing import Optional, Tuple, Callable
+
+from core.type import TransferInfo
+from misc.utils import LOGGER
+
+
+class TransferStats:
+    """Throughput and CPU usage of a single copy."""
+
+    def __init__(self, method: str, size: int, seconds: float, cpu_seconds: float):
+        self.method: str = method
+        self.size: int = size
+        self.seconds: float = seconds
+        self.cpu_seconds: float = cpu_seconds
+
+    def throughput(self) -> float:
+        """Bytes per second"""
+        return self.size / self.seconds if self.seconds > 0 else 0.0
+
+    def cpu_usage(self) -> float:
+        """CPU time of the copying thread relative to the wall time, as percentage"""
+        return 100 * self.cpu_seconds / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self) -> str:
+        return "{:.1f} MiB in {:.2f}s ({:.1f} MiB/s, CPU {:.0f}%) via {}".format(
+            self.size / 1024 ** 2, self.seconds, self.throughput() / 1024 ** 2, self.cpu_usage(), self.method)
+
+
+class LocalTransfer:
+    """Copies files between local paths using the fastest mechanism the kernel offers.
+
+    Tries, in order: a reflink (FICLONE), copy_file_range, sendfile and large buffered I/O. With `drop_cache` the
+    copied ranges are flushed and dropped from the page cache as the copy goes, so a copy does not evict the
+    working set of other processes. With `direct_io` the kernel fast paths are skipped and data goes through
+    aligned O_DIRECT reads and writes.
+    """
+
+    FICLONE = 0x40049409
+    ALIGNMENT = 4096
+    DROP_CACHE_INTERVAL = 64 * 1024 * 1024
+    FALLBACK_ERRORS = [errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF, errno.ENOTSUP]
+
+    def __init__(self, info: Optional[TransferInfo] = None):
+        self.info: TransferInfo = info if info is not None else TransferInfo()
+
+    def copy(self, source: str, target: str, throttle: Optional[Callable[[int], None]] = None) -> TransferStats:
+        """Copies a file. `throttle` is called with the size of every copied chunk and may block to slow the copy down"""
+        if os.path.isdir(target):
+            target = os.path.join(target, os.path.basename(source))
+        start_time, start_cpu = time.perf_counter(), time.thread_time()
+        src_fd = self.__open(source, os.O_RDONLY)
+        try:
+            dst_fd = self.__open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                size = os.fstat(src_fd).st_size
+                self.__advise(src_fd, 0, 0, "POSIX_FADV_SEQUENTIAL")
+                method = self.__copy(src_fd, dst_fd, size, throttle)
+            finally:
+                os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+        shutil.copystat(source, target)
+        stats = TransferStats(method, size, time.perf_counter() - start_time, time.thread_time() - start_cpu)
+        LOGGER.debug(f"Copied '{source}' to '{target}': {stats}")
+        return stats
+
+    def __copy(self, src_fd: int, dst_fd: int, size: int, throttle: Optional[Callable[[int], None]]) -> str:
+        if not self.info.direct_io:
+            if throttle is None and self.__clone(src_fd, dst_fd):
+                return "reflink"
+            offset = 0
+            for method, copy_range in [("copy_file_range", self.__copy_file_range), ("sendfile", self.__sendfile)]:
+                offset, error = copy_range(src_fd, dst_fd, offset, size, throttle)
+                if error is None:
+                    return method
+                # The fast path is not available here, carry on from where it stopped with the next one
+                LOGGER.debug(f"{method} is not available: {error}")
+            self.__buffered(src_fd, dst_fd, offset, size, throttle)
+            return "buffered"
+        self.__buffered(src_fd, dst_fd, 0, size, throttle)
+        return "direct" if self.__is_direct(dst_fd) else "buffered"
+
+    # noinspection PyMethodMayBeStatic
+    def __clone(self, src_fd: int, dst_fd: int) -> bool:
+        try:
+            fcntl.ioctl(dst_fd, LocalTransfer.FICLONE, src_fd)
+            return True
+        except OSError:
+            return False
+
+    def __copy_file_range(self, src_fd: int, dst_fd: int, offset: int, size: int, throttle) -> Tuple[int, Optional[OSError]]:
+        if not hasattr(os, "copy_file_range"):
+            return offset, OSError(errno.ENOSYS, "copy_file_range is not supported")
+        return self.__copy_loop(src_fd, dst_fd, offset, size, throttle, lambda position, count: os.copy_file_range(src_fd, dst_fd, count, position, position))
+
+    def __sendfile(self, src_fd: int, dst_fd: int, offset: int, size: int, throttle) -> Tuple[int, Optional[OSError]]:
+        os.lseek(dst_fd, offset, os.SEEK_SET)
+        return self.__copy_loop(src_fd, dst_fd, offset, size, throttle, lambda position, count: os.sendfile(dst_fd, src_fd, position, count))
+
+    def __copy_loop(self, src_fd: int, dst_fd: int, offset: int, size: int, throttle, copy_range) -> Tuple[int, Optional[OSError]]:
+        """Returns the offset reached and, if the copy could not be completed this way, the error to fall back on"""
+        dropped = offset
+        while offset < size:
+            try:
+                copied = copy_range(offset, min(self.info.buffer_size, size - offset))
+            except OSError as e:
+                if e.errno not in LocalTransfer.FALLBACK_ERRORS:
+                    raise
+                return offset, e
+            if copied == 0:
+                break
+            offset += copied
+            if throttle is not None:
+                throttle(copied)
+            if offset - dropped >= LocalTransfer.DROP_CACHE_INTERVAL:
+                self.__drop_cache(src_fd, dst_fd, dropped, offset)
+                dropped = offset
+        self.__drop_cache(src_fd, dst_fd, dropped, offset)
+        return offset, None
+
+    def __buffered(self, src_fd: int, dst_fd: int, offset: int, size: int, throttle) -> None:
+        buffer_size = -(-self.info.buffer_size // LocalTransfer.ALIGNMENT) * LocalTransfer.ALIGNMENT
+        dropped = offset
+        direct = self.__is_direct(dst_fd)
+        # Anonymous mappings are page aligned, as O_DIRECT requires
+        with mmap.mmap(-1, buffer_size) as buffer:
+            view = memoryview(buffer)
+            try:
+                while offset < size:
+                    read = os.preadv(src_fd, [view], offset)
+                    if read == 0:
+                        break
+                    length = -(-read // LocalTransfer.ALIGNMENT) * LocalTransfer.ALIGNMENT if direct else read
+                    os.pwritev(dst_fd, [view[:length]], offset)
+                    offset += read
+                    if throttle is not None:
+                        throttle(read)
+                    if offset - dropped >= LocalTransfer.DROP_CACHE_INTERVAL:
+                        self.__drop_cache(src_fd, dst_fd, dropped, offset)
+                        dropped = offset
+            finally:
+                view.release()
+        if direct:
+            # The last block was padded to the alignment
+            os.ftruncate(dst_fd, offset)
+        self.__drop_cache(src_fd, dst_fd, dropped, offset)
+
+    def __drop_cache(self, src_fd: int, dst_fd: int, start: int, end: int) -> None:
+        if not self.info.drop_cache or end <= start:
+            return
+        # Dirty pages cannot be dropped, so the written range is flushed first
+        os.fdatasync(dst_fd)
+        self.__advise(src_fd, start, end - start, "POSIX_FADV_DONTNEED")
+        self.__advise(dst_fd, start, end - start, "POSIX_FADV_DONTNEED")
+
+    # noinspection PyMethodMayBeStatic
+    def __advise(self, fd: int, offset: int, length: int, advice: str) -> None:
+        if hasattr(os, "posix_fadvise") and hasattr(os, advice):
+            try:
+                os.posix_fadvise(fd, offset, length, getattr(os, advice))
+            except OSError as e:
+                LOGGER.debug(f"posix_fadvise({advice}) failed: {e}")
+
+    def __open(self, path: str, flags: int, mode: int = 0o777) -> int:
+        if self.info.direct_io and hasattr(os, "O_DIRECT"):
+            try:
+                return os.open(path, flags | os.O_DIRECT, mode)
+            except OSError as e:
+                # Some filesystems (e.g. tmpfs) do not support O_DIRECT
+                LOGGER.debug(f"Cannot open '{path}' with O_DIRECT: {e}")
+        return os.open(path, flags, mode)
+
+    # noinspection PyMethodMayBeStatic
+    def __is_direct(self, fd: int) -> bool:
+        return hasattr(os, "O_DIRECT") and fcntl.fcntl(fd, fcntl.F_GETFL) & os.O_DIRECT != 0
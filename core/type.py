@@ -1,7 +1,8 @@
+import hashlib
 import os.path
 import re
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Tuple, Dict
 
 from misc.utils import LOGGER
 from misc.utils import password_decrypt, VaultBackupException
@@ -31,41 +32,229 @@ class SSHInfo:
         return indent + f"{self.user}@{self.ip}:{self.port}"
 
 
+class TransferInfo:
+    """Tuning of local copies"""
+
+    DEFAULT_BUFFER_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, buffer_size: Optional[int] = None, direct_io: bool = False, drop_cache: bool = True):
+        self.buffer_size: int = TransferInfo.DEFAULT_BUFFER_SIZE if buffer_size is None else buffer_size
+        self.direct_io: bool = direct_io
+        self.drop_cache: bool = drop_cache
+        if self.buffer_size <= 0:
+            raise VaultBackupException("Transfer buffer size must be greater than 0.")
+        LOGGER.debug(f"Initialized TransferInfo: {self.display()}")
+
+    def display(self, indent: str = "") -> str:
+        return indent + f"buffer: {self.buffer_size}, direct I/O: {self.direct_io}, drop cache: {self.drop_cache}"
+
+
+class GovernorInfo:
+    """Limits of the resources a backup run may use"""
+
+    IONICE_CLASSES = ["realtime", "best-effort", "idle"]
+
+    def __init__(self, read_rate: Optional[int] = None, upload_rate: Optional[int] = None, nice: Optional[int] = None,
+                 ionice_class: Optional[str] = None, ionice_level: Optional[int] = None, drop_cache: bool = True,
+                 adaptive: bool = False, max_load: Optional[float] = None, max_disk_latency: Optional[float] = None):
+        self.read_rate: Optional[int] = read_rate
+        self.upload_rate: Optional[int] = upload_rate
+        self.nice: Optional[int] = nice
+        self.ionice_class: Optional[str] = ionice_class
+        self.ionice_level: Optional[int] = ionice_level
+        self.drop_cache: bool = drop_cache
+        self.adaptive: bool = adaptive
+        self.max_load: float = 1.0 if max_load is None else max_load
+        self.max_disk_latency: float = 50.0 if max_disk_latency is None else max_disk_latency
+        if any(x is not None and x <= 0 for x in [read_rate, upload_rate]):
+            raise VaultBackupException("Governor rates must be greater than 0.")
+        if ionice_class is not None and ionice_class not in GovernorInfo.IONICE_CLASSES:
+            raise VaultBackupException(f"I/O priority class '{ionice_class}' is not supported. Expected one of: {GovernorInfo.IONICE_CLASSES}")
+        LOGGER.debug(f"Initialized GovernorInfo: {self.display()}")
+
+    def display(self, indent: str = "") -> str:
+        return indent + f"read rate: {self.read_rate}, upload rate: {self.upload_rate}, nice: {self.nice}, " \
+                        f"ionice: {self.ionice_class}, drop cache: {self.drop_cache}, adaptive: {self.adaptive}"
+
+
+class ProgressInfo:
+    """How the progress of a backup run is reported"""
+
+    DEFAULT_INTERVAL = 10.0
+
+    def __init__(self, interval: Optional[float] = None, status_file: Optional[str] = None, trace_sample: Optional[int] = None, estimate: bool = False):
+        self.interval: float = ProgressInfo.DEFAULT_INTERVAL if interval is None else interval
+        self.status_file: Optional[str] = None if status_file is None else os.path.abspath(status_file)
+        self.trace_sample: int = 0 if trace_sample is None else trace_sample
+        self.estimate: bool = estimate
+        if self.interval <= 0:
+            raise VaultBackupException("Progress interval must be greater than 0.")
+        if self.trace_sample < 0:
+            raise VaultBackupException("Progress trace sample must be at least 0.")
+        LOGGER.debug(f"Initialized ProgressInfo: {self.display()}")
+
+    def display(self, indent: str = "") -> str:
+        return indent + f"interval: {self.interval}s, status file: {self.status_file}, trace sample: {self.trace_sample}, estimate: {self.estimate}"
+
+
+class StagingInfo:
+    """Where archives are staged before they are copied to the destinations, and how much of it they may take"""
+
+    def __init__(self, paths: Optional[List[str]] = None, min_free: Optional[int] = None, max_archives: Optional[int] = None):
+        self.paths: List[str] = [os.path.abspath(x) for x in paths] if paths is not None else []
+        self.min_free: int = 0 if min_free is None else min_free
+        self.max_archives: Optional[int] = max_archives
+        if self.min_free < 0:
+            raise VaultBackupException("Staging min free space must be at least 0.")
+        if max_archives is not None and max_archives <= 0:
+            raise VaultBackupException("Staging max archives number must be at least 1.")
+        LOGGER.debug(f"Initialized StagingInfo: {self.display()}")
+
+    def display(self, indent: str = "") -> str:
+        return indent + f"paths: {self.paths if len(self.paths) > 0 else 'default'}, min free: {self.min_free}, max archives: {self.max_archives}"
+
+
+class S3Info:
+    """Object storage (S3 protocol) connection, and how archives are uploaded to it"""
+
+    DEFAULT_REGION = "us-east-1"
+    DEFAULT_PART_SIZE = 16 * 1024 * 1024
+    MIN_PART_SIZE = 5 * 1024 * 1024
+    DEFAULT_PARALLEL_PARTS = 8
+
+    def __init__(self, endpoint: str, access_key: str, region: Optional[str] = None, part_size: Optional[int] = None, parallel_parts: Optional[int] = None):
+        self.endpoint: str = endpoint.rstrip("/")
+        self.access_key: str = access_key
+        self.__secret_key: Optional[str] = None
+        self.region: str = S3Info.DEFAULT_REGION if region is None else region
+        self.part_size: int = S3Info.DEFAULT_PART_SIZE if part_size is None else part_size
+        self.parallel_parts: int = S3Info.DEFAULT_PARALLEL_PARTS if parallel_parts is None else parallel_parts
+        if not re.match(r"^https?://[^/]+$", self.endpoint):
+            raise VaultBackupException(f"S3 endpoint '{endpoint}' is not supported. Expected: http(s)://<host>[:<port>]")
+        if self.part_size < S3Info.MIN_PART_SIZE:
+            raise VaultBackupException(f"S3 part size must be at least {S3Info.MIN_PART_SIZE} bytes.")
+        if self.parallel_parts <= 0:
+            raise VaultBackupException("S3 parallel parts number must be at least 1.")
+        LOGGER.debug(f"Initialized S3Info: {self.display()}")
+
+    def get_secret_key(self, decrypt: bool = True) -> str:
+        return self.__secret_key if self.__secret_key is None else password_decrypt(self.__secret_key) if decrypt else self.__secret_key
+
+    def set_secret_key(self, secret_key: Optional[str]) -> None:
+        """Expects encrypted secret key"""
+        self.__secret_key = secret_key
+
+    def display(self, indent: str = "") -> str:
+        return indent + f"{self.access_key}@{self.endpoint} ({self.region}), part size: {self.part_size}, parallel parts: {self.parallel_parts}"
+
+
+class BackupEvent:
+    """Something that happened during a backup run, as streamed by BackupExecutor.events"""
+
+    STARTED = "started"
+    PROGRESS = "progress"
+    FINISHED = "finished"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    def __init__(self, kind: str, archive: Optional[str], data: Optional[dict] = None):
+        self.kind: str = kind
+        self.archive: Optional[str] = archive
+        self.data: dict = data if data is not None else {}
+
+    def __str__(self) -> str:
+        return f"{self.kind} {self.archive}: {self.data}"
+
+
 class ArchiveDestination:
     """Information about where archived data is going to be stored."""
+    ARCHIVE_TYPE = "archive"
+    MIRROR_TYPE = "mirror"
+    TYPES = [ARCHIVE_TYPE, MIRROR_TYPE]
 
-    def __init__(self, label: str, path: str, remote: bool, versions: int, last_run: datetime):
+    def __init__(self, label: str, path: str, remote: bool, versions: int, last_run: datetime, fingerprint: Optional[str] = None, s3: bool = False):
         self.label: str = label
-        self.path: str = os.path.abspath(path)
+        # The path of an S3 destination is "<bucket>[/<prefix>]"
+        self.path: str = path.strip("/") if s3 else os.path.abspath(path)
         self.remote: bool = remote
+        self.s3: bool = s3
         self.versions: int = versions
         self.last_run: datetime = last_run
+        self.fingerprint: Optional[str] = fingerprint
+        self.type: str = ArchiveDestination.ARCHIVE_TYPE
+        self.compress: bool = False
+        self.encrypt: bool = False
         self.is_eligible = False
         if versions <= 0:
             raise VaultBackupException("Versions number must be at least 1.")
+        if s3 and remote:
+            raise VaultBackupException(f"Destination '{label}' cannot be both remote and S3.")
+        if s3 and self.path == "":
+            raise VaultBackupException(f"Destination '{label}' is S3, its path must start with the bucket.")
         LOGGER.debug(f"Initialized Archive Destination: {self}")
 
     def __str__(self) -> str:
         return self.label
 
+    def set_type(self, dst_type: Optional[str], compress: bool = False, encrypt: bool = False) -> None:
+        """Compression and encryption of the files apply to mirror destinations"""
+        dst_type = ArchiveDestination.ARCHIVE_TYPE if dst_type is None else dst_type.lower()
+        if dst_type not in ArchiveDestination.TYPES:
+            raise VaultBackupException(f"Destination type '{dst_type}' is not supported. Expected one of: {ArchiveDestination.TYPES}")
+        if dst_type == ArchiveDestination.MIRROR_TYPE and (self.remote or self.s3):
+            raise VaultBackupException(f"Destination '{self.label}' is remote, mirror destinations must be local.")
+        self.type, self.compress, self.encrypt = dst_type, compress, encrypt
+
     def __eq__(self, other) -> bool:
         return False if not isinstance(other, ArchiveDestination) else \
             True if self.__hash__() == other.__hash__() else False
 
     def __hash__(self) -> int:
-        return "{}{}".format(self.path, self.remote).__hash__()
+        return "{}{}{}".format(self.path, self.remote, self.s3).__hash__()
 
     def display(self, indent: str = "") -> str:
-        return indent + "[{}{}] {} - versions: {}".format(self.label, " @ Remote" if self.remote else "", self.path, self.versions)
+        return indent + "[{}{}] {} - versions: {}{}".format(self.label, " @ Remote" if self.remote else " @ S3" if self.s3 else "", self.path, self.versions,
+                                                          f" - {self.type}" if self.type != ArchiveDestination.ARCHIVE_TYPE else "")
 
 
 class Archive:
     dir_path = "/".join(os.path.dirname(os.path.abspath(__file__)).split("/")[:-1])
+    ZIP_ENCRYPTION = "zip"
+    STREAM_ENCRYPTION = "stream"
+    ENCRYPTION_MODES = [ZIP_ENCRYPTION, STREAM_ENCRYPTION]
+    DEFAULT_PARALLEL_UPLOADS = 4
+    DEFAULT_SCAN_THREADS = 1
+    DEFAULT_PULL_CHANNELS = 4
+    READ_ORDERS = ["walk", "inode", "extent"]
+    DEFAULT_READ_AHEAD = 64 * 1024 * 1024
+    ZIP_FORMAT = "zip"
+    REPOSITORY_FORMAT = "repository"
+    FORMATS = [ZIP_FORMAT, REPOSITORY_FORMAT]
+    AUTO_COMPRESSION = "auto"
 
     def __init__(self, name: str, path: str):
         self.name: str = name
         self.path: str = os.path.abspath(path)
         self.destinations: List[ArchiveDestination] = []
+        self.__known_destinations: Dict[ArchiveDestination, ArchiveDestination] = {}
+        self.format: str = Archive.ZIP_FORMAT
+        self.encryption: str = Archive.ZIP_ENCRYPTION
+        self.compression: Optional[int | str] = None
+        self.volume_size: Optional[int] = None
+        self.parallel_uploads: int = Archive.DEFAULT_PARALLEL_UPLOADS
+        self.verify_content: bool = False
+        self.scan_threads: int = Archive.DEFAULT_SCAN_THREADS
+        self.shards: Optional[int] = None
+        self.shard_workers: Optional[int] = None
+        self.shard_host: Tuple[int, int] = (1, 1)
+        self.command: Optional[str] = None
+        self.probe: Optional[str] = None
+        self.member: Optional[str] = None
+        self.remote: bool = False
+        self.pull_channels: int = Archive.DEFAULT_PULL_CHANNELS
+        self.read_order: Optional[str] = None
+        self.read_ahead: int = Archive.DEFAULT_READ_AHEAD
+        self.staging_dir: Optional[str] = None
         self.__password: Optional[str] = None
         self.__archive_path: Optional[str] = None
         if not re.match(r".+\.zip", self.name):
@@ -82,13 +271,34 @@ class Archive:
     def __hash__(self) -> int:
         return (self.name + self.path + (self.__password if self.__password is not None else "")).__hash__()
 
-    def get_archive_path(self, start_time: datetime = None) -> str:
-        if self.__archive_path is None:
-            name = ".".join(self.name.split(".")[:-1])
-            date_format = start_time.strftime("%Y%m%d_%H%M%S")
-            self.__archive_path = os.path.join(Archive.dir_path, f"{name}_{date_format}.zip")
+    def get_archive_path(self, start_time: datetime = None) -> Optional[str]:
+        """Path of the archive of the current run, set by passing the start time of the run. None before it is set"""
+        if start_time is not None:
+            self.__archive_path = self.get_version_path(start_time)
         return self.__archive_path
 
+    def get_version_path(self, start_time: datetime) -> str:
+        """Path of the archive of the version started at `start_time`, in the staging directory"""
+        name = ".".join(self.name.split(".")[:-1])
+        date_format = start_time.strftime("%Y%m%d_%H%M%S")
+        extension = ".zip.enc" if self.encryption == Archive.STREAM_ENCRYPTION else ".zip"
+        return os.path.join(self.staging_dir if self.staging_dir is not None else Archive.dir_path, f"{name}_{date_format}{extension}")
+
+    def reset_archive_path(self) -> None:
+        self.__archive_path = None
+
+    def set_format(self, archive_format: Optional[str]) -> None:
+        archive_format = Archive.ZIP_FORMAT if archive_format is None else archive_format.lower()
+        if archive_format not in Archive.FORMATS:
+            raise VaultBackupException(f"Format '{archive_format}' is not supported. Expected one of: {Archive.FORMATS}")
+        self.format = archive_format
+
+    def set_encryption(self, encryption: Optional[str]) -> None:
+        encryption = Archive.ZIP_ENCRYPTION if encryption is None else encryption.lower()
+        if encryption not in Archive.ENCRYPTION_MODES:
+            raise VaultBackupException(f"Encryption mode '{encryption}' is not supported. Expected one of: {Archive.ENCRYPTION_MODES}")
+        self.encryption = encryption
+
     def get_password(self, decrypt: bool = True) -> str:
         return self.__password if self.__password is None else password_decrypt(self.__password) if decrypt else self.__password
 
@@ -96,25 +306,144 @@ class Archive:
         """Expects encrypted password"""
         self.__password = password
 
-    def add_destination(self, label: str, path: str, remote: bool, versions: int, last_run: datetime):
-        dst = ArchiveDestination(label, path, remote, versions, last_run)
+    def set_compression(self, compression: Optional[str]) -> None:
+        """None for the default level, "auto" or a level from 0 (stored) to 9"""
+        if compression is None or compression.lower() == Archive.AUTO_COMPRESSION:
+            self.compression = None if compression is None else Archive.AUTO_COMPRESSION
+            return
+        if not re.match(r"^\d$", compression):
+            raise VaultBackupException(f"Compression '{compression}' is not supported. Expected: \"{Archive.AUTO_COMPRESSION}\" or a level from 0 to 9")
+        self.compression = int(compression)
+
+    def set_volumes(self, volume_size: Optional[int], parallel_uploads: Optional[int]) -> None:
+        if volume_size is not None and volume_size <= 0:
+            raise VaultBackupException("Volume size must be greater than 0.")
+        if parallel_uploads is not None and parallel_uploads <= 0:
+            raise VaultBackupException("Parallel uploads number must be at least 1.")
+        self.volume_size = volume_size
+        self.parallel_uploads = Archive.DEFAULT_PARALLEL_UPLOADS if parallel_uploads is None else parallel_uploads
+
+    def set_shards(self, shards: Optional[int], shard_workers: Optional[int], shard_host: Optional[str]) -> None:
+        """shard_host is "K/M": this host archives the shards of index K, K + M, ... of the M hosts sharing the version"""
+        if shards is not None and shards <= 0:
+            raise VaultBackupException("Shards number must be at least 1.")
+        if shard_workers is not None and shard_workers <= 0:
+            raise VaultBackupException("Shard workers number must be at least 1.")
+        if shards is not None and self.volume_size is not None:
+            raise VaultBackupException(f"Archive '{self.name}' cannot be split in both shards and volumes.")
+        host = (1, 1)
+        if shard_host is not None:
+            matches = re.findall(r"^(\d+)/(\d+)$", shard_host.strip())
+            if len(matches) == 0 or not 1 <= int(matches[0][0]) <= int(matches[0][1]):
+                raise VaultBackupException(f"Shard host '{shard_host}' is not supported. Expected: \"K/M\", the host K of M hosts")
+            host = (int(matches[0][0]), int(matches[0][1]))
+        self.shards = shards
+        self.shard_workers = min(shards, os.cpu_count() or 1) if shards is not None and shard_workers is None else shard_workers
+        self.shard_host = host
+
+    def get_shard_path(self, suffix: str) -> str:
+        """Path of a shard of the archive: the shard suffix goes before the extension"""
+        path = self.get_archive_path()
+        extension = ".zip.enc" if path.endswith(".zip.enc") else ".zip"
+        return path[:-len(extension)] + suffix + extension
+
+    def set_command(self, command: Optional[str], probe: Optional[str], member: Optional[str]) -> None:
+        """Source given by the output of a command, run in the archive path, instead of the tree at the path"""
+        if command is None:
+            if probe is not None or member is not None:
+                raise VaultBackupException(f"Archive '{self.name}' has a source probe or member, but no source command.")
+            return
+        if self.format != Archive.ZIP_FORMAT or self.shards is not None or self.verify_content:
+            raise VaultBackupException(f"Archive '{self.name}' has a source command, it cannot use the repository format, shards or content "
+                                       f"verification (use a probe instead).")
+        self.command = command
+        self.probe = probe
+        self.member = ".".join(self.name.split(".")[:-1]) if member is None else member
+
+    def set_remote(self, remote: bool, pull_channels: Optional[int]) -> None:
+        """Source on the SSH host, pulled over `pull_channels` SFTP channels"""
+        if pull_channels is not None and pull_channels <= 0:
+            raise VaultBackupException("Pull channels number must be at least 1.")
+        if remote and (self.format != Archive.ZIP_FORMAT or self.shards is not None or self.command is not None or self.verify_content):
+            raise VaultBackupException(f"Archive '{self.name}' has a remote source, it cannot use the repository format, shards, a source command "
+                                       f"or content verification.")
+        self.remote = remote
+        self.pull_channels = Archive.DEFAULT_PULL_CHANNELS if pull_channels is None else pull_channels
+
+    def set_read_order(self, read_order: Optional[str], read_ahead: Optional[int]) -> None:
+        """Files of the source are read ahead of the archive, in batches of `read_ahead` bytes read in `read_order`"""
+        if read_ahead is not None and read_ahead <= 0:
+            raise VaultBackupException("Read ahead size must be greater than 0.")
+        read_order = None if read_order is None else read_order.lower()
+        if read_order is not None and read_order not in Archive.READ_ORDERS:
+            raise VaultBackupException(f"Read order '{read_order}' is not supported. Expected one of: {Archive.READ_ORDERS}")
+        if read_order is not None and (self.format != Archive.ZIP_FORMAT or self.shards is not None or self.command is not None or self.remote):
+            raise VaultBackupException(f"Archive '{self.name}' has a read order, it cannot use the repository format, shards, a source command "
+                                       f"or a remote source.")
+        self.read_order = read_order
+        self.read_ahead = Archive.DEFAULT_READ_AHEAD if read_ahead is None else read_ahead
+
+    def set_scan_threads(self, scan_threads: Optional[int]) -> None:
+        if scan_threads is not None and scan_threads <= 0:
+            raise VaultBackupException("Scan threads number must be at least 1.")
+        self.scan_threads = Archive.DEFAULT_SCAN_THREADS if scan_threads is None else scan_threads
+
+    def get_cache_path(self) -> str:
+        path_hash = hashlib.sha1(self.path.encode()).hexdigest()[:12]
+        return os.path.join(Archive.dir_path, ".cache", f"{self.get_version_prefix()}{path_hash}.json")
+
+    def get_checkpoint_path(self) -> str:
+        path_hash = hashlib.sha1(self.path.encode()).hexdigest()[:12]
+        return os.path.join(Archive.dir_path, ".cache", f"{self.get_version_prefix()}{path_hash}.checkpoint")
+
+    def get_version_prefix(self) -> str:
+        return ".".join(self.name.split(".")[:-1]) + "_"
+
+    def get_repository_path(self, dst: ArchiveDestination) -> str:
+        return os.path.join(dst.path, ".".join(self.name.split(".")[:-1]) + ".repo")
+
+    def get_mirror_path(self, dst: ArchiveDestination) -> str:
+        return os.path.join(dst.path, ".".join(self.name.split(".")[:-1]) + ".mirror")
+
+    def get_snapshot_name(self, start_time: datetime) -> str:
+        return self.get_version_prefix() + start_time.strftime("%Y%m%d_%H%M%S")
+
+    def add_destination(self, label: str, path: str, remote: bool, versions: int, last_run: datetime, fingerprint: Optional[str] = None,
+                        dst_type: Optional[str] = None, compress: bool = False, encrypt: bool = False, s3: bool = False):
+        dst = ArchiveDestination(label, path, remote, versions, last_run, fingerprint, s3)
+        dst.set_type(dst_type, compress, encrypt)
+        if dst.type == ArchiveDestination.MIRROR_TYPE and (self.command is not None or self.remote):
+            raise VaultBackupException(f"Archive '{self.name}' has a source command or a remote source, it cannot have mirror destinations.")
         self.insert_destination(dst)
 
     def insert_destination(self, dst: ArchiveDestination):
-        if dst not in self.destinations:
-            self.destinations.append(dst)
+        if dst in self.__known_destinations:
+            self.__merge(self.__known_destinations[dst], dst)
         else:
-            self.__merge(dst)
+            self.__known_destinations[dst] = dst
+            self.destinations.append(dst)
 
-    def __merge(self, new_dst: ArchiveDestination):
-        index = self.destinations.index(new_dst)
-        if self.destinations[index].label != new_dst.label:
-            raise VaultBackupException(f"Label conflict between {self.destinations[index]} and {new_dst}")
-        self.destinations[index].versions = max(self.destinations[index].versions, new_dst.versions)
-        self.destinations[index].last_run = min(self.destinations[index].last_run, new_dst.last_run)
+    @staticmethod
+    def __merge(dst: ArchiveDestination, new_dst: ArchiveDestination):
+        if dst.label != new_dst.label:
+            raise VaultBackupException(f"Label conflict between {dst} and {new_dst}")
+        dst.versions = max(dst.versions, new_dst.versions)
+        if new_dst.last_run < dst.last_run:
+            dst.last_run = new_dst.last_run
+            dst.fingerprint = new_dst.fingerprint
 
     def display(self, indent: str = "") -> str:
         return indent + (f"Archive: {self.name}\n"
-                         f"Path: {self.path}\n" +
+                         f"Path: {self.path}{f' @ Remote ({self.pull_channels} channels)' if self.remote else ''}\n" +
+                         (f"Command: {self.command} > {self.member}\n" if self.command is not None else "") +
+                         (f"Probe: {self.probe}\n" if self.probe is not None else "") +
+                         (f"Format: {self.format}\n" if self.format != Archive.ZIP_FORMAT else "") +
+                         (f"Compression: {self.compression}\n" if self.compression is not None else "") +
+                         (f"Encryption: {self.encryption}\n" if self.encryption != Archive.ZIP_ENCRYPTION else "") +
+                         (f"Volume size: {self.volume_size}\n" if self.volume_size is not None else "") +
+                         ("Content verification: on\n" if self.verify_content else "") +
+                         (f"Scan threads: {self.scan_threads}\n" if self.scan_threads != Archive.DEFAULT_SCAN_THREADS else "") +
+                         (f"Read order: {self.read_order} (read ahead {self.read_ahead} bytes)\n" if self.read_order is not None else "") +
+                         (f"Shards: {self.shards} ({self.shard_workers} workers, host {self.shard_host[0]}/{self.shard_host[1]})\n" if self.shards is not None else "") +
                          "{}".format('Destination: ' if len(self.destinations) <= 1 else 'Destinations:\n\t') +
                          "\n\t".join(map(lambda x: x.display(), self.destinations))).replace("\n", f"\n{indent}")
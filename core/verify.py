@@ -0,0 +1,133 @@
+import io
+import random
+import re
+import time
+from datetime import datetime
+from typing import Optional, List, Dict
+
+import pyzipper
+
+from core.crypto import EncryptedStreamReader
+from core.storage import Storage
+from misc.utils import LOGGER
+
+
+class ConcatenatedReader(io.RawIOBase):
+    """Seekable reader over files read back to back (the volumes of an archive), that counts the bytes it reads.
+
+    Files are opened on the first read that reaches them, so only the ranges actually read are transferred.
+    """
+
+    def __init__(self, storage: Storage, names: List[str]):
+        super().__init__()
+        self.__storage = storage
+        self.__names = names
+        self.__offsets = []
+        self.size: int = 0
+        for name in names:
+            self.__offsets.append(self.size)
+            self.size += storage.size(name)
+        self.__files = {}
+        self.__position = 0
+        self.bytes_read: int = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.__position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.__position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if position < 0:
+            raise ValueError("Negative seek position.")
+        self.__position = position
+        return position
+
+    def readinto(self, buffer) -> int:
+        if self.__position >= self.size:
+            return 0
+        index = max(x for x in range(len(self.__offsets)) if self.__offsets[x] <= self.__position)
+        if index not in self.__files:
+            self.__files[index] = self.__storage.open(self.__names[index])
+        file = self.__files[index]
+        file.seek(self.__position - self.__offsets[index])
+        end = self.__offsets[index + 1] if index + 1 < len(self.__offsets) else self.size
+        data = file.read(min(len(buffer), end - self.__position))
+        buffer[:len(data)] = data
+        self.__position += len(data)
+        self.bytes_read += len(data)
+        return len(data)
+
+    def close(self) -> None:
+        for file in self.__files.values():
+            file.close()
+        self.__files = {}
+        super().close()
+
+
+class VersionVerifier:
+    """Checks that a version can be restored without downloading it.
+
+    Only the central directory and a random sample of `sample` members are read, through ranged reads. The sampled
+    members are decrypted and read to the end, so their CRC (and the HMAC of AES encrypted members) is checked.
+    Stream encrypted archives are decrypted frame by frame, only for the frames read (a frame is the smallest read).
+    """
+
+    READ_SIZE = 1024 * 1024
+
+    def __init__(self, storage: Storage, password: Optional[str], sample: int, rng: Optional[random.Random] = None):
+        self.storage: Storage = storage
+        self.password: Optional[str] = password
+        self.sample: int = sample
+        self.__rng = rng if rng is not None else random.Random()
+
+    @staticmethod
+    def versions(prefix: str, names: List[str]) -> Dict[str, List[str]]:
+        """Data files of every archive found in names (the archive, or its volumes in order), by version name. Every shard
+        of a sharded version is an archive of its own"""
+        pattern = re.compile(re.escape(prefix) + r"(\d{8}_\d{6}(?:\.s\d+of\d+)?)\.zip(\.enc)?(\.\d{3})?$")
+        versions = {}
+        for name in sorted(names):
+            matches = pattern.match(name)
+            if matches is not None:
+                versions.setdefault(prefix + matches.group(1), []).append(name)
+        return versions
+
+    def verify(self, names: List[str]) -> dict:
+        """Result of the verification of a version: whether it passed, and what it cost"""
+        start = time.perf_counter()
+        result = {"verified": datetime.now().isoformat(), "ok": False, "members": 0, "sampled": 0, "bytes_read": 0, "size": 0, "error": None}
+        reader = ConcatenatedReader(self.storage, names)
+        result["size"] = reader.size
+        try:
+            stream = EncryptedStreamReader(reader, self.password) if ".zip.enc" in names[0] else reader
+            with stream, pyzipper.AESZipFile(stream, 'r') as zip_file:
+                if self.password is not None:
+                    zip_file.setpassword(self.password.encode())
+                members = [x for x in zip_file.infolist() if not x.is_dir()]
+                result["members"] = len(members)
+                for member in self.__rng.sample(members, min(self.sample, len(members))):
+                    with zip_file.open(member) as data:
+                        while data.read(VersionVerifier.READ_SIZE):
+                            pass
+                    result["sampled"] += 1
+            result["ok"] = True
+        except Exception as e:
+            LOGGER.debug(f"Verification of {names} failed: {e}")
+            result["error"] = f"{type(e).__name__}: {e}"
+        finally:
+            reader.close()
+        result["bytes_read"] = reader.bytes_read
+        result["seconds"] = time.perf_counter() - start
+        return result
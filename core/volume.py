@@ -0,0 +1,133 @@
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, List, Optional, Dict
+
+from misc.utils import LOGGER
+
+
+class Volume:
+    """A sealed part of a multi-volume archive."""
+
+    def __init__(self, path: str, index: int, size: int, checksum: str):
+        self.path: str = path
+        self.index: int = index
+        self.size: int = size
+        self.checksum: str = checksum
+
+    def __str__(self) -> str:
+        return os.path.basename(self.path)
+
+
+class VolumeWriter(io.RawIOBase):
+    """Write-only stream that splits everything written to it into fixed-size volumes: <base>.001, <base>.002, ...
+
+    Concatenating the volumes gives back the original stream. Every volume is hashed while it is written and
+    handed to `on_seal` as soon as it is complete, so it can be shipped while the next one is being written.
+    """
+
+    MANIFEST_SUFFIX = ".sha256"
+
+    def __init__(self, base_path: str, volume_size: int, on_seal: Optional[Callable[[Volume], None]] = None):
+        super().__init__()
+        self.base_path: str = base_path
+        self.volume_size: int = volume_size
+        self.volumes: List[Volume] = []
+        self.__on_seal = on_seal
+        self.__file = None
+        self.__hash = None
+        self.__written = 0
+        self.__position = 0
+
+    @staticmethod
+    def volume_path(base_path: str, index: int) -> str:
+        return f"{base_path}.{index:03d}"
+
+    @staticmethod
+    def manifest_path(base_path: str) -> str:
+        return base_path + VolumeWriter.MANIFEST_SUFFIX
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def tell(self) -> int:
+        return self.__position
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        view = memoryview(data).cast("B")
+        offset = 0
+        while offset < len(view):
+            if self.__file is None:
+                self.__open_volume()
+            length = min(len(view) - offset, self.volume_size - self.__written)
+            self.__file.write(view[offset:offset + length])
+            self.__hash.update(view[offset:offset + length])
+            self.__written += length
+            offset += length
+            if self.__written == self.volume_size:
+                self.__seal_volume()
+        self.__position += len(view)
+        return len(view)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            if self.__file is not None or len(self.volumes) == 0:
+                if self.__file is None:
+                    self.__open_volume()
+                self.__seal_volume()
+            with open(VolumeWriter.manifest_path(self.base_path), 'w') as manifest:
+                manifest.writelines(f"{x.checksum}  {x}\n" for x in self.volumes)
+        finally:
+            super().close()
+
+    def __open_volume(self) -> None:
+        self.__file = open(VolumeWriter.volume_path(self.base_path, len(self.volumes) + 1), 'wb')
+        self.__hash = hashlib.sha256()
+        self.__written = 0
+
+    def __seal_volume(self) -> None:
+        self.__file.close()
+        volume = Volume(self.__file.name, len(self.volumes) + 1, self.__written, self.__hash.hexdigest())
+        self.__file = None
+        self.volumes.append(volume)
+        LOGGER.debug(f"Volume sealed: {volume} ({volume.size} bytes)")
+        if self.__on_seal is not None:
+            self.__on_seal(volume)
+
+
+class TransferQueue:
+    """Runs transfers in background threads as soon as files become available."""
+
+    def __init__(self, workers: int, transfer: Callable[[str], None]):
+        self.__pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="transfer")
+        self.__transfer = transfer
+        self.__futures: Dict[str, Future] = {}
+        self.__lock = threading.Lock()
+
+    def submit(self, path: str) -> None:
+        with self.__lock:
+            if path not in self.__futures:
+                self.__futures[path] = self.__pool.submit(self.__transfer, path)
+
+    def is_submitted(self, path: str) -> bool:
+        with self.__lock:
+            return path in self.__futures
+
+    def wait(self) -> None:
+        """Waits for every submitted transfer and raises the first error, if any."""
+        with self.__lock:
+            futures = list(self.__futures.values())
+        for future in futures:
+            future.result()
+
+    def close(self) -> None:
+        self.__pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,107 @@
+import shutil
+import struct
+import tempfile
+from typing import Optional, List, BinaryIO
+
+import pyzipper
+from pyzipper import zipfile
+
+
+class SpilledCentralDirectory:
+    """Central directory of a zip being written, kept in a temporary file instead of memory.
+
+    Stands for the `filelist` of the writer: a member appended by the writer is complete, so its central directory
+    record (a few dozen bytes plus its name) is final and goes to the spill file, and only the last `keep` members
+    stay in memory as ZipInfo. Memory does not grow with the number of members.
+    """
+
+    KEEP = 16
+    BUFFER_SIZE = 1024 * 1024
+
+    def __init__(self, spill_dir: Optional[str] = None, keep: int = KEEP):
+        self.keep: int = keep
+        self.__spill = tempfile.TemporaryFile(dir=spill_dir, buffering=SpilledCentralDirectory.BUFFER_SIZE)
+        self.__tail: List[zipfile.ZipInfo] = []
+        self.__spilled = 0
+
+    def __len__(self) -> int:
+        return self.__spilled + len(self.__tail)
+
+    def __getitem__(self, index: int) -> zipfile.ZipInfo:
+        """Only the members still in memory, the last ones, can be read back"""
+        position = index if index >= 0 else len(self) + index
+        if not self.__spilled <= position < len(self):
+            raise IndexError(f"Member {index} of the central directory was spilled to disk")
+        return self.__tail[position - self.__spilled]
+
+    def __iter__(self):
+        raise TypeError("The central directory was spilled to disk and cannot be iterated")
+
+    def append(self, zinfo: zipfile.ZipInfo) -> None:
+        self.__tail.append(zinfo)
+        if len(self.__tail) > self.keep:
+            self.__write(self.__spill, self.__tail.pop(0))
+            self.__spilled += 1
+
+    def write_to(self, output: BinaryIO) -> None:
+        """Writes the records of every member, in order, to the archive"""
+        self.__spill.flush()
+        self.__spill.seek(0)
+        shutil.copyfileobj(self.__spill, output, SpilledCentralDirectory.BUFFER_SIZE)
+        for zinfo in self.__tail:
+            self.__write(output, zinfo)
+
+    def close(self) -> None:
+        self.__spill.close()
+
+    @staticmethod
+    def __write(output: BinaryIO, zinfo: zipfile.ZipInfo) -> None:
+        # ZIP64 extras for sizes and offsets over 4 GiB are added to the record by the ZipInfo
+        centdir, filename, extra_data = zinfo.central_directory()
+        output.write(centdir + filename + extra_data + zinfo.comment)
+
+
+class _NoNames(dict):
+    """Stands for the `NameToInfo` of the writer: names are not kept, so duplicates are not detected"""
+
+    def __setitem__(self, key, value) -> None:
+        pass
+
+
+class StreamingZipFile(pyzipper.AESZipFile):
+    """Zip writer whose memory does not depend on the number of members, for trees of tens of millions of entries.
+
+    The central directory is spilled to a temporary file in `spill_dir` (next to the archive, not a memory backed
+    /tmp) as members are written and copied to the archive on close, followed by the ZIP64 end records when the
+    member count, the size or the offset of the central directory need them. Only mode 'w' is supported.
+    """
+
+    def __init__(self, file, mode: str = 'w', *args, spill_dir: Optional[str] = None, **kwargs):
+        if mode != 'w':
+            raise ValueError("StreamingZipFile only writes new archives (mode 'w')")
+        super().__init__(file, mode, *args, **kwargs)
+        self.filelist = SpilledCentralDirectory(spill_dir)
+        self.NameToInfo = _NoNames()
+
+    def close(self) -> None:
+        try:
+            super().close()
+        finally:
+            if isinstance(self.filelist, SpilledCentralDirectory):
+                self.filelist.close()
+
+    def _write_end_record(self) -> None:
+        self.filelist.write_to(self.fp)
+        end = self.fp.tell()
+        count = len(self.filelist)
+        size = end - self.start_dir
+        offset = self.start_dir
+        if count > zipfile.ZIP_FILECOUNT_LIMIT or size > zipfile.ZIP64_LIMIT or offset > zipfile.ZIP64_LIMIT:
+            if not self._allowZip64:
+                raise zipfile.LargeZipFile("Central directory would require ZIP64 extensions")
+            self.fp.write(struct.pack(zipfile.structEndArchive64, zipfile.stringEndArchive64, 44, 45, 45, 0, 0, count, count, size, offset))
+            self.fp.write(struct.pack(zipfile.structEndArchive64Locator, zipfile.stringEndArchive64Locator, 0, end, 1))
+            count, size, offset = min(count, 0xFFFF), min(size, 0xFFFFFFFF), min(offset, 0xFFFFFFFF)
+        self.fp.write(struct.pack(zipfile.structEndArchive, zipfile.stringEndArchive, 0, 0, count, count, size, offset, len(self._comment)))
+        self.fp.write(self._comment)
+        self.fp.flush()
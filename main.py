@@ -2,20 +2,26 @@ import json
 
 from core.backup import BackupExecutor
 from core.resolvers import JsonResolver
-from misc.utils import LOGGER
+from core.state import StateStore
+from misc.utils import LOGGER, VaultBackupException, write_atomic
 
 if __name__ == '__main__':
     status_success = False
 
     try:
         json_file_path = "config.json"
+        state_file_path = "state.json"
         cfg = JsonResolver(json_file_path)
 
-        backup_executor = BackupExecutor(cfg.force, cfg.require_ssh, cfg.ssh)
-        backup_executor.execute(cfg.backups)
-        cfg.update_last_run_date()
+        backup_executor = BackupExecutor(cfg.force, cfg.require_ssh, cfg.ssh, cfg.transfer, cfg.governor, cfg.progress, StateStore(state_file_path), cfg.version, cfg.staging, cfg.s3)
+        if cfg.verify is not None:
+            if not backup_executor.verify(cfg.backups, cfg.verify):
+                raise VaultBackupException("Some versions failed verification.")
+        else:
+            backup_executor.execute(cfg.backups)
+            cfg.update_last_run_date()
 
-        open(json_file_path, 'w').writelines(json.dumps(cfg.to_json(), indent='\t'))
+            write_atomic(json_file_path, json.dumps(cfg.to_json(), indent='\t'))
         status_success = True
     finally:
         LOGGER.end_execution()
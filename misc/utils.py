@@ -1,4 +1,5 @@
 import base64
+import hashlib
 import os.path
 import re
 from datetime import datetime
@@ -12,6 +13,10 @@ class VaultBackupException(Exception):
     pass
 
 
+class BackupCancelled(VaultBackupException):
+    pass
+
+
 def password_decrypt(encrypted_password: str) -> Optional[str]:
     return base64.b64decode(encrypted_password).decode()
 
@@ -58,7 +63,37 @@ def handle_timestamp(value) -> datetime:
     return datetime(1900, 1, 1) if value is None else datetime.fromisoformat(value)
 
 
+def handle_size(value) -> Optional[int]:
+    """Convert a size to bytes. Accepts a number of bytes or a number followed by K, M, G or T"""
+    value = convert(str, value)
+    if value is None:
+        return None
+    matches = re.findall(r"^(\d+(?:\.\d+)?)\s*([KMGT]?)(?:I?B)?$", value.strip().upper())
+    if len(matches) == 0:
+        raise VaultBackupException(f"Cannot convert '{value}' to a size. Expected: <number>[K|M|G|T]")
+    number, unit = matches[0]
+    return int(float(number) * 1024 ** ("KMGT".index(unit) + 1 if unit else 0))
+
+
+def file_checksum(path: str, buffer_size: int = 1024 * 1024) -> str:
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for data in iter(lambda: file.read(buffer_size), b""):
+            checksum.update(data)
+    return checksum.hexdigest()
+
+
 def not_none(key: str, value: any) -> any:
     if value is None:
         raise VaultBackupException(f"Key '{key}' cannot be None.")
     return value
+
+
+def write_atomic(path: str, content: str) -> None:
+    """Replaces a file with the content, so readers and crashes see either the old or the new file"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as file:
+        file.write(content)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
@@ -1,5 +1,279 @@
+import asyncio
+import os
+import tempfile
+import time
 import unittest
+from datetime import datetime
+
+from core.backup import BackupExecutor
+from core.destination import LocalBackend, DestinationBackend
+from core.state import StateStore
+from core.transfer import LocalTransfer
+from core.type import ArchiveDestination, Archive, BackupEvent, GovernorInfo
+from misc.utils import VaultBackupException
+from tests.utils import log_response, LOG
+
+
+class RecordingBackend(DestinationBackend):
+    """Destination that only records the checksum every transfer is verified against"""
+
+    def __init__(self, destination: ArchiveDestination, uploads: list):
+        super().__init__(destination)
+        self.uploads = uploads
+
+    def group(self) -> tuple:
+        return "recording", None
+
+    def upload(self, path: str, checksum) -> None:
+        self.uploads.append((self.destination.label, checksum))
+
+    def list(self) -> list:
+        return []
+
+
+class RecordingExecutor(BackupExecutor):
+
+    def __init__(self, uploads: list):
+        super().__init__(True, False, None)
+        self.uploads = uploads
+
+    def _get_backend(self, dst: ArchiveDestination) -> DestinationBackend:
+        return RecordingBackend(dst, self.uploads)
 
 
 class TestBackup(unittest.TestCase):
-    pass
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.executor = BackupExecutor(True, False, None)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _destination(self, label: str, remote: bool = False) -> ArchiveDestination:
+        path = os.path.join(self.tmp_dir.name, label)
+        os.makedirs(path, exist_ok=True)
+        return ArchiveDestination(label, path, remote, 1, datetime(2020, 10, 20))
+
+    @log_response
+    def test_group_destinations(self) -> None:
+        local_1, remote_1, local_2, remote_2 = self._destination("l1"), self._destination("r1", True), self._destination("l2"), self._destination("r2", True)
+        groups = self.executor._group_destinations([local_1, remote_1, local_2, remote_2])
+        LOG.debug(f"Groups: {[[str(y) for y in x] for x in groups]}")
+        self.assertEqual([[local_1, local_2], [remote_1, remote_2]], groups)
+
+    @log_response
+    def test_group_missing_destination(self) -> None:
+        local_1 = self._destination("l1")
+        missing = ArchiveDestination("missing", os.path.join(self.tmp_dir.name, "missing"), False, 1, datetime(2020, 10, 20))
+        self.assertEqual([[local_1], [missing]], self.executor._group_destinations([local_1, missing]))
+
+    @log_response
+    def test_duplicate_replaces_target(self) -> None:
+        source, target = self._destination("l1"), self._destination("l2")
+        source_backend, target_backend = LocalBackend(source, LocalTransfer()), LocalBackend(target, LocalTransfer())
+        for path, content in [(source.path, b"new"), (target.path, b"old")]:
+            with open(os.path.join(path, "archive.zip"), 'wb') as file:
+                file.write(content)
+        self.assertTrue(target_backend.duplicate(source_backend, "archive.zip", None))
+        with open(os.path.join(target.path, "archive.zip"), 'rb') as file:
+            self.assertEqual(b"new", file.read())
+        self.assertEqual(["archive.zip"], os.listdir(target.path))
+
+    @log_response
+    def test_duplicate_keeps_target_on_failure(self) -> None:
+        source, target = self._destination("l1"), self._destination("l2")
+        with open(os.path.join(target.path, "archive.zip"), 'wb') as file:
+            file.write(b"old")
+        with self.assertRaises(OSError):
+            LocalBackend(target, LocalTransfer()).duplicate(LocalBackend(source, LocalTransfer()), "archive.zip", None)
+        with open(os.path.join(target.path, "archive.zip"), 'rb') as file:
+            self.assertEqual(b"old", file.read())
+
+    @log_response
+    def test_skip_unchanged_content(self) -> None:
+        archive = Archive("test_archive.zip", self.tmp_dir.name)
+        archive.insert_destination(self._destination("same"))
+        archive.insert_destination(self._destination("changed"))
+        archive.insert_destination(self._destination("not_eligible"))
+        archive.destinations[0].fingerprint = "abc"
+        archive.destinations[1].fingerprint = "def"
+        archive.destinations[2].fingerprint = "abc"
+        is_eligible = [True, True, False]
+        start_time = datetime(2021, 1, 1)
+        self.executor._skip_unchanged_content(archive, is_eligible, "abc", start_time)
+        self.assertEqual([False, True, False], is_eligible)
+        self.assertEqual(start_time, archive.destinations[0].last_run)
+        self.assertEqual(datetime(2020, 10, 20), archive.destinations[1].last_run)
+        self.assertEqual(datetime(2020, 10, 20), archive.destinations[2].last_run)
+
+    @log_response
+    def test_state_commit(self) -> None:
+        source = os.path.join(self.tmp_dir.name, "source")
+        os.makedirs(source)
+        with open(os.path.join(source, "file.txt"), 'w') as file:
+            file.write("content")
+        self.addCleanup(setattr, Archive, "dir_path", Archive.dir_path)
+        Archive.dir_path = self.tmp_dir.name
+        archive = Archive("test_archive.zip", source)
+        archive.insert_destination(self._destination("local"))
+        state = StateStore(os.path.join(self.tmp_dir.name, "state.json"))
+        BackupExecutor(True, False, None, state=state).execute([archive])
+        committed = state.get(archive, archive.destinations[0])
+        LOG.debug(f"Committed state: {committed}")
+        self.assertEqual(archive.destinations[0].last_run.isoformat(), committed["last_run"])
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir.name, "local", committed["archive"])))
+        self.assertEqual(64, len(committed["checksum"]))
+        self.assertGreater(committed["throughput"], 0)
+
+    @log_response
+    def test_state_commit_failed_destination(self) -> None:
+        archive = self._archive("data")
+        # A file where the directory should be, so every transfer to it fails
+        broken_path = os.path.join(self.tmp_dir.name, "broken")
+        with open(broken_path, 'w') as file:
+            file.write("not a directory")
+        archive.destinations.insert(0, ArchiveDestination("broken", broken_path, False, 1, datetime(2020, 10, 20)))
+        state = StateStore(os.path.join(self.tmp_dir.name, "state.json"))
+        with self.assertRaises(VaultBackupException) as context:
+            BackupExecutor(True, False, None, state=state).execute([archive])
+        LOG.debug(f"Error: {context.exception}")
+        self.assertIn("[broken]", str(context.exception))
+        committed = state.get(archive, archive.destinations[1])
+        LOG.debug(f"Committed state: {committed}")
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir.name, "dst_data", committed["archive"])))
+        self.assertEqual(64, len(committed["checksum"]))
+        self.assertNotIn("archive", state.get(archive, archive.destinations[0]))
+        self.assertEqual(datetime(2020, 10, 20), archive.destinations[0].last_run)
+
+    def _versions(self, names: list, versions: int) -> (Archive, str):
+        """Archive whose only destination holds the given files and keeps `versions` versions"""
+        destination = self._destination("versions")
+        destination.versions = versions
+        for name in names:
+            with open(os.path.join(destination.path, name), 'w') as file:
+                file.write(name)
+        archive = Archive("bk.zip", self.tmp_dir.name)
+        archive.insert_destination(destination)
+        return archive, destination.path
+
+    @log_response
+    def test_clean_partial_transfer(self) -> None:
+        archive, path = self._versions(["bk_20261017_100000.zip", "bk_20261018_100000.zip", "bk_20261019_100000.zip.part"], 2)
+        self.executor._clean_archives(archive)
+        # An interrupted transfer is not a version, it does not push complete ones out
+        self.assertEqual(["bk_20261017_100000.zip", "bk_20261018_100000.zip", "bk_20261019_100000.zip.part"], sorted(os.listdir(path)))
+
+    @log_response
+    def test_clean_incomplete_volumes(self) -> None:
+        names = ["bk_20261017_100000.zip", "bk_20261018_100000.zip", "bk_20261019_100000.zip.part", "bk_20261019_110000.zip.001"]
+        archive, path = self._versions(names, 2)
+        self.executor._clean_archives(archive)
+        # Volumes without their manifest are not a complete version
+        self.assertEqual(names, sorted(os.listdir(path)))
+        for name in ["bk_20261020_100000.zip.001", "bk_20261020_100000.zip.sha256"]:
+            with open(os.path.join(path, name), 'w') as file:
+                file.write(name)
+        self.executor._clean_archives(archive)
+        self.assertEqual(["bk_20261018_100000.zip", "bk_20261019_100000.zip.part", "bk_20261019_110000.zip.001", "bk_20261020_100000.zip.001",
+                          "bk_20261020_100000.zip.sha256"], sorted(os.listdir(path)))
+
+    @log_response
+    def test_transfers_verified(self) -> None:
+        archive = self._archive("verified")
+        archive.insert_destination(self._destination("other"))
+        uploads = []
+        RecordingExecutor(uploads).execute([archive])
+        LOG.debug(f"Uploads: {uploads}")
+        # The first destination of a group is verified like the ones filled from it
+        self.assertEqual(["dst_verified", "other"], [x[0] for x in uploads])
+        self.assertTrue(all(x[1] is not None and len(x[1]) == 64 for x in uploads))
+
+    def _archive(self, name: str, size: int = 10) -> Archive:
+        source = os.path.join(self.tmp_dir.name, f"source_{name}")
+        os.makedirs(source)
+        for index in range(3):
+            with open(os.path.join(source, f"file{index}.bin"), 'wb') as file:
+                file.write(os.urandom(size))
+        self.addCleanup(setattr, Archive, "dir_path", Archive.dir_path)
+        Archive.dir_path = self.tmp_dir.name
+        archive = Archive(f"{name}.zip", source)
+        archive.insert_destination(self._destination(f"dst_{name}"))
+        return archive
+
+    @log_response
+    def test_run_events(self) -> None:
+        archives = [self._archive("first"), self._archive("second")]
+
+        async def run() -> list:
+            executor = await BackupExecutor.create(True, False, None)
+            task = asyncio.create_task(executor.run(archives))
+            events = [x async for x in executor.events()]
+            await task
+            return events
+
+        events = asyncio.run(run())
+        LOG.debug(f"Events: {[str(x) for x in events]}")
+        kinds = [(x.kind, x.archive) for x in events if x.kind != BackupEvent.PROGRESS]
+        self.assertEqual([(BackupEvent.STARTED, "first.zip"), (BackupEvent.FINISHED, "first.zip"),
+                          (BackupEvent.STARTED, "second.zip"), (BackupEvent.FINISHED, "second.zip")], kinds)
+        self.assertEqual(1, len(os.listdir(os.path.join(self.tmp_dir.name, "dst_first"))))
+
+    @log_response
+    def test_run_twice(self) -> None:
+        archive = self._archive("twice")
+        archive.destinations[0].versions = 2
+        state = StateStore(os.path.join(self.tmp_dir.name, "state.json"))
+
+        async def run() -> list:
+            executor = await BackupExecutor.create(True, False, None, state=state)
+            names = []
+            for _ in range(2):
+                await executor.run([archive])
+                names.append(state.get(archive, archive.destinations[0])["archive"])
+                # Versions are named to the second
+                time.sleep(1)
+            return names
+
+        names = asyncio.run(run())
+        LOG.debug(f"Versions: {names}")
+        self.assertNotEqual(names[0], names[1])
+        self.assertEqual(sorted(names), sorted(os.listdir(os.path.join(self.tmp_dir.name, "dst_twice"))))
+        self.assertEqual(archive.destinations[0].last_run.strftime("%Y%m%d_%H%M%S"), names[1][len("twice_"):-len(".zip")])
+
+    @log_response
+    def test_run_cancel(self) -> None:
+        archive = self._archive("slow", 4 * 1024 * 1024)
+
+        async def run() -> list:
+            executor = BackupExecutor(True, False, None, governor=GovernorInfo(read_rate=2 * 1024 * 1024))
+            task = asyncio.create_task(executor.run([archive]))
+            events = []
+            async for event in executor.events():
+                events.append(event.kind)
+                if event.kind == BackupEvent.STARTED:
+                    await asyncio.sleep(0.5)
+                    task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return events
+
+        events = asyncio.run(run())
+        self.assertEqual([BackupEvent.STARTED, BackupEvent.CANCELLED], [x for x in events if x != BackupEvent.PROGRESS])
+        self.assertEqual([], os.listdir(os.path.join(self.tmp_dir.name, "dst_slow")))
+        self.assertEqual([], [x for x in os.listdir(self.tmp_dir.name) if x.endswith(".zip")])
+        self.assertEqual(datetime(2020, 10, 20), archive.destinations[0].last_run)
+
+    @log_response
+    def test_concurrent_runs(self) -> None:
+        archives = [self._archive("first"), self._archive("second")]
+
+        async def run() -> None:
+            executors = [BackupExecutor(True, False, None) for _ in archives]
+            await asyncio.gather(*[x.run([y]) for x, y in zip(executors, archives)])
+
+        asyncio.run(run())
+        for name in ["first", "second"]:
+            files = os.listdir(os.path.join(self.tmp_dir.name, f"dst_{name}"))
+            self.assertEqual(1, len(files))
+            self.assertTrue(files[0].startswith(name) and files[0].endswith(".zip"))
@@ -0,0 +1,146 @@
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime
+
+import pyzipper
+
+from core.backup import BackupExecutor
+from core.checkpoint import ArchiveCheckpoint
+from core.type import Archive, ArchiveDestination
+from misc.utils import password_encrypt
+from tests.utils import log_response, LOG
+
+
+class InterruptingTuner:
+    """Fails when the member at `index` is about to be written, as if the process died there"""
+
+    def __init__(self, index: int):
+        self.index = index
+
+    def choose(self, size: int) -> int:
+        self.index -= 1
+        if self.index < 0:
+            raise RuntimeError("Interrupted")
+        return 6
+
+    def observe(self, data: bytes) -> None:
+        pass
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp_dir.name, "source")
+        os.makedirs(os.path.join(self.source, "sub"))
+        self.content = {}
+        for index in range(6):
+            rel_path = f"file{index}.bin" if index % 2 == 0 else f"sub/file{index}.bin"
+            self.content[rel_path] = os.urandom(64 * 1024)
+            with open(os.path.join(self.source, rel_path), 'wb') as file:
+                file.write(self.content[rel_path])
+        self.addCleanup(setattr, Archive, "dir_path", Archive.dir_path)
+        self.addCleanup(setattr, ArchiveCheckpoint, "INTERVAL", ArchiveCheckpoint.INTERVAL)
+        Archive.dir_path = self.tmp_dir.name
+        ArchiveCheckpoint.INTERVAL = 0
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _archive(self) -> Archive:
+        archive = Archive("test_archive.zip", self.source)
+        archive.set_password(password_encrypt("secret"))
+        destination = os.path.join(self.tmp_dir.name, "destination")
+        os.makedirs(destination, exist_ok=True)
+        archive.insert_destination(ArchiveDestination("local", destination, False, 1, datetime(2020, 10, 20)))
+        return archive
+
+    def _interrupt(self, members: int) -> (Archive, ArchiveCheckpoint, bytes):
+        """Archives `members` files, then fails. Returns the partial archive content up to the last checkpoint"""
+        archive = self._archive()
+        executor = BackupExecutor(True, False, None)
+        checkpoint = executor._get_checkpoint(archive, datetime(2021, 1, 1, 10, 0, 0))
+        with self.assertRaises(RuntimeError):
+            executor._do_archive(archive, checkpoint.start_time, None, InterruptingTuner(members), checkpoint)
+        self.assertTrue(os.path.isfile(archive.get_checkpoint_path()))
+        # Committed members are only kept in the journal
+        self.assertEqual([], checkpoint.members)
+        checkpoint = ArchiveCheckpoint.load(archive.get_checkpoint_path())
+        with open(archive.get_archive_path(), 'rb') as file:
+            partial = file.read(checkpoint.offset)
+        return archive, checkpoint, partial
+
+    def _resume(self) -> str:
+        archive = self._archive()
+        BackupExecutor(True, False, None).execute([archive])
+        self.assertFalse(os.path.isfile(archive.get_checkpoint_path()))
+        self.assertEqual([], [x for x in os.listdir(self.tmp_dir.name) if x.endswith(".zip")])
+        return os.path.join(self.tmp_dir.name, "destination", os.path.basename(archive.get_archive_path()))
+
+    def _assert_content(self, path: str) -> None:
+        with pyzipper.AESZipFile(path, 'r') as zip_file:
+            zip_file.setpassword(b"secret")
+            self.assertIsNone(zip_file.testzip())
+            self.assertIn("sub/", zip_file.namelist())
+            for rel_path, content in self.content.items():
+                self.assertEqual(content, zip_file.read(rel_path))
+
+    @log_response
+    def test_resume(self) -> None:
+        _, checkpoint, partial = self._interrupt(3)
+        LOG.debug(f"Checkpoint: {len(checkpoint.members)} members, {checkpoint.offset} bytes")
+        self.assertEqual(4, len(checkpoint.members))
+        # A line cut by the interruption is not part of the checkpoint
+        with open(checkpoint.path, 'a') as journal:
+            journal.write('{"member": {"filename": "fi')
+        self.assertEqual(checkpoint.offset, ArchiveCheckpoint.load(checkpoint.path).offset)
+
+        path = self._resume()
+        self.assertTrue(os.path.basename(path).startswith("test_archive_20210101_100000"))
+        with open(path, 'rb') as file:
+            self.assertEqual(partial, file.read(len(partial)))
+        self._assert_content(path)
+
+    @log_response
+    def test_resume_changed_member(self) -> None:
+        _, checkpoint, partial = self._interrupt(3)
+        changed = [x for x, y in checkpoint.members if y is not None][1]["filename"]
+        kept = [x["filename"] for x, _ in checkpoint.members]
+        kept = kept[:kept.index(changed)]
+        LOG.debug(f"Changed: {changed}, kept: {kept}")
+        time.sleep(0.01)
+        self.content[changed] = os.urandom(1024)
+        with open(os.path.join(self.source, changed), 'wb') as file:
+            file.write(self.content[changed])
+
+        path = self._resume()
+        with pyzipper.AESZipFile(path, 'r') as zip_file:
+            offset = zip_file.getinfo(changed).header_offset
+            self.assertEqual(kept, zip_file.namelist()[:len(kept)])
+        with open(path, 'rb') as file:
+            self.assertEqual(partial[:offset], file.read(offset))
+        self._assert_content(path)
+
+    @log_response
+    def test_settings_changed(self) -> None:
+        archive, _, _ = self._interrupt(2)
+        archive = self._archive()
+        archive.set_password(password_encrypt("other"))
+        checkpoint = BackupExecutor(True, False, None)._get_checkpoint(archive, datetime(2021, 1, 2))
+        self.assertEqual(0, checkpoint.offset)
+        self.assertEqual(datetime(2021, 1, 2), checkpoint.start_time)
+        self.assertEqual([], [x for x in os.listdir(self.tmp_dir.name) if x.startswith("test_archive_20210101")])
+
+    @log_response
+    def test_staging_changed(self) -> None:
+        self._interrupt(2)
+        archive = self._archive()
+        archive.staging_dir = os.path.join(self.tmp_dir.name, "staging")
+        checkpoint = BackupExecutor(True, False, None)._get_checkpoint(archive, datetime(2021, 1, 2))
+        # The rejected checkpoint does not leave its version name behind
+        self.assertEqual(0, checkpoint.offset)
+        expected = os.path.join(archive.staging_dir, "test_archive_20210102_000000.zip")
+        self.assertEqual(expected, checkpoint.archive_path)
+        self.assertEqual(expected, archive.get_archive_path())
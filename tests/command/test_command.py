@@ -0,0 +1,117 @@
+import os
+import shlex
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+
+import pyzipper
+
+from core.backup import BackupExecutor
+from core.command import CommandReader
+from core.state import StateStore
+from core.type import Archive
+from misc.utils import VaultBackupException, password_encrypt
+from tests.utils import log_response, LOG
+
+PYTHON = shlex.quote(sys.executable)
+# 6 MiB of output, written in small pieces
+DUMP = PYTHON + " -c \"import sys, random; r = random.Random(7); [sys.stdout.buffer.write(r.randbytes(4096)) for _ in range(1536)]\""
+
+
+class TestCommand(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.work_dir = os.path.join(self.tmp_dir.name, "work")
+        self.destination = os.path.join(self.tmp_dir.name, "destination")
+        os.makedirs(self.work_dir)
+        os.makedirs(self.destination)
+        with open(os.path.join(self.work_dir, "lsn"), 'w') as file:
+            file.write("0/16B3748")
+        self.addCleanup(setattr, Archive, "dir_path", Archive.dir_path)
+        Archive.dir_path = self.tmp_dir.name
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _archive(self, command: str = DUMP, probe: str = None, last_run: datetime = datetime(2020, 10, 20), fingerprint: str = None) -> Archive:
+        archive = Archive("db.zip", self.work_dir)
+        archive.set_password(password_encrypt("secret"))
+        archive.set_command(command, probe, "db.dump")
+        archive.add_destination("local", self.destination, False, 1, last_run, fingerprint)
+        return archive
+
+    def _expected(self) -> bytes:
+        with CommandReader(DUMP) as reader:
+            return b"".join(reader)
+
+    @log_response
+    def test_reader(self) -> None:
+        with CommandReader(DUMP, chunk_size=1024 * 1024) as reader:
+            sizes = [len(x) for x in reader]
+        LOG.debug(f"Chunks: {sizes}")
+        self.assertEqual(6 * 1024 * 1024, reader.bytes_read)
+        self.assertLessEqual(max(sizes), 1024 * 1024)
+
+        with self.assertRaises(VaultBackupException) as context:
+            with CommandReader(PYTHON + " -c \"import sys; print('partial'); sys.stderr.write('connection refused'); sys.exit(3)\"") as reader:
+                self.assertEqual([b"partial\n"], list(reader))
+        LOG.debug(f"Error: {context.exception}")
+        self.assertIn("exit status 3", str(context.exception))
+        self.assertIn("connection refused", str(context.exception))
+
+    @log_response
+    def test_command_backup(self) -> None:
+        state = StateStore(os.path.join(self.tmp_dir.name, "state.json"))
+        archive = self._archive()
+        BackupExecutor(True, False, None, state=state).execute([archive])
+        names = os.listdir(self.destination)
+        LOG.debug(f"Destination: {names}")
+        self.assertEqual(1, len(names))
+        with pyzipper.AESZipFile(os.path.join(self.destination, names[0]), 'r') as zip_file:
+            zip_file.setpassword(b"secret")
+            self.assertEqual(["db.dump"], zip_file.namelist())
+            self.assertEqual(self._expected(), zip_file.read("db.dump"))
+        self.assertEqual(names[0], state.get(archive, archive.destinations[0])["archive"])
+
+    @log_response
+    def test_failed_command(self) -> None:
+        archive = self._archive(DUMP + " && exit 5")
+        with self.assertRaises(VaultBackupException):
+            BackupExecutor(True, False, None).execute([archive])
+        self.assertEqual([], os.listdir(self.destination))
+        self.assertEqual([], [x for x in os.listdir(self.tmp_dir.name) if x.startswith("db_")])
+        self.assertEqual(datetime(2020, 10, 20), archive.destinations[0].last_run)
+
+    @log_response
+    def test_probe(self) -> None:
+        destinations = []
+        for day, lsn in [(1, "0/16B3748"), (2, "0/16B3748"), (3, "0/16B3790")]:
+            with open(os.path.join(self.work_dir, "lsn"), 'w') as file:
+                file.write(lsn)
+            last_run, fingerprint = (destinations[-1].last_run, destinations[-1].fingerprint) if len(destinations) > 0 else (datetime(2020, 10, 20), None)
+            archive = self._archive(probe="cat lsn", last_run=last_run, fingerprint=fingerprint)
+            BackupExecutor(False, False, None, version_time=datetime(2021, 1, day)).execute([archive])
+            destinations.append(archive.destinations[0])
+            LOG.debug(f"Day {day}: {sorted(os.listdir(self.destination))}, fingerprint {destinations[-1].fingerprint}")
+            if day == 2:
+                # Same probe output, only the last run moved
+                self.assertEqual(["db_20210101_000000.zip"], os.listdir(self.destination))
+        self.assertEqual(["db_20210103_000000.zip"], os.listdir(self.destination))
+        self.assertEqual(datetime(2021, 1, 2), destinations[1].last_run)
+        self.assertEqual(destinations[0].fingerprint, destinations[1].fingerprint)
+        self.assertNotEqual(destinations[1].fingerprint, destinations[2].fingerprint)
+
+    @log_response
+    def test_settings(self) -> None:
+        archive = Archive("db.zip", self.work_dir)
+        archive.set_shards(2, None, None)
+        with self.assertRaises(VaultBackupException):
+            archive.set_command(DUMP, None, None)
+        with self.assertRaises(VaultBackupException):
+            Archive("db.zip", self.work_dir).set_command(None, "cat lsn", None)
+        archive = self._archive()
+        self.assertEqual("db.dump", archive.member)
+        with self.assertRaises(VaultBackupException):
+            archive.add_destination("mirror", self.destination, False, 1, datetime(2020, 10, 20), None, "mirror")
@@ -0,0 +1,65 @@
+import os
+import random
+import unittest
+
+from core.compression import CompressionTuner
+from core.type import Archive
+from misc.utils import VaultBackupException
+from tests.utils import log_response, LOG
+
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self) -> None:
+        words = [bytes(random.Random(x).choices(b"abcdefghijklmnopqrstuvwxyz", k=8)) for x in range(500)]
+        self.text = b" ".join(random.Random(1).choices(words, k=40000))[:CompressionTuner.SAMPLE_SIZE]
+        self.random = os.urandom(CompressionTuner.SAMPLE_SIZE)
+
+    def _tuner(self, upload_throughput, data: bytes) -> CompressionTuner:
+        tuner = CompressionTuner(upload_throughput)
+        tuner.observe(data)
+        LOG.debug(f"Throughput {upload_throughput}: level {tuner.level}, " +
+                  ", ".join(f"{x.level}: {x.speed() / 1024 ** 2:.0f} MiB/s, ratio {x.ratio():.2f}" for x in tuner.stats.values()))
+        return tuner
+
+    @log_response
+    def test_slow_upload(self) -> None:
+        self.assertGreaterEqual(self._tuner(64 * 1024, self.text).level, 6)
+
+    @log_response
+    def test_fast_upload(self) -> None:
+        self.assertLessEqual(self._tuner(10 * 1024 ** 4, self.text).level, 1)
+
+    @log_response
+    def test_incompressible(self) -> None:
+        self.assertEqual(0, self._tuner(64 * 1024, self.random).level)
+
+    @log_response
+    def test_unknown_throughput(self) -> None:
+        self.assertEqual(6, self._tuner(None, self.text).level)
+
+    @log_response
+    def test_resample(self) -> None:
+        tuner = self._tuner(64 * 1024, self.random)
+        self.assertEqual(0, tuner.choose(1000 * 1024))
+        self.assertGreater(tuner.predicted_upload, 0)
+        # Not sampled again before SAMPLE_INTERVAL bytes
+        for _ in range(CompressionTuner.SAMPLE_INTERVAL // len(self.text) - 1):
+            tuner.observe(self.text)
+        self.assertEqual(0, tuner.level)
+        for _ in range(4):
+            tuner.sample(self.text)
+        self.assertGreaterEqual(tuner.level, 6)
+        self.assertEqual({0: 1}, tuner.used)
+        LOG.debug(tuner.report(1.0, 2.0))
+
+    @log_response
+    def test_archive_compression(self) -> None:
+        archive = Archive("test_archive.zip", ".")
+        archive.set_compression("AUTO")
+        self.assertEqual(Archive.AUTO_COMPRESSION, archive.compression)
+        archive.set_compression("9")
+        self.assertEqual(9, archive.compression)
+        archive.set_compression(None)
+        self.assertIsNone(archive.compression)
+        self.assertRaises(VaultBackupException, archive.set_compression, "10")
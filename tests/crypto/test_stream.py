@@ -0,0 +1,81 @@
+import io
+import os
+import unittest
+
+import pyzipper
+
+from core.crypto import EncryptedStreamWriter, EncryptedStreamReader, StreamHeader
+from misc.utils import VaultBackupException
+from tests.utils import log_response, LOG
+
+
+class _KeepOpen(io.BytesIO):
+    def close(self) -> None:
+        pass
+
+
+class TestStreamEncryption(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.data = os.urandom(10000)
+        self.raw = _KeepOpen()
+        with EncryptedStreamWriter(self.raw, "test123", 1024) as writer:
+            writer.write(self.data[:3000])
+            writer.write(self.data[3000:])
+
+    @log_response
+    def test_round_trip(self) -> None:
+        reader = EncryptedStreamReader(io.BytesIO(self.raw.getvalue()), "test123")
+        self.assertEqual(len(self.data), reader.size)
+        self.assertEqual(self.data, reader.read())
+        LOG.debug(f"Plain: {len(self.data)} bytes, encrypted: {len(self.raw.getvalue())} bytes")
+        self.assertEqual(StreamHeader.SIZE + len(self.data) + 10 * StreamHeader.TAG_SIZE, len(self.raw.getvalue()))
+
+    @log_response
+    def test_random_access(self) -> None:
+        reader = EncryptedStreamReader(io.BytesIO(self.raw.getvalue()), "test123")
+        reader.seek(5000)
+        self.assertEqual(self.data[5000:7500], reader.read(2500))
+        reader.seek(-10, io.SEEK_END)
+        self.assertEqual(self.data[-10:], reader.read())
+        self.assertEqual(b"", reader.read(10))
+
+    @log_response
+    def test_empty_stream(self) -> None:
+        raw = _KeepOpen()
+        EncryptedStreamWriter(raw, "test123").close()
+        reader = EncryptedStreamReader(io.BytesIO(raw.getvalue()), "test123")
+        self.assertEqual(0, reader.size)
+        self.assertEqual(b"", reader.read())
+
+    @log_response
+    def test_wrong_password(self) -> None:
+        reader = EncryptedStreamReader(io.BytesIO(self.raw.getvalue()), "wrong")
+        self.assertRaises(VaultBackupException, reader.read, 10)
+
+    @log_response
+    def test_tampered_frame(self) -> None:
+        data = bytearray(self.raw.getvalue())
+        data[StreamHeader.SIZE + 2000] ^= 0x01
+        reader = EncryptedStreamReader(io.BytesIO(bytes(data)), "test123")
+        self.assertEqual(self.data[:1024], reader.read(1024))
+        self.assertRaises(VaultBackupException, reader.read, 1024)
+
+    @log_response
+    def test_truncated_stream(self) -> None:
+        frame_size = 1024 + StreamHeader.TAG_SIZE
+        data = self.raw.getvalue()[:StreamHeader.SIZE + 3 * frame_size]
+        reader = EncryptedStreamReader(io.BytesIO(data), "test123")
+        reader.seek(2 * 1024)
+        self.assertRaises(VaultBackupException, reader.read, 10)
+
+    @log_response
+    def test_zip_container(self) -> None:
+        raw = _KeepOpen()
+        with EncryptedStreamWriter(raw, "test123", 4096) as writer:
+            with pyzipper.AESZipFile(writer, 'w', compression=pyzipper.ZIP_DEFLATED) as zip_file:
+                zip_file.writestr("first.bin", self.data)
+                zip_file.writestr("second.txt", "second member")
+        with pyzipper.AESZipFile(EncryptedStreamReader(io.BytesIO(raw.getvalue()), "test123")) as zip_file:
+            self.assertEqual(b"second member", zip_file.read("second.txt"))
+            self.assertEqual(self.data, zip_file.read("first.bin"))
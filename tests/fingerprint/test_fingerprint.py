@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+
+from core.fingerprint import HashCache, tree_fingerprint
+from tests.utils import log_response, LOG
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp_dir.name, "root")
+        self.cache_path = os.path.join(self.tmp_dir.name, "cache", "hashes.json")
+        os.makedirs(os.path.join(self.root, "dir"))
+        self._write("file.txt", "content")
+        self._write("dir/other.txt", "other content")
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _write(self, rel_path: str, content: str) -> None:
+        with open(os.path.join(self.root, rel_path), 'w') as file:
+            file.write(content)
+
+    def _fingerprint(self) -> (str, HashCache):
+        cache = HashCache(self.cache_path)
+        fingerprint = tree_fingerprint(self.root, cache)
+        cache.save()
+        LOG.debug(f"Fingerprint: {fingerprint}, hashed: {cache.hashed}, reused: {cache.reused}")
+        return fingerprint, cache
+
+    @log_response
+    def test_cache(self) -> None:
+        fingerprint, cache = self._fingerprint()
+        self.assertEqual(2, cache.hashed)
+        same_fingerprint, cache = self._fingerprint()
+        self.assertEqual(fingerprint, same_fingerprint)
+        self.assertEqual(0, cache.hashed)
+        self.assertEqual(2, cache.reused)
+
+    @log_response
+    def test_metadata_change(self) -> None:
+        fingerprint, _ = self._fingerprint()
+        os.utime(os.path.join(self.root, "file.txt"), (1600000000, 1600000000))
+        os.chmod(os.path.join(self.root, "dir", "other.txt"), 0o600)
+        same_fingerprint, cache = self._fingerprint()
+        self.assertEqual(fingerprint, same_fingerprint)
+        self.assertEqual(1, cache.hashed)
+
+    @log_response
+    def test_content_change(self) -> None:
+        fingerprint, _ = self._fingerprint()
+        self._write("file.txt", "changed")
+        self.assertNotEqual(fingerprint, self._fingerprint()[0])
+
+    @log_response
+    def test_rename_and_new_dir(self) -> None:
+        fingerprint, _ = self._fingerprint()
+        os.rename(os.path.join(self.root, "file.txt"), os.path.join(self.root, "renamed.txt"))
+        renamed_fingerprint = self._fingerprint()[0]
+        self.assertNotEqual(fingerprint, renamed_fingerprint)
+        os.makedirs(os.path.join(self.root, "empty"))
+        self.assertNotEqual(renamed_fingerprint, self._fingerprint()[0])
+
+    @log_response
+    def test_corrupted_cache(self) -> None:
+        fingerprint, _ = self._fingerprint()
+        with open(self.cache_path, 'w') as file:
+            file.write("{not json")
+        same_fingerprint, cache = self._fingerprint()
+        self.assertEqual(fingerprint, same_fingerprint)
+        self.assertEqual(2, cache.hashed)
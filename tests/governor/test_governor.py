@@ -0,0 +1,63 @@
+import tempfile
+import time
+import unittest
+
+from core.governor import TokenBucket, ResourceGovernor
+from core.type import GovernorInfo
+from misc.utils import VaultBackupException
+from tests.utils import log_response, LOG
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    @log_response
+    def test_unlimited(self) -> None:
+        bucket = TokenBucket(None)
+        start = time.monotonic()
+        bucket.consume(10 ** 12)
+        self.assertLess(time.monotonic() - start, 0.1)
+
+    @log_response
+    def test_rate(self) -> None:
+        bucket = TokenBucket(100000)
+        start = time.monotonic()
+        bucket.consume(100000)
+        self.assertLess(time.monotonic() - start, 0.1)
+        bucket.consume(30000)
+        elapsed = time.monotonic() - start
+        LOG.debug(f"Elapsed: {elapsed:.3f}s")
+        self.assertGreaterEqual(elapsed, 0.25)
+
+    @log_response
+    def test_factor(self) -> None:
+        bucket = TokenBucket(100000, 0)
+        bucket.factor = 0.5
+        start = time.monotonic()
+        bucket.consume(10000)
+        self.assertGreaterEqual(time.monotonic() - start, 0.18)
+
+
+class TestResourceGovernor(unittest.TestCase):
+
+    @log_response
+    def test_defaults(self) -> None:
+        governor = ResourceGovernor()
+        self.assertIsNone(governor.upload_throttle("Test"))
+        self.assertIsNone(governor.upload_progress("Test"))
+        with tempfile.TemporaryFile() as file:
+            file.write(b"data")
+            governor.release(file.fileno())
+
+    @log_response
+    def test_upload_progress(self) -> None:
+        governor = ResourceGovernor(GovernorInfo(upload_rate=100000))
+        progress = governor.upload_progress("Test")
+        start = time.monotonic()
+        progress(b"file", 130000, 60000)
+        progress(b"file", 130000, 130000)
+        self.assertGreaterEqual(time.monotonic() - start, 0.25)
+
+    @log_response
+    def test_wrong_info(self) -> None:
+        self.assertRaises(VaultBackupException, GovernorInfo, 0)
+        self.assertRaises(VaultBackupException, GovernorInfo, None, None, None, "lowest")
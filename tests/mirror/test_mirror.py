@@ -0,0 +1,98 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+from core.backup import BackupExecutor
+from core.mirror import Mirror
+from core.type import Archive, ArchiveDestination
+from misc.utils import VaultBackupException
+from tests.utils import log_response, LOG
+
+
+class TestMirror(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp_dir.name, "source")
+        self.path = os.path.join(self.tmp_dir.name, "mirror")
+        os.makedirs(os.path.join(self.source, "sub", "empty"))
+        self.content = {"a.txt": b"a" * 1000, os.path.join("sub", "b.bin"): os.urandom(5000), os.path.join("sub", "c.txt"): b"c"}
+        for rel_path, content in self.content.items():
+            self._write(rel_path, content)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _write(self, rel_path: str, content: bytes) -> None:
+        with open(os.path.join(self.source, rel_path), 'wb') as file:
+            file.write(content)
+
+    @log_response
+    def test_link_unchanged(self) -> None:
+        Mirror(self.path, "data_").backup(self.source, "data_20210101_000000")
+        self.content["a.txt"] = b"changed"
+        self._write("a.txt", self.content["a.txt"])
+        mirror = Mirror(self.path, "data_")
+        mirror.backup(self.source, "data_20210102_000000")
+        LOG.debug(f"Linked: {mirror.linked}, copied: {mirror.copied}")
+        self.assertEqual((2, 1, 7), (mirror.linked, mirror.copied, mirror.copied_bytes))
+        self.assertEqual(["data_20210101_000000", "data_20210102_000000"], mirror.snapshots())
+        old, new = os.path.join(self.path, "data_20210101_000000"), os.path.join(self.path, "data_20210102_000000")
+        self.assertTrue(os.path.samefile(os.path.join(old, "sub", "b.bin"), os.path.join(new, "sub", "b.bin")))
+        self.assertFalse(os.path.samefile(os.path.join(old, "a.txt"), os.path.join(new, "a.txt")))
+        self.assertTrue(os.path.isdir(os.path.join(new, "sub", "empty")))
+        for rel_path, content in self.content.items():
+            with open(os.path.join(new, rel_path), 'rb') as file:
+                self.assertEqual(content, file.read())
+
+    @log_response
+    def test_compress_encrypt(self) -> None:
+        mirror = Mirror(self.path, "data_", "secret", compress=True, encrypt=True)
+        mirror.backup(self.source, "data_20210101_000000")
+        stored = os.path.join(self.path, "data_20210101_000000", "a.txt.gz.enc")
+        with open(stored, 'rb') as file:
+            self.assertNotIn(b"aaaa", file.read())
+        reader = Mirror(self.path, "data_", "secret")
+        for rel_path, content in self.content.items():
+            with reader.open("data_20210101_000000", rel_path) as file:
+                self.assertEqual(content, file.read())
+        with self.assertRaises(VaultBackupException):
+            Mirror(self.path, "data_", "wrong")
+
+        # Changing the options copies the files again instead of linking them
+        mirror = Mirror(self.path, "data_", "secret", compress=True)
+        mirror.backup(self.source, "data_20210102_000000")
+        self.assertEqual((0, 3), (mirror.linked, mirror.copied))
+
+    @log_response
+    def test_prune(self) -> None:
+        mirror = Mirror(self.path, "data_")
+        for day in range(1, 4):
+            mirror.backup(self.source, f"data_2021010{day}_000000")
+        os.makedirs(os.path.join(self.path, "data_20210104_000000.part"))
+        os.makedirs(os.path.join(self.path, "data_20210105_000000"))
+        self.assertEqual(["data_20210101_000000"], mirror.prune(2))
+        self.assertEqual(["data_20210102_000000", "data_20210102_000000.manifest.json", "data_20210103_000000", "data_20210103_000000.manifest.json"],
+                         sorted(os.listdir(self.path)))
+
+    @log_response
+    def test_executor(self) -> None:
+        self.addCleanup(setattr, Archive, "dir_path", Archive.dir_path)
+        Archive.dir_path = self.tmp_dir.name
+        archive = Archive("data.zip", self.source)
+        archive.add_destination("mirror", os.path.join(self.tmp_dir.name, "dst_mirror"), False, 1, datetime(2020, 10, 20), dst_type="mirror")
+        archive.add_destination("zip", os.path.join(self.tmp_dir.name, "dst_zip"), False, 1, datetime(2020, 10, 20))
+        os.makedirs(os.path.join(self.tmp_dir.name, "dst_zip"))
+        BackupExecutor(True, False, None).execute([archive])
+        mirror = Mirror(archive.get_mirror_path(archive.destinations[0]), archive.get_version_prefix())
+        self.assertEqual(1, len(mirror.snapshots()))
+        self.assertEqual(len(self.content), len(mirror.read_manifest(mirror.snapshots()[0])["files"]))
+        self.assertEqual(1, len([x for x in os.listdir(os.path.join(self.tmp_dir.name, "dst_zip")) if x.endswith(".zip")]))
+        self.assertEqual(["data.mirror"], os.listdir(os.path.join(self.tmp_dir.name, "dst_mirror")))
+
+    @log_response
+    def test_remote_mirror(self) -> None:
+        dst = ArchiveDestination("remote", "/remote", True, 1, datetime(2020, 10, 20))
+        with self.assertRaises(VaultBackupException):
+            dst.set_type("mirror")
@@ -0,0 +1,65 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from core.progress import ProgressReporter, scan_totals
+from core.type import ProgressInfo
+from misc.utils import VaultBackupException
+from tests.utils import log_response, LOG
+
+
+class TestProgress(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.status_file = os.path.join(self.tmp_dir.name, "status.json")
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    @log_response
+    def test_counters(self) -> None:
+        progress = ProgressReporter(ProgressInfo(3600))
+        progress.start("archive", 4, 4000)
+        for index in range(4):
+            progress.update(f"file{index}", 500)
+            progress.add_bytes(500)
+        self.assertEqual(4, progress.files)
+        self.assertEqual(4000, progress.bytes)
+        self.assertEqual("file3", progress.current)
+        self.assertEqual(0, progress.eta())
+        progress.start("repository")
+        self.assertEqual(0, progress.files)
+        self.assertIsNone(progress.eta())
+
+    @log_response
+    def test_status_file(self) -> None:
+        progress = ProgressReporter(ProgressInfo(0.05, self.status_file))
+        progress.start("archive", 10, 10000)
+        progress.update("first", 1000)
+        self.assertFalse(os.path.exists(self.status_file))
+        time.sleep(0.06)
+        progress.update("second", 1000)
+        with open(self.status_file, 'r') as status_file:
+            status = json.loads(status_file.read())
+        LOG.debug(f"Status: {status}")
+        self.assertEqual("archive", status["phase"])
+        self.assertEqual(2, status["files"])
+        self.assertEqual("second", status["current"])
+        self.assertGreater(status["eta"], 0)
+
+    @log_response
+    def test_scan_totals(self) -> None:
+        os.makedirs(os.path.join(self.tmp_dir.name, "src", "dir"))
+        for rel_path, size in [("a", 10), ("dir/b", 20)]:
+            with open(os.path.join(self.tmp_dir.name, "src", rel_path), 'wb') as file:
+                file.write(b"x" * size)
+        self.assertEqual((2, 30), scan_totals(os.path.join(self.tmp_dir.name, "src")))
+
+    @log_response
+    def test_info(self) -> None:
+        self.assertRaises(VaultBackupException, ProgressInfo, 0)
+        self.assertRaises(VaultBackupException, ProgressInfo, None, None, -1)
+        self.assertEqual(0, ProgressInfo().trace_sample)
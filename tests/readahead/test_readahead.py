@@ -0,0 +1,97 @@
+import os
+import random
+import tempfile
+import unittest
+from datetime import datetime
+
+import pyzipper
+
+from core.backup import BackupExecutor
+from core.readahead import ReadAhead, ReadOrder
+from core.scanner import ParallelScanner
+from core.type import Archive
+from tests.utils import log_response, LOG
+
+
+def walk(root: str):
+    for path, directories, files in ParallelScanner().walk(root):
+        yield from ((x, True) for x in directories)
+        yield from ((x, False) for x in files)
+
+
+class TestReadAhead(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp_dir.name, "source")
+        # Written in a random order, so the inode and extent orders differ from the name order of the walk
+        names = [os.path.join(f"dir{x % 4}", f"file{x:03d}.bin") for x in range(64)]
+        random.Random(7).shuffle(names)
+        self.content = {}
+        for index, name in enumerate(names):
+            os.makedirs(os.path.join(self.root, os.path.dirname(name)), exist_ok=True)
+            self.content[name] = os.urandom(4096 + index)
+            with open(os.path.join(self.root, name), 'wb') as file:
+                file.write(self.content[name])
+                # Allocated on the disk, so the files have an extent
+                os.fsync(file.fileno())
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _read(self, order: str, batch_size: int = ReadAhead.DEFAULT_BATCH_SIZE, skip=None) -> (list, list):
+        sizes = []
+        with ReadAhead(walk(self.root), order, batch_size, skip, sizes.append) as reader:
+            entries = [(os.path.relpath(x.path, self.root), is_dir, data) for x, is_dir, data in reader]
+        LOG.debug(reader.report())
+        return entries, sizes
+
+    @log_response
+    def test_orders(self) -> None:
+        expected = [(os.path.relpath(x.path, self.root), is_dir) for x, is_dir in walk(self.root)]
+        for order in ReadOrder.ORDERS:
+            entries, sizes = self._read(order)
+            # The entries are handed out in the order of the walk whatever the read order
+            self.assertEqual(expected, [x[:2] for x in entries])
+            self.assertEqual({k: v for k, v in self.content.items()}, {x[0]: x[2] for x in entries if not x[1]})
+            files = [x for x, is_dir in walk(self.root) if not is_dir]
+            read_order = [x.stat().st_size for x in sorted(files, key=lambda x: ReadOrder.key(order, x))]
+            self.assertEqual(read_order, sizes)
+        inode_order = [x.stat().st_size for x in sorted([x for x, is_dir in walk(self.root) if not is_dir], key=lambda x: x.inode())]
+        self.assertEqual(inode_order, self._read(ReadOrder.INODE)[1])
+
+    @log_response
+    def test_extent(self) -> None:
+        path = os.path.join(self.root, "dir0", "file000.bin")
+        offset = ReadOrder.physical_offset(path)
+        LOG.debug(f"Physical offset of '{path}': {offset}")
+        self.assertTrue(offset is None or offset > 0)
+        offsets = [ReadOrder.physical_offset(os.path.join(self.root, x)) for x in self.content]
+        LOG.debug(f"{len([x for x in offsets if x is not None])} of {len(offsets)} files have a known extent")
+        self.assertIsNone(ReadOrder.physical_offset(os.path.join(self.root, "missing")))
+
+    @log_response
+    def test_batches(self) -> None:
+        entries, sizes = self._read(ReadOrder.INODE, 4200, lambda x: x.name == "file001.bin")
+        by_name = {x[0]: x[2] for x in entries if not x[1]}
+        # Files larger than a batch and skipped files are read in place
+        self.assertIsNone(by_name[os.path.join("dir1", "file001.bin")])
+        self.assertEqual(len([x for x in self.content.values() if len(x) <= 4200]) - 1, len(sizes))
+        self.assertTrue(all(x is None or len(x) <= 4200 for x in by_name.values()))
+
+    @log_response
+    def test_archive(self) -> None:
+        self.addCleanup(setattr, Archive, "dir_path", Archive.dir_path)
+        Archive.dir_path = self.tmp_dir.name
+        listings = {}
+        for order in [None] + ReadOrder.ORDERS:
+            destination = os.path.join(self.tmp_dir.name, f"destination_{order}")
+            os.makedirs(destination)
+            archive = Archive("data.zip", self.root)
+            archive.set_read_order(order, 16 * 1024)
+            archive.add_destination("local", destination, False, 1, datetime(2020, 10, 20))
+            BackupExecutor(True, False, None).execute([archive])
+            with pyzipper.AESZipFile(os.path.join(destination, os.listdir(destination)[0]), 'r') as zip_file:
+                listings[order] = [(x.filename, zip_file.read(x) if not x.is_dir() else None) for x in zip_file.infolist()]
+        for order in ReadOrder.ORDERS:
+            self.assertEqual(listings[None], listings[order])
@@ -0,0 +1,94 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import unittest
+
+import pyzipper
+
+from core.reader import LargeFileReader
+from tests.utils import log_response, LOG
+
+
+class TestReader(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "sparse.img")
+        self.window = 4 * mmap.ALLOCATIONGRANULARITY
+        with open(self.path, 'wb') as file:
+            file.truncate(64 * self.window)
+            for offset in [1000, 20 * self.window + 17, 63 * self.window]:
+                file.seek(offset)
+                file.write(os.urandom(self.window // 2))
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _content(self) -> bytes:
+        with open(self.path, 'rb') as file:
+            return file.read()
+
+    @log_response
+    def test_content_and_hash(self) -> None:
+        reader = LargeFileReader(self.path, self.window)
+        content = b"".join(bytes(x) for x in reader)
+        LOG.debug(f"Data: {reader.data_bytes}, holes: {reader.hole_bytes}")
+        self.assertEqual(self._content(), content)
+        self.assertEqual(hashlib.sha256(content).hexdigest(), reader.hexdigest())
+        self.assertEqual(len(content), reader.data_bytes + reader.hole_bytes)
+
+    @log_response
+    def test_holes_skipped(self) -> None:
+        if not LargeFileReader.is_sparse(os.stat(self.path)):
+            self.skipTest("The filesystem does not support sparse files")
+        read = []
+        reader = LargeFileReader(self.path, self.window, None, read.append)
+        for view in reader:
+            self.assertLessEqual(len(view), self.window)
+        self.assertGreater(reader.hole_bytes, 0)
+        self.assertEqual(reader.data_bytes, sum(read))
+        self.assertLess(reader.data_bytes, os.path.getsize(self.path) // 2)
+
+    @log_response
+    def test_truncated_while_read(self) -> None:
+        path = os.path.join(self.tmp_dir.name, "live.db")
+        content = os.urandom(8 * self.window)
+        with open(path, 'wb') as file:
+            file.write(content)
+        reader = LargeFileReader(path, self.window)
+        read = b""
+        for view in reader:
+            if len(read) == 0:
+                # Truncated after the first window was handed out and before it is consumed
+                os.truncate(path, 100)
+            read += bytes(view)
+        LOG.debug(f"Read {len(read)} of {len(content)} bytes")
+        self.assertEqual(content[:self.window], read)
+        self.assertEqual(len(read), reader.data_bytes)
+
+    @log_response
+    def test_segments(self) -> None:
+        reader = LargeFileReader(self.path, self.window)
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            segments = reader.segments(fd, os.path.getsize(self.path))
+        finally:
+            os.close(fd)
+        LOG.debug(f"Segments: {segments}")
+        self.assertEqual(0, segments[0][0])
+        self.assertEqual(os.path.getsize(self.path), sum(x[1] for x in segments))
+        for previous, current in zip(segments, segments[1:]):
+            self.assertEqual(previous[0] + previous[1], current[0])
+
+    @log_response
+    def test_zip_member(self) -> None:
+        archive_path = os.path.join(self.tmp_dir.name, "archive.zip")
+        with pyzipper.AESZipFile(archive_path, 'w', compression=pyzipper.ZIP_DEFLATED) as zip_file:
+            zinfo = zip_file.zipinfo_cls.from_file(self.path, "sparse.img")
+            zinfo.compress_type = pyzipper.ZIP_DEFLATED
+            with zip_file.open(zinfo, 'w') as dst:
+                for view in LargeFileReader(self.path, self.window):
+                    dst.write(view)
+        with pyzipper.AESZipFile(archive_path) as zip_file:
+            self.assertEqual(self._content(), zip_file.read("sparse.img"))
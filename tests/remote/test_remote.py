@@ -0,0 +1,129 @@
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime
+from typing import Iterator
+
+from core.command import CommandReader
+from core.prefetch import Prefetcher
+from core.remote import RemoteScanner
+from core.type import Archive
+from misc.utils import VaultBackupException
+from tests.utils import log_response, LOG
+
+
+def local_stream(command: str) -> Iterator[bytes]:
+    """Runs the command of the scanner on this host, as the SSH connection would on the remote one"""
+    with CommandReader(command) as reader:
+        yield from reader
+
+
+class SlowReader(io.BytesIO):
+    """In-memory file with the latency of a network round-trip per read, that counts the chunks it handed out and the
+    reads in flight"""
+
+    def __init__(self, data: bytes, counter: dict, latency: float):
+        super().__init__(data)
+        self.counter = counter
+        self.latency = latency
+
+    def read(self, size: int = -1) -> bytes:
+        with self.counter["lock"]:
+            self.counter["reading"] += 1
+            self.counter["peak_reads"] = max(self.counter["peak_reads"], self.counter["reading"])
+        time.sleep(self.latency)
+        data = super().read(size)
+        with self.counter["lock"]:
+            self.counter["reading"] -= 1
+            if len(data) > 0:
+                self.counter["buffered"] += 1
+                self.counter["peak"] = max(self.counter["peak"], self.counter["buffered"])
+        return data
+
+
+class TestRemote(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.items = {f"file{x}": os.urandom(x * 1000 + 1) for x in range(24)}
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _pull(self, workers: int, latency: float = 0.01, failing: str = None) -> (dict, dict, float):
+        counter = {"lock": threading.Lock(), "buffered": 0, "peak": 0, "reading": 0, "peak_reads": 0}
+
+        def opener(name: str) -> io.BytesIO:
+            if name == failing:
+                raise IOError(f"No such file: {name}")
+            return SlowReader(self.items[name], counter, latency)
+
+        content = {}
+        start = time.perf_counter()
+        with Prefetcher(list(self.items), [opener] * workers, chunk_size=4096, max_chunks=2) as prefetcher:
+            for name, chunks in prefetcher:
+                content[name] = b""
+                for data in chunks:
+                    content[name] += data
+                    with counter["lock"]:
+                        counter["buffered"] -= 1
+        return content, counter, time.perf_counter() - start
+
+    @log_response
+    def test_scan(self) -> None:
+        root = os.path.join(self.tmp_dir.name, "source")
+        os.makedirs(os.path.join(root, "b", "c"))
+        os.makedirs(os.path.join(root, "a"))
+        for path in ["z.txt", os.path.join("b", "c", "tab\tand\nnewline"), os.path.join("a", "data.bin")]:
+            with open(os.path.join(root, path), 'wb') as file:
+                file.write(b"x" * len(path))
+        os.chmod(os.path.join(root, "z.txt"), 0o640)
+        os.symlink(os.path.join(root, "b"), os.path.join(root, "link"))
+        os.symlink(os.path.join(root, "missing"), os.path.join(root, "broken"))
+
+        entries = RemoteScanner(local_stream).scan(root)
+        LOG.debug(f"Entries: {[(x.path, x.is_dir, oct(x.mode), x.size) for x in entries]}")
+        self.assertEqual(["a", "a/data.bin", "b", "b/c", "b/c/tab\tand\nnewline", "link", "z.txt"], [x.path for x in entries])
+        self.assertEqual([True, False, True, True, False, True, False], [x.is_dir for x in entries])
+        self.assertEqual(0o640, entries[-1].mode)
+        self.assertEqual(len(os.path.join("a", "data.bin")), entries[1].size)
+        self.assertAlmostEqual(os.stat(os.path.join(root, "z.txt")).st_mtime, entries[-1].mtime, places=3)
+
+        with self.assertRaises(VaultBackupException):
+            RemoteScanner(local_stream).scan(os.path.join(self.tmp_dir.name, "missing"))
+
+    @log_response
+    def test_prefetch(self) -> None:
+        content, serial_counter, serial = self._pull(1)
+        self.assertEqual(self.items, content)
+        content, counter, parallel = self._pull(4)
+        LOG.debug(f"1 worker: {serial:.2f}s, 4 workers: {parallel:.2f}s, peak of {counter['peak_reads']} reads in flight "
+                  f"and {counter['peak']} chunks buffered")
+        self.assertEqual(self.items, content)
+        self.assertEqual(list(self.items), list(content))
+        # The timings are only logged, the round-trips of the channels overlap whatever the load of the machine
+        self.assertEqual(1, serial_counter["peak_reads"])
+        self.assertGreater(counter["peak_reads"], 1)
+        self.assertLessEqual(counter["peak_reads"], 4)
+        # Every worker holds the chunks of its queue, plus the one it is putting, plus the one being consumed
+        self.assertLessEqual(counter["peak"], 4 * (2 + 1) + 1)
+
+    @log_response
+    def test_prefetch_error(self) -> None:
+        with self.assertRaises(IOError):
+            self._pull(4, 0.0, "file5")
+
+    @log_response
+    def test_settings(self) -> None:
+        archive = Archive("data.zip", "/srv/app")
+        archive.set_shards(2, None, None)
+        with self.assertRaises(VaultBackupException):
+            archive.set_remote(True, None)
+        archive = Archive("data.zip", "/srv/app")
+        archive.set_remote(True, 8)
+        self.assertEqual(8, archive.pull_channels)
+        with self.assertRaises(VaultBackupException):
+            archive.add_destination("mirror", self.tmp_dir.name, False, 1, datetime(2020, 10, 20), None, "mirror")
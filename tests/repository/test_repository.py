@@ -0,0 +1,148 @@
+import os
+import random
+import tempfile
+import unittest
+
+from core.repository import Chunker, Repository, RepositoryWriter
+from core.storage import LocalStorage
+from misc.utils import VaultBackupException
+from tests.utils import log_response, LOG
+
+
+class TestRepository(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp_dir.name, "source")
+        os.makedirs(os.path.join(self.source, "dir", "empty"))
+        self.data = random.Random(7).randbytes(300 * 1024)
+        self._write("dir/data.bin", self.data)
+        self._write("file.txt", b"content")
+        self.chunker = Chunker(4 * 1024, 16 * 1024, 64 * 1024)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _write(self, rel_path: str, content: bytes) -> None:
+        with open(os.path.join(self.source, rel_path), 'wb') as file:
+            file.write(content)
+
+    def _repository(self, name: str, password="secret") -> Repository:
+        return Repository(LocalStorage(os.path.join(self.tmp_dir.name, name)), password)
+
+    def _backup(self, snapshot: str, repositories: dict) -> RepositoryWriter:
+        writer = RepositoryWriter(repositories, self.chunker)
+        writer.backup(self.source, snapshot)
+        LOG.debug(f"Snapshot {snapshot}: {writer.stats}")
+        return writer
+
+    def _chunk_sizes(self, data: bytes) -> list:
+        sizes = []
+        while len(data) > 0:
+            sizes.append(self.chunker.cut(data))
+            data = data[sizes[-1]:]
+        return sizes
+
+    @log_response
+    def test_chunker_boundaries(self) -> None:
+        sizes = self._chunk_sizes(self.data)
+        self.assertEqual(len(self.data), sum(sizes))
+        self.assertTrue(all(4 * 1024 <= x <= 64 * 1024 for x in sizes[:-1]))
+        # An insertion near the start only changes the chunks around it
+        shifted = self._chunk_sizes(b"inserted" + self.data)
+        self.assertGreater(len(set(sizes) & set(shifted)), len(sizes) // 2)
+
+    @log_response
+    def test_chunker_reference(self) -> None:
+        # Byte by byte gear hash the vectorized search must agree with
+        def reference(data: bytes) -> int:
+            length = min(len(data), 64 * 1024)
+            hash_value = 0
+            for index in range(4 * 1024, length):
+                hash_value = ((hash_value << 1) + int(Chunker.GEAR[data[index]])) & 0xFFFFFFFFFFFFFFFF
+                if not hash_value & ((1 << 15) - 1 if index < 16 * 1024 else (1 << 13) - 1):
+                    return index + 1
+            return length
+        for data in [self.data, self.data[100 * 1024:], bytes(100 * 1024), self.data[:3 * 1024]]:
+            self.assertEqual(reference(data), self.chunker.cut(data))
+
+    @log_response
+    def test_backup_and_restore(self) -> None:
+        repository = self._repository("repo")
+        self._backup("data_20240101_000000", {"local": repository})
+        target = os.path.join(self.tmp_dir.name, "restored")
+        repository.restore("data_20240101_000000", target)
+        with open(os.path.join(target, "dir", "data.bin"), 'rb') as file:
+            self.assertEqual(self.data, file.read())
+        self.assertTrue(os.path.isdir(os.path.join(target, "dir", "empty")))
+        self.assertEqual(os.stat(os.path.join(self.source, "file.txt")).st_mtime_ns, os.stat(os.path.join(target, "file.txt")).st_mtime_ns)
+
+    @log_response
+    def test_restore_directory_metadata(self) -> None:
+        os.utime(os.path.join(self.source, "dir"), ns=(10 ** 18, 10 ** 18))
+        os.chmod(os.path.join(self.source, "dir"), 0o555)
+        repository = self._repository("repo")
+        self._backup("data_20240101_000000", {"local": repository})
+        target = os.path.join(self.tmp_dir.name, "restored")
+        repository.restore("data_20240101_000000", target)
+        # Set once its files are written, so the read-only directory has them and keeps its mtime
+        with open(os.path.join(target, "dir", "data.bin"), 'rb') as file:
+            self.assertEqual(self.data, file.read())
+        self.assertEqual(0o555, os.stat(os.path.join(target, "dir")).st_mode & 0o777)
+        self.assertEqual(10 ** 18, os.stat(os.path.join(target, "dir")).st_mtime_ns)
+
+    @log_response
+    def test_deduplication(self) -> None:
+        repository = self._repository("repo")
+        first = self._backup("data_20240101_000000", {"local": repository})
+        self._write("copy.bin", self.data)
+        second = self._backup("data_20240102_000000", {"local": repository})
+        self.assertEqual(0, second.stats["local"]["new_chunks"])
+        # Unchanged files are taken from the previous snapshot without being read
+        self.assertEqual(2, second.stats["local"]["reused_files"])
+        self.assertEqual(len(self.data), second.read_bytes)
+        self.assertGreater(first.stats["local"]["new_chunks"], 0)
+
+    @log_response
+    def test_multiple_repositories(self) -> None:
+        repositories = {"first": self._repository("first"), "second": self._repository("second", None)}
+        writer = self._backup("data_20240101_000000", repositories)
+        self.assertEqual(len(self.data) + len(b"content"), writer.read_bytes)
+        self.assertEqual(writer.stats["first"]["new_chunks"], writer.stats["second"]["new_chunks"])
+        # Chunk ids are keyed per repository
+        self.assertFalse(repositories["first"].known_chunks() & repositories["second"].known_chunks())
+
+    @log_response
+    def test_prune(self) -> None:
+        repository = self._repository("repo")
+        self._backup("data_20240101_000000", {"local": repository})
+        self._write("dir/data.bin", self.data[::-1])
+        self._backup("data_20240102_000000", {"local": repository})
+        removed, chunks = repository.prune(1)
+        self.assertEqual(["data_20240101_000000"], removed)
+        self.assertGreater(chunks, 0)
+        target = os.path.join(self.tmp_dir.name, "restored")
+        repository.restore("data_20240102_000000", target)
+        with open(os.path.join(target, "dir", "data.bin"), 'rb') as file:
+            self.assertEqual(self.data[::-1], file.read())
+
+    @log_response
+    def test_password(self) -> None:
+        self._backup("data_20240101_000000", {"local": self._repository("repo")})
+        self.assertRaises(VaultBackupException, self._repository, "repo", "wrong")
+        self.assertRaises(VaultBackupException, self._repository, "repo", None)
+        with open(os.path.join(self.tmp_dir.name, "repo", "snapshots", "data_20240101_000000"), 'rb') as file:
+            self.assertNotIn(b"data.bin", file.read())
+
+    @log_response
+    def test_corrupted_chunk(self) -> None:
+        repository = self._repository("repo", None)
+        self._backup("data_20240101_000000", {"local": repository})
+        chunk_id = sorted(repository.known_chunks())[0]
+        path = os.path.join(self.tmp_dir.name, "repo", "chunks", chunk_id[:2], chunk_id)
+        with open(path, 'r+b') as file:
+            file.seek(-1, os.SEEK_END)
+            last = file.read(1)
+            file.seek(-1, os.SEEK_END)
+            file.write(bytes([last[0] ^ 0xFF]))
+        self.assertRaises(VaultBackupException, repository.get_chunk, chunk_id)
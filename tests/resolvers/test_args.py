@@ -43,6 +43,11 @@ class TestArgResolver(unittest.TestCase):
         self.assertIsNone(args.password)
         self.assertEqual(password_encrypt("test"), args.password_ssh)
 
+        sys_mock.argv = ["/dummy/path", "-Dpassword_s3=enc(test)"]
+        args = ArgsResolver()
+        self.assertIsNone(args.password_ssh)
+        self.assertEqual(password_encrypt("test"), args.password_s3)
+
         sys_mock.argv = ["/dummy/path", "-Dforce=yes", "-Dpassword=enc(test)", f"-Dpassword_ssh={password_encrypt('test1')}"]
         args = ArgsResolver()
         self.assertEqual(True, args.force)
@@ -0,0 +1,88 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from core.scanner import ParallelScanner
+from tests.utils import log_response, LOG
+
+
+class TestScanner(unittest.TestCase):
+    DELAY = 0.005
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+        self.listings = {"lock": threading.Lock(), "active": 0, "peak": 0}
+        for first in range(6):
+            for second in range(6):
+                path = os.path.join(self.root, f"dir{first}", f"sub{second}")
+                os.makedirs(path)
+                for index in range(4):
+                    with open(os.path.join(path, f"file{index}.txt"), 'w') as file:
+                        file.write(str(index))
+        os.symlink(os.path.join(self.root, "dir0"), os.path.join(self.root, "link"))
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _delayed_scandir(self, path: str):
+        """A filesystem where every directory listing is a network round-trip, that records the peak of listings in flight"""
+        with self.listings["lock"]:
+            self.listings["active"] += 1
+            self.listings["peak"] = max(self.listings["peak"], self.listings["active"])
+        try:
+            time.sleep(TestScanner.DELAY)
+            return os.scandir(path)
+        finally:
+            with self.listings["lock"]:
+                self.listings["active"] -= 1
+
+    @staticmethod
+    def _listing(scanner: ParallelScanner, root: str) -> list:
+        return [(path, [x.name for x in directories], [(x.name, x.stat().st_size) for x in files]) for path, directories, files in scanner.walk(root)]
+
+    def _benchmark(self, name: str, threads: int, scandir) -> (list, int):
+        self.listings["peak"] = 0
+        start = time.perf_counter()
+        listing = self._listing(ParallelScanner(threads, scandir=scandir), self.root)
+        seconds = time.perf_counter() - start
+        LOG.info(f"{name}, {threads} threads: {len(listing)} directories in {seconds * 1000:.1f} ms, "
+                 f"{self.listings['peak']} listings in flight")
+        return listing, self.listings["peak"]
+
+    @log_response
+    def test_same_as_walk(self) -> None:
+        listing = self._listing(ParallelScanner(4), self.root)
+        expected = [(path, sorted(directories), sorted((x, os.path.getsize(os.path.join(path, x))) for x in files))
+                    for path, directories, files in os.walk(self.root)]
+        self.assertEqual(sorted(expected), sorted(listing))
+        # Top-down and sorted, whatever the order the workers finished in
+        self.assertEqual([self.root, os.path.join(self.root, "dir0"), os.path.join(self.root, "dir0", "sub0")], [x[0] for x in listing[:3]])
+        self.assertEqual(listing, self._listing(ParallelScanner(8, max_pending=2), self.root))
+
+    @log_response
+    def test_benchmark(self) -> None:
+        local, _ = self._benchmark("Local", 1, os.scandir)
+        self.assertEqual(local, self._benchmark("Local", 8, os.scandir)[0])
+        delayed, sequential = self._benchmark("Delayed", 1, self._delayed_scandir)
+        parallel_listing, parallel = self._benchmark("Delayed", 8, self._delayed_scandir)
+        self.assertEqual(local, delayed)
+        self.assertEqual(local, parallel_listing)
+        # The timings are only logged, the round-trips are overlapped whatever the load of the machine
+        self.assertEqual(1, sequential)
+        self.assertGreater(parallel, 1)
+        self.assertLessEqual(parallel, 8)
+
+    @log_response
+    def test_stop_early(self) -> None:
+        scanner = ParallelScanner(4, scandir=self._delayed_scandir)
+        for path, _, _ in scanner.walk(self.root):
+            break
+        self.assertEqual([], [x.name for x in threading.enumerate() if x.name.startswith("scanner")])
+
+    @log_response
+    def test_unreadable(self) -> None:
+        listing = self._listing(ParallelScanner(2), os.path.join(self.root, "missing"))
+        self.assertEqual([(os.path.join(self.root, "missing"), [], [])], listing)
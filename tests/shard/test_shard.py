@@ -0,0 +1,101 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+import pyzipper
+
+from core.backup import BackupExecutor
+from core.shard import ShardSet
+from core.state import StateStore
+from core.type import Archive
+from misc.utils import VaultBackupException, password_encrypt
+from tests.utils import log_response, LOG
+
+
+class TestShard(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp_dir.name, "source")
+        self.destination = os.path.join(self.tmp_dir.name, "destination")
+        os.makedirs(os.path.join(self.source, "sub", "empty"))
+        os.makedirs(self.destination)
+        self.content = {}
+        for index, size in enumerate([900, 700, 500, 400, 300, 300, 200, 100, 50, 10]):
+            rel_path = f"file{index}.bin" if index % 3 else os.path.join("sub", f"file{index}.bin")
+            self.content[rel_path] = os.urandom(size * 100)
+            with open(os.path.join(self.source, rel_path), 'wb') as file:
+                file.write(self.content[rel_path])
+        self.addCleanup(setattr, Archive, "dir_path", Archive.dir_path)
+        Archive.dir_path = self.tmp_dir.name
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _archive(self, shard_host: str = None) -> Archive:
+        archive = Archive("data.zip", self.source)
+        archive.set_password(password_encrypt("secret"))
+        archive.set_shards(3, 2, shard_host)
+        archive.add_destination("local", self.destination, False, 1, datetime(2020, 10, 20))
+        return archive
+
+    def _extract(self, names: list) -> dict:
+        content = {}
+        for name in names:
+            with pyzipper.AESZipFile(os.path.join(self.destination, name), 'r') as zip_file:
+                zip_file.setpassword(b"secret")
+                content.update({x.filename: zip_file.read(x) for x in zip_file.infolist() if not x.is_dir()})
+        return content
+
+    @log_response
+    def test_partition(self) -> None:
+        shards = ShardSet(3).partition(self.source)
+        LOG.debug(f"Shards: {[(str(x), x.size) for x in shards]}")
+        files = [x[1] for shard in shards for x in shard.members if os.path.isfile(x[0])]
+        self.assertEqual(sorted(self.content.keys()), sorted(files))
+        sizes = [x.size for x in shards]
+        self.assertLessEqual(max(sizes) - min(sizes), max(len(x) for x in self.content.values()))
+        self.assertEqual(["sub", os.path.join("sub", "empty")], [x[1] for x in shards[0].members if os.path.isdir(x[0])])
+        self.assertEqual([x.members for x in shards], [x.members for x in ShardSet(3, 4).partition(self.source, 4)])
+        self.assertEqual(".s1of3", str(shards[0]))
+
+    @log_response
+    def test_sharded_backup(self) -> None:
+        state = StateStore(os.path.join(self.tmp_dir.name, "state.json"))
+        for day in [1, 2]:
+            archive = self._archive()
+            BackupExecutor(True, False, None, state=state, version_time=datetime(2021, 1, day)).execute([archive])
+        names = sorted(os.listdir(self.destination))
+        LOG.debug(f"Destination: {names}")
+        self.assertEqual(["data_20210102_000000.s1of3.zip", "data_20210102_000000.s2of3.zip", "data_20210102_000000.s3of3.zip",
+                          "data_20210102_000000.shards.json"], names)
+        self.assertEqual(self.content, self._extract(names[:3]))
+        self.assertEqual("data_20210102_000000.shards.json", state.get(archive, archive.destinations[0])["archive"])
+        self.assertEqual([], [x for x in os.listdir(self.tmp_dir.name) if x.startswith("data_")])
+
+    @log_response
+    def test_hosts(self) -> None:
+        for day in [1, 2]:
+            for host in ["1/2", "2/2"]:
+                BackupExecutor(True, False, None, version_time=datetime(2021, 1, day)).execute([self._archive(host)])
+                names = sorted(os.listdir(self.destination))
+                LOG.debug(f"Day {day}, host {host}: {names}")
+                if day == 2 and host == "1/2":
+                    # The new set is incomplete, so the previous one is kept
+                    self.assertEqual(["data_20210101_000000", "data_20210102_000000"], sorted({x[:20] for x in names}))
+        self.assertEqual(["data_20210102_000000.h1of2.shards.json", "data_20210102_000000.h2of2.shards.json",
+                          "data_20210102_000000.s1of3.zip", "data_20210102_000000.s2of3.zip", "data_20210102_000000.s3of3.zip"], names)
+        self.assertEqual(self.content, self._extract([x for x in names if x.endswith(".zip")]))
+
+        with self.assertRaises(VaultBackupException):
+            BackupExecutor(True, False, None).execute([self._archive("1/2")])
+
+    @log_response
+    def test_settings(self) -> None:
+        archive = Archive("data.zip", self.source)
+        archive.set_volumes(1024, None)
+        with self.assertRaises(VaultBackupException):
+            archive.set_shards(2, None, None)
+        with self.assertRaises(VaultBackupException):
+            Archive("data.zip", self.source).set_shards(2, None, "3/2")
@@ -0,0 +1,116 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+
+import pyzipper
+
+from core.backup import BackupExecutor
+from core.checkpoint import ArchiveCheckpoint
+from core.staging import StagingArea, AdmissionController
+from core.type import Archive, StagingInfo
+from misc.utils import VaultBackupException
+from tests.utils import log_response, LOG
+
+
+def crash_while_staging(area: StagingArea, checkpoint_path: str) -> None:
+    """Stages an archive and dies without cleaning up, as a killed run would"""
+    area.lease("data_", 1024, checkpoint_path)
+    for name in ["data_20210101_000000.zip", "data_20210102_000000.zip.001", "data_20210102_000000.zip.sha256"]:
+        with open(os.path.join(area.path, name), 'wb') as file:
+            file.write(b"x" * 100)
+    os._exit(1)
+
+
+class TestStaging(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.paths = [os.path.join(self.tmp_dir.name, x) for x in ["fast", "large"]]
+        for path in self.paths:
+            os.makedirs(path)
+        self.addCleanup(setattr, AdmissionController, "POLL_INTERVAL", AdmissionController.POLL_INTERVAL)
+        AdmissionController.POLL_INTERVAL = 0.05
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _areas(self, room: int) -> list:
+        """A first area with about `room` bytes left above its min free, and a second one with all its free space"""
+        fast = StagingArea(self.paths[0])
+        fast.min_free = fast.free() - room
+        return [fast, StagingArea(self.paths[1])]
+
+    @log_response
+    def test_admission(self) -> None:
+        controller = AdmissionController(self._areas(1024 * 1024))
+        with controller.admit("small_", 512 * 1024) as small, controller.admit("large_", 10 * 1024 * 1024) as large:
+            LOG.debug(f"Small archive staged in {small.area}, large one in {large.area}")
+            self.assertEqual(self.paths[0], small.area.path)
+            self.assertEqual(self.paths[1], large.area.path)
+        self.assertEqual(["admission.lock"], os.listdir(os.path.join(self.paths[0], StagingArea.LEASE_DIR)))
+
+        # A reservation takes the room of the area until it is released
+        controller = AdmissionController(self._areas(100 * 1024 * 1024))
+        with controller.admit("first_", 80 * 1024 * 1024) as first, controller.admit("second_", 80 * 1024 * 1024) as second:
+            self.assertEqual([self.paths[0], self.paths[1]], [first.area.path, second.area.path])
+
+        with self.assertRaises(VaultBackupException):
+            AdmissionController([StagingArea(self.paths[0])]).admit("huge_", 1024 ** 6)
+
+    @log_response
+    def test_wait(self) -> None:
+        controller = AdmissionController([StagingArea(self.paths[0])], max_archives=1)
+        admitted = []
+        with controller.admit("first_", 1024):
+            waiting = threading.Thread(target=lambda: admitted.append(controller.admit("second_", 1024)))
+            waiting.start()
+            waiting.join(0.3)
+            self.assertEqual([], admitted)
+        waiting.join(5)
+        self.assertEqual(1, len(admitted))
+        admitted[0].release()
+
+    @log_response
+    def test_crash_cleanup(self) -> None:
+        area = StagingArea(self.paths[0])
+        checkpoint = ArchiveCheckpoint(os.path.join(self.tmp_dir.name, "data.checkpoint"))
+        checkpoint.start(os.path.join(area.path, "data_20210101_000000.zip"), datetime(2021, 1, 1), "key")
+        with open(os.path.join(area.path, "other_20210101_000000.zip"), 'wb') as file:
+            file.write(b"not staged by the crashed run")
+        process = multiprocessing.get_context("fork").Process(target=crash_while_staging, args=(area, checkpoint.path))
+        process.start()
+        process.join()
+        self.assertEqual(1, process.exitcode)
+        self.assertEqual(1, len([x for x in os.listdir(os.path.join(area.path, StagingArea.LEASE_DIR)) if x.endswith(".lease")]))
+
+        AdmissionController([area]).cleanup()
+        LOG.debug(f"Staging area after cleanup: {sorted(os.listdir(area.path))}")
+        self.assertEqual([".staging", "data_20210101_000000.zip", "other_20210101_000000.zip"], sorted(os.listdir(area.path)))
+        self.assertEqual(["admission.lock"], os.listdir(os.path.join(area.path, StagingArea.LEASE_DIR)))
+
+    @log_response
+    def test_staged_backup(self) -> None:
+        self.addCleanup(setattr, Archive, "dir_path", Archive.dir_path)
+        Archive.dir_path = os.path.join(self.tmp_dir.name, "code")
+        os.makedirs(Archive.dir_path)
+        source, destination = os.path.join(self.tmp_dir.name, "source"), os.path.join(self.tmp_dir.name, "destination")
+        os.makedirs(source)
+        os.makedirs(destination)
+        with open(os.path.join(source, "file.bin"), 'wb') as file:
+            file.write(os.urandom(4096))
+        archive = Archive("data.zip", source)
+        archive.add_destination("local", destination, False, 1, datetime(2020, 10, 20))
+
+        staging = StagingInfo([self.paths[1]], None, 1)
+        BackupExecutor(True, False, None, staging=staging).execute([archive])
+        LOG.debug(f"Staged in {archive.get_archive_path()}")
+        self.assertEqual(self.paths[1], os.path.dirname(archive.get_archive_path()))
+        self.assertEqual([os.path.basename(archive.get_archive_path())], os.listdir(destination))
+        with pyzipper.AESZipFile(os.path.join(destination, os.listdir(destination)[0]), 'r') as zip_file:
+            self.assertEqual(["file.bin"], zip_file.namelist())
+        self.assertEqual([".staging"], os.listdir(self.paths[1]))
+        self.assertEqual(["admission.lock"], os.listdir(os.path.join(self.paths[1], StagingArea.LEASE_DIR)))
+        self.assertEqual([], [x for x in os.listdir(Archive.dir_path) if x.endswith(".zip")])
@@ -0,0 +1,59 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+from core.state import StateStore
+from core.type import Archive
+from misc.utils import VaultBackupException
+from tests.utils import log_response, LOG
+
+
+class TestState(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "state", "state.json")
+        self.archive = Archive("test_archive.zip", self.tmp_dir.name)
+        self.archive.add_destination("local", os.path.join(self.tmp_dir.name, "dst"), False, 1, datetime(2020, 10, 20))
+        self.archive.add_destination("remote", os.path.join(self.tmp_dir.name, "dst"), True, 1, datetime(2020, 10, 20))
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    @log_response
+    def test_commit_and_restore(self) -> None:
+        state = StateStore(self.path)
+        local = self.archive.destinations[0]
+        local.last_run, local.fingerprint = datetime(2021, 1, 1), "abc"
+        state.commit(self.archive, local, "test_archive_20210101_000000.zip", checksum="123", throughput=1000.0)
+        with open(self.path, 'r') as state_file:
+            LOG.debug(f"State: {state_file.read()}")
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+
+        archive = Archive("test_archive.zip", self.tmp_dir.name)
+        archive.add_destination("local", os.path.join(self.tmp_dir.name, "dst"), False, 1, datetime(2020, 10, 20))
+        archive.add_destination("remote", os.path.join(self.tmp_dir.name, "dst"), True, 1, datetime(2020, 10, 20))
+        restored = StateStore(self.path)
+        restored.restore(archive)
+        self.assertEqual(datetime(2021, 1, 1), archive.destinations[0].last_run)
+        self.assertEqual("abc", archive.destinations[0].fingerprint)
+        self.assertEqual(datetime(2020, 10, 20), archive.destinations[1].last_run)
+        self.assertEqual("123", restored.get(archive, archive.destinations[0])["checksum"])
+        self.assertEqual({}, restored.get(archive, archive.destinations[1]))
+
+    @log_response
+    def test_newer_config(self) -> None:
+        state = StateStore(self.path)
+        state.commit(self.archive, self.archive.destinations[0])
+        self.archive.destinations[0].last_run = datetime(2022, 1, 1)
+        state.restore(self.archive)
+        self.assertEqual(datetime(2022, 1, 1), self.archive.destinations[0].last_run)
+
+    @log_response
+    def test_corrupted(self) -> None:
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as state_file:
+            state_file.write("{not json")
+        self.assertRaises(VaultBackupException, StateStore, self.path)
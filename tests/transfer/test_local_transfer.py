@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+
+from core.transfer import LocalTransfer, TransferStats
+from core.type import TransferInfo
+from tests.utils import log_response, LOG
+
+
+class TestLocalTransfer(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp_dir.name, "source.bin")
+        self.data = os.urandom(3 * 1024 * 1024 + 123)
+        with open(self.source, 'wb') as file:
+            file.write(self.data)
+        os.utime(self.source, (1600000000, 1600000000))
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _check_copy(self, info: TransferInfo, methods: list) -> None:
+        target = os.path.join(self.tmp_dir.name, "target")
+        os.makedirs(target, exist_ok=True)
+        stats = LocalTransfer(info).copy(self.source, target)
+        LOG.debug(f"Copy stats: {stats}")
+        with open(os.path.join(target, "source.bin"), 'rb') as file:
+            self.assertEqual(self.data, file.read())
+        self.assertEqual(1600000000, int(os.path.getmtime(os.path.join(target, "source.bin"))))
+        self.assertEqual(len(self.data), stats.size)
+        self.assertIn(stats.method, methods)
+
+    @log_response
+    def test_default_copy(self) -> None:
+        self._check_copy(TransferInfo(), ["reflink", "copy_file_range", "sendfile", "buffered"])
+
+    @log_response
+    def test_small_buffer(self) -> None:
+        self._check_copy(TransferInfo(1000, False, False), ["reflink", "copy_file_range", "sendfile", "buffered"])
+
+    @log_response
+    def test_direct_io(self) -> None:
+        self._check_copy(TransferInfo(1024 * 1024, True, True), ["direct", "buffered"])
+
+    @log_response
+    def test_stats(self) -> None:
+        stats = TransferStats("buffered", 10 * 1024 ** 2, 2.0, 0.5)
+        self.assertEqual(5 * 1024 ** 2, stats.throughput())
+        self.assertEqual(25, stats.cpu_usage())
+        self.assertTrue("5.0 MiB/s" in str(stats))
+        self.assertEqual(0, TransferStats("reflink", 0, 0, 0).throughput())
@@ -3,7 +3,7 @@ import binascii
 import unittest
 from datetime import datetime
 
-from misc.utils import password_decrypt, password_encrypt, convert, VaultBackupException, handle_password, handle_timestamp
+from misc.utils import password_decrypt, password_encrypt, convert, VaultBackupException, handle_password, handle_timestamp, handle_size
 from tests.utils import log_response, LOG
 
 
@@ -138,3 +138,16 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(datetime(2020, 10, 20), handle_timestamp("2020-10-20"))
         self.assertEqual(datetime(1900, 1, 1), handle_timestamp(None))
         self.assertRaises(ValueError, handle_timestamp, "2020-10-20 00:00:")
+
+    @log_response
+    def test_handle_size(self) -> None:
+        self.assertEqual(1024, handle_size(1024))
+        self.assertEqual(1024, handle_size("1024"))
+        self.assertEqual(512 * 1024, handle_size("512K"))
+        self.assertEqual(100 * 1024 ** 2, handle_size("100M"))
+        self.assertEqual(100 * 1024 ** 2, handle_size("100 MB"))
+        self.assertEqual(int(1.5 * 1024 ** 3), handle_size("1.5g"))
+        self.assertEqual(2 * 1024 ** 4, handle_size("2TiB"))
+        self.assertEqual(None, handle_size(None))
+        self.assertRaises(VaultBackupException, handle_size, "-1M")
+        self.assertRaises(VaultBackupException, handle_size, "10X")
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+from core.backup import BackupExecutor
+from core.state import StateStore
+from core.type import Archive
+from core.verify import VersionVerifier
+from misc.utils import password_encrypt
+from tests.utils import log_response, LOG
+
+
+class TestVerify(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp_dir.name, "source")
+        os.makedirs(os.path.join(self.source, "sub"))
+        for index in range(20):
+            with open(os.path.join(self.source, "sub" if index % 2 else "", f"file{index}.bin"), 'wb') as file:
+                file.write(os.urandom(64 * 1024))
+        self.addCleanup(setattr, Archive, "dir_path", Archive.dir_path)
+        Archive.dir_path = self.tmp_dir.name
+        self.state = StateStore(os.path.join(self.tmp_dir.name, "state.json"))
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _backup(self, name: str, encryption: str = None, volume_size: int = None) -> Archive:
+        archive = Archive(f"{name}.zip", self.source)
+        archive.set_password(password_encrypt("secret"))
+        archive.set_encryption(encryption)
+        archive.set_volumes(volume_size, None)
+        destination = os.path.join(self.tmp_dir.name, f"dst_{name}")
+        os.makedirs(destination)
+        archive.add_destination("local", destination, False, 2, datetime(2020, 10, 20))
+        BackupExecutor(True, False, None, state=self.state).execute([archive])
+        return archive
+
+    def _verification(self, archive: Archive) -> dict:
+        return self.state.get(archive, archive.destinations[0])["verification"]
+
+    @log_response
+    def test_sampled(self) -> None:
+        archives = [self._backup("plain"), self._backup("stream", "stream"), self._backup("volumes", volume_size=300 * 1024)]
+        self.assertTrue(BackupExecutor(True, False, None, state=self.state).verify(archives, 2))
+        for archive in archives:
+            results = self._verification(archive)
+            LOG.debug(f"{archive.name}: {results}")
+            self.assertEqual(1, len(results))
+            result = list(results.values())[0]
+            self.assertTrue(result["ok"])
+            self.assertEqual((20, 2), (result["members"], result["sampled"]))
+            if archive.encryption != Archive.STREAM_ENCRYPTION:
+                # A stream is read by whole frames of 1 MiB, as large as this archive
+                self.assertLess(result["bytes_read"], result["size"] / 3)
+
+    @log_response
+    def test_corrupted(self) -> None:
+        archive = self._backup("corrupted")
+        path = os.path.join(self.tmp_dir.name, "dst_corrupted", os.listdir(os.path.join(self.tmp_dir.name, "dst_corrupted"))[0])
+        with open(path, 'r+b') as file:
+            file.seek(os.path.getsize(path) // 2)
+            data = file.read(1)
+            file.seek(-1, os.SEEK_CUR)
+            file.write(bytes([data[0] ^ 0xFF]))
+        executor = BackupExecutor(True, False, None, state=self.state)
+        self.assertTrue(executor.verify([archive], 0))
+        self.assertFalse(executor.verify([archive], 20))
+        result = list(self._verification(archive).values())[0]
+        LOG.debug(f"Result: {result}")
+        self.assertFalse(result["ok"])
+        self.assertIsNotNone(result["error"])
+
+    @log_response
+    def test_versions(self) -> None:
+        names = ["data_20210101_000000.zip", "data_20210102_000000.zip.enc", "data_20210103_000000.zip.002", "data_20210103_000000.zip.001",
+                 "data_20210103_000000.zip.sha256", "data_20210104_000000.zip.part", "other_20210101_000000.zip"]
+        self.assertEqual({"data_20210101_000000": ["data_20210101_000000.zip"], "data_20210102_000000": ["data_20210102_000000.zip.enc"],
+                          "data_20210103_000000": ["data_20210103_000000.zip.001", "data_20210103_000000.zip.002"]},
+                         VersionVerifier.versions("data_", names))
@@ -0,0 +1,80 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+from core.volume import VolumeWriter, TransferQueue
+from tests.utils import log_response, LOG
+
+
+class TestVolumeWriter(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.base_path = os.path.join(self.tmp_dir.name, "archive_20201010_000000.zip")
+        self.data = os.urandom(2500)
+        self.sealed = []
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    @log_response
+    def test_split(self) -> None:
+        with VolumeWriter(self.base_path, 1000, self.sealed.append) as writer:
+            writer.write(self.data[:700])
+            writer.write(self.data[700:])
+            self.assertEqual(2500, writer.tell())
+        LOG.debug(f"Volumes: {[str(x) for x in writer.volumes]}")
+        self.assertEqual([1000, 1000, 500], [x.size for x in writer.volumes])
+        self.assertEqual(writer.volumes, self.sealed)
+        data = b""
+        for volume in writer.volumes:
+            with open(VolumeWriter.volume_path(self.base_path, volume.index), 'rb') as file:
+                content = file.read()
+            self.assertEqual(hashlib.sha256(content).hexdigest(), volume.checksum)
+            data += content
+        self.assertEqual(self.data, data)
+
+    @log_response
+    def test_manifest(self) -> None:
+        with VolumeWriter(self.base_path, 1000) as writer:
+            writer.write(self.data)
+        with open(VolumeWriter.manifest_path(self.base_path), 'r') as manifest:
+            lines = manifest.read().splitlines()
+        self.assertEqual([f"{x.checksum}  {x}" for x in writer.volumes], lines)
+        self.assertEqual("archive_20201010_000000.zip.001", str(writer.volumes[0]))
+
+    @log_response
+    def test_exact_multiple_and_empty(self) -> None:
+        with VolumeWriter(self.base_path, 1250) as writer:
+            writer.write(self.data)
+        self.assertEqual([1250, 1250], [x.size for x in writer.volumes])
+
+        with VolumeWriter(self.base_path + ".empty", 1000) as writer:
+            pass
+        self.assertEqual([0], [x.size for x in writer.volumes])
+
+
+class TestTransferQueue(unittest.TestCase):
+
+    @log_response
+    def test_transfer(self) -> None:
+        done = []
+        queue = TransferQueue(2, done.append)
+        queue.submit("a")
+        queue.submit("b")
+        queue.submit("a")
+        queue.wait()
+        queue.close()
+        self.assertTrue(queue.is_submitted("a"))
+        self.assertEqual(["a", "b"], sorted(done))
+
+    @log_response
+    def test_error(self) -> None:
+        def fail(path: str) -> None:
+            raise IOError(f"Cannot transfer {path}")
+
+        queue = TransferQueue(2, fail)
+        queue.submit("a")
+        self.assertRaises(IOError, queue.wait)
+        queue.close()
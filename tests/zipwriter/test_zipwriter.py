@@ -0,0 +1,72 @@
+import os
+import tempfile
+import time
+import tracemalloc
+import unittest
+
+import pyzipper
+
+from core.zipwriter import StreamingZipFile
+from tests.utils import log_response, LOG
+
+
+class TestZipWriter(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "archive.zip")
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _write(self, zip_cls: type, entries: int, **kwargs) -> (int, float):
+        """Peak of the memory allocated while writing `entries` small members, and the seconds it took"""
+        tracemalloc.start()
+        start = time.perf_counter()
+        with zip_cls(self.path, 'w', **kwargs) as zip_file:
+            for index in range(entries):
+                zip_file.writestr(f"directory_{index // 1000:05d}/file_{index:08d}.txt", f"content {index}")
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak, seconds
+
+    @log_response
+    def test_flat_memory(self) -> None:
+        # Both spill more than the copy buffer of the central directory. Over 65535 members the count only fits in the
+        # ZIP64 end records
+        small, _ = self._write(StreamingZipFile, 20000, spill_dir=self.tmp_dir.name)
+        plain, plain_seconds = self._write(pyzipper.AESZipFile, 20000)
+        large, seconds = self._write(StreamingZipFile, 66000, spill_dir=self.tmp_dir.name)
+        LOG.debug(f"Peak memory: {small} bytes for 20000 members, {large} bytes for 66000 members ({seconds:.1f}s), "
+                  f"{plain} bytes for 20000 members without spilling ({plain_seconds:.1f}s)")
+        self.assertLess(large, small + 256 * 1024)
+        self.assertLess(small * 2, plain)
+
+        with open(self.path, 'rb') as file:
+            file.seek(-200, os.SEEK_END)
+            self.assertIn(b"PK\x06\x06", file.read())
+        with pyzipper.AESZipFile(self.path, 'r') as zip_file:
+            members = zip_file.infolist()
+            self.assertEqual(66000, len(members))
+            self.assertEqual("directory_00065/file_00065999.txt", members[-1].filename)
+            self.assertEqual(b"content 12345", zip_file.read("directory_00012/file_00012345.txt"))
+            self.assertIsNone(zip_file.testzip())
+
+    @log_response
+    def test_encrypted(self) -> None:
+        with StreamingZipFile(self.path, 'w', compression=pyzipper.ZIP_DEFLATED, spill_dir=self.tmp_dir.name) as zip_file:
+            zip_file.encryption = pyzipper.WZ_AES
+            zip_file.pwd = b"secret"
+            for index in range(100):
+                zip_file.writestr(f"file_{index}", os.urandom(index))
+                self.assertEqual(f"file_{index}", zip_file.filelist[-1].filename)
+            with self.assertRaises(IndexError):
+                _ = zip_file.filelist[0]
+            with self.assertRaises(TypeError):
+                list(zip_file.filelist)
+        with pyzipper.AESZipFile(self.path, 'r') as zip_file:
+            zip_file.setpassword(b"secret")
+            self.assertEqual([f"file_{x}" for x in range(100)], zip_file.namelist())
+            self.assertIsNone(zip_file.testzip())
+        self.assertEqual(["archive.zip"], os.listdir(self.tmp_dir.name))